@@ -0,0 +1,73 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Per-order signing cost, before and after :class:`emx.utils.Signer`.
+
+Run with ``python -m benchmarks.bench_signing``.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import timeit
+
+from emx.utils import Signer, body_to_string, get_timestamp
+
+
+API_KEY = "benchmark-key"
+API_SECRET = base64.b64encode(b"0123456789abcdef0123456789abcdef").decode()
+ORDER = {
+    "client_id": "ladder-1",
+    "contract_code": "BTCZ18",
+    "type": "limit",
+    "side": "buy",
+    "size": "1.0000",
+    "price": "6500.00",
+    "stop_price": "",
+    "peg_offset_value": "",
+    "reduce_only": False,
+    "post_only": True,
+}
+
+
+def legacy_sign_order(headers):
+    """What RestApi.create_new_order used to do for every order."""
+    timestamp = get_timestamp()
+    message = str(timestamp) + "POST" + "/v1/orders" + body_to_string(ORDER)
+    secret = base64.b64decode(API_SECRET)
+    signature = base64.encodebytes(hmac.new(secret, message.encode(),
+                                            digestmod=hashlib.sha256).digest())
+    headers['EMX-ACCESS-KEY'] = API_KEY
+    headers['EMX-ACCESS-SIG'] = signature.decode().strip()
+    headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
+    # requests serialized the body a second time with json=body
+    return headers, json.dumps(ORDER)
+
+
+def main(number=100000):
+    headers = {'content-type': 'application/json'}
+    signer = Signer(API_KEY, API_SECRET)
+
+    legacy = min(timeit.repeat(lambda: legacy_sign_order(headers), number=number, repeat=5))
+    signed = min(timeit.repeat(lambda: signer.headers("POST", "/v1/orders", ORDER), number=number, repeat=5))
+
+    print("legacy signing : {:.2f} us/order".format(legacy / number * 1e6))
+    print("Signer.headers : {:.2f} us/order".format(signed / number * 1e6))
+    print("speedup        : {:.2f}x".format(legacy / signed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" Local stand-in for the EMX REST and WebSocket APIs, for offline benchmarks.
+
+Only the standard library is used. The REST side answers the ``/v1/...`` routes
+used by :class:`emx.rest_api.RestApi`; the WebSocket side implements the
+subscribe / unsubscribe protocol of :class:`emx.ws_api.WebSocketApi` and streams
+synthetic ``ticker``, ``trade`` and ``level2`` messages at a configurable rate.
+Signatures are not verified.
+
+Run standalone with ``python -m benchmarks.mock_server``.
+"""
+
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+PUBLIC_CHANNELS = ("ticker", "trade", "level2")
+
+
+def iso_now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class MockExchange():
+    """ Shared state of the mock: contracts, orders and fills. """
+
+    def __init__(self, contracts=10, fills=1000):
+        self.contract_codes = ["C{:04d}".format(i) for i in range(contracts)]
+        self.orders = {}
+        self.fills = [self._fill(i) for i in range(fills, 0, -1)]
+        self.lock = threading.Lock()
+        self._order_ids = itertools.count(1)
+        self.listeners = []
+
+    def _fill(self, i):
+        return {"fill_id": "F{}".format(i), "order_id": "O{}".format(i), "client_id": "",
+                "contract_code": self.contract_codes[i % len(self.contract_codes)],
+                "side": "buy" if i % 2 else "sell", "size": "1.0000", "price": "100.00",
+                "fee": "0.01", "timestamp": iso_now()}
+
+    def contract(self, code):
+        return {"contract_code": code, "status": "active", "base_currency": "BTC",
+                "quote_currency": "USD", "minimum_price_increment": "0.01",
+                "minimum_size_increment": "0.0001", "expiration_time": "2030-01-01T00:00:00Z"}
+
+    def notify(self, msg):
+        for listener in list(self.listeners):
+            listener(msg)
+
+    def create_order(self, body):
+        with self.lock:
+            order = dict(body)
+            order["order_id"] = "O{}".format(next(self._order_ids))
+            order["status"] = "accepted"
+            self.orders[order["order_id"]] = order
+        self.notify({"channel": "orders", "type": "accepted", "contract_code": order.get("contract_code"),
+                     "data": dict(order, timestamp=iso_now())})
+        return order
+
+    def modify_order(self, order_id, body):
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return None
+            order.update(body)
+        self.notify({"channel": "orders", "type": "modified", "contract_code": order.get("contract_code"),
+                     "data": dict(order, timestamp=iso_now())})
+        return order
+
+    def cancel_order(self, order_id):
+        with self.lock:
+            order = self.orders.pop(order_id, None)
+        if order is not None:
+            self.notify({"channel": "orders", "type": "canceled", "contract_code": order.get("contract_code"),
+                         "data": dict(order, status="canceled", timestamp=iso_now())})
+        return order
+
+
+def _page(records, id_field, after, limit=100):
+    start = 0
+    if after:
+        ids = [record[id_field] for record in records]
+        start = ids.index(after) + 1 if after in ids else len(records)
+    return records[start:start + limit]
+
+
+class _RestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "EmxMock/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload):
+        out = json.dumps(payload).encode()
+        # Status line, headers and body in one write, so the client never waits
+        # on a delayed ACK between them
+        self.wfile.write(b"HTTP/1.1 %d OK\r\ncontent-type: application/json\r\n"
+                         b"content-length: %d\r\n\r\n" % (status, len(out)) + out)
+
+    def _handle(self):
+        length = int(self.headers.get("content-length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body = json.loads(raw) if raw else {}
+        mock = self.server.mock
+        if mock.latency or mock.jitter:
+            time.sleep(mock.latency + random.random() * mock.jitter)
+        path = self.path.split("?", 1)[0].rstrip("/")
+        status, payload = self.route(self.command, path.split("/")[2:], body, mock.exchange)
+        mock.requests += 1
+        self._reply(status, payload)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+    @staticmethod
+    def route(method, parts, body, exchange):
+        now = iso_now()
+        if parts[:1] == ["contracts"]:
+            if len(parts) == 1 or parts[1] == "active":
+                return 200, {"contracts": [exchange.contract(code) for code in exchange.contract_codes]}
+            code = parts[1]
+            what = parts[2] if len(parts) > 2 else None
+            if what is None:
+                return 200, exchange.contract(code)
+            if what == "quote":
+                return 200, {"contract_code": code, "bid": "99.99", "bid_size": "5", "ask": "100.01",
+                             "ask_size": "5", "timestamp": now}
+            if what == "book":
+                return 200, {"contract_code": code, "timestamp": now,
+                             "bids": [["{:.2f}".format(100 - i * 0.01), "1"] for i in range(1, 21)],
+                             "asks": [["{:.2f}".format(100 + i * 0.01), "1"] for i in range(1, 21)]}
+            if what == "summary":
+                return 200, {"contract_code": code, "volume_24h": "1000", "last_trade_price": "100.00",
+                             "timestamp": now}
+            if what == "funding":
+                return 200, {"contract_code": code, "funding_rate": "0.0001", "timestamp": now}
+        elif parts[:1] == ["accounts"]:
+            if len(parts) == 1:
+                return 200, {"accounts": [{"trader_id": "T{}".format(i), "alias": ""} for i in range(3)]}
+            return 200, {"initial_margin_required": "10.0", "maintenance_margin_required": "5.0",
+                         "unrealized_profit": "0.0", "net_liquidation_value": "1000.0",
+                         "available_funds": "990.0", "excess_liquidity": "995.0", "holds": "0.0"}
+        elif parts[:1] == ["positions"]:
+            return 200, {"positions": [{"trader_id": "T0", "contract_code": code, "quantity": "1",
+                                        "marking_price": "100.00", "marking_time": now,
+                                        "average_entry_price": "99.00", "cost": "99.00",
+                                        "day_closed_pl": "0", "open_pl": "1.00"}
+                                       for code in exchange.contract_codes[:3]]}
+        elif parts[:1] == ["fills"]:
+            return 200, {"fills": _page(exchange.fills, "fill_id", body.get("after"))}
+        elif parts[:1] == ["keys"]:
+            if method == "POST":
+                return 200, {"key": "mock-key", "secret": base64.b64encode(b"mock-secret").decode()}
+            if method == "DELETE":
+                return 200, {"key": parts[1], "message": "Key revoked."}
+            return 200, {"keys": [{"key": "mock-key"}]}
+        elif parts[:1] == ["orders"]:
+            if method == "POST":
+                order = exchange.create_order(body)
+                return 200, {"message": "New order request received.", "order": order, "timestamp": now}
+            if method == "PATCH":
+                exchange.modify_order(parts[1], body)
+                return 200, {"message": "Modify order request received.", "order_id": parts[1], "timestamp": now}
+            if method == "DELETE" and len(parts) > 1:
+                exchange.cancel_order(parts[1])
+                return 200, {"message": "Cancel order request received.", "order_id": parts[1], "timestamp": now}
+            if method == "DELETE":
+                for order_id in list(exchange.orders):
+                    exchange.cancel_order(order_id)
+                return 200, {"message": "Order cancellation request received.", "contract_code": "",
+                             "timestamp": now}
+            orders = sorted(exchange.orders.values(), key=lambda order: order["order_id"], reverse=True)
+            return 200, {"orders": _page(orders, "order_id", body.get("after"))}
+        return 404, {"message": "Unknown route"}
+
+
+def _recv_exact(conn, n):
+    data = b""
+    while len(data) < n:
+        chunk = conn.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def _read_frame(conn):
+    first, second = _recv_exact(conn, 2)
+    opcode = first & 0x0f
+    length = second & 0x7f
+    if length == 126:
+        length = struct.unpack(">H", _recv_exact(conn, 2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", _recv_exact(conn, 8))[0]
+    mask = _recv_exact(conn, 4) if second & 0x80 else None
+    payload = _recv_exact(conn, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def _frame(payload, opcode=0x1):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+class _WsConnection():
+
+    def __init__(self, conn, mock):
+        self.conn = conn
+        self.mock = mock
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.alive = True
+
+    def send(self, msg, opcode=0x1):
+        data = msg if isinstance(msg, bytes) else json.dumps(msg).encode()
+        with self.lock:
+            self.conn.sendall(_frame(data, opcode))
+
+    def subscriptions_msg(self):
+        return {"type": "subscriptions",
+                "channels": [{"name": name, "contract_codes": sorted(codes)}
+                             for name, codes in self.subscriptions.items()]}
+
+    def on_exchange_event(self, msg):
+        codes = self.subscriptions.get(msg["channel"])
+        if codes is not None and (not codes or msg.get("contract_code") in codes):
+            try:
+                self.send(msg)
+            except OSError:
+                self.alive = False
+
+    def serve(self):
+        self.mock.exchange.listeners.append(self.on_exchange_event)
+        try:
+            while self.alive:
+                opcode, payload = _read_frame(self.conn)
+                if opcode == 0x8:
+                    self.send(payload, 0x8)
+                    break
+                if opcode == 0x9:
+                    self.send(payload, 0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                msg = json.loads(payload)
+                channels = msg.get("channels", [])
+                if msg.get("type") == "subscribe":
+                    for channel in channels:
+                        self.subscriptions.setdefault(channel, set()).update(msg.get("contract_codes", []))
+                elif msg.get("type") == "unsubscribe":
+                    for channel in channels:
+                        self.subscriptions.pop(channel, None)
+                elif msg.get("type") == "request":
+                    self.mock.on_ws_request(self, msg)
+                    continue
+                self.send(self.subscriptions_msg())
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.alive = False
+            self.mock.exchange.listeners.remove(self.on_exchange_event)
+            self.conn.close()
+
+
+class MockEmxServer():
+    """ REST and WebSocket mock listening on localhost.
+
+    :param rest_port: port of the HTTP server (0 picks a free one)
+    :param ws_port: port of the WebSocket server (0 picks a free one)
+    :param latency: seconds added to every REST response
+    :param jitter: maximum random seconds added on top of latency
+    :param md_rate: market data messages per second sent to each connection,
+        spread over its public subscriptions (0 disables the feed)
+    :param contracts: number of synthetic contracts
+    """
+
+    def __init__(self, rest_port=0, ws_port=0, latency=0.0, jitter=0.0, md_rate=0, contracts=10):
+        self.latency = latency
+        self.jitter = jitter
+        self.md_rate = md_rate
+        self.exchange = MockExchange(contracts)
+        self.requests = 0
+        self._sequence = itertools.count(1)
+
+        self._http = ThreadingHTTPServer(("127.0.0.1", rest_port), _RestHandler)
+        self._http.daemon_threads = True
+        self._http.mock = self
+
+        self._ws_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._ws_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._ws_sock.bind(("127.0.0.1", ws_port))
+        self._ws_sock.listen(128)
+        self._ws_connections = []
+        self._running = False
+
+    @property
+    def rest_uri(self):
+        return "http://127.0.0.1:{}".format(self._http.server_address[1])
+
+    @property
+    def ws_uri(self):
+        return "ws://127.0.0.1:{}".format(self._ws_sock.getsockname()[1])
+
+    def start(self):
+        self._running = True
+        for target in (self._http.serve_forever, self._accept_loop, self._feed_loop):
+            threading.Thread(target=target, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._http.shutdown()
+        self._http.server_close()
+        self._ws_sock.close()
+        for connection in self._ws_connections:
+            connection.alive = False
+            try:
+                connection.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def on_ws_request(self, connection, msg):
+        """Order entry on the ``trading`` channel; acknowledgements are the
+        ``orders`` channel events of the exchange."""
+        data = dict(msg.get("data", {}))
+        action = msg.get("action")
+        if action == "create-order":
+            self.exchange.create_order(data)
+            return
+        order_id = data.pop("order_id", None)
+        if action == "modify-order" and self.exchange.modify_order(order_id, data) is not None:
+            return
+        if action == "cancel-order" and self.exchange.cancel_order(order_id) is not None:
+            return
+        connection.send({"type": "error", "order_id": order_id, "message": "Unknown order or action"})
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn, _ = self._ws_sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handshake, args=(conn,), daemon=True).start()
+
+    def _handshake(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                conn.close()
+                return
+            request += chunk
+        key = b""
+        for line in request.split(b"\r\n"):
+            if line.lower().startswith(b"sec-websocket-key:"):
+                key = line.split(b":", 1)[1].strip()
+        accept = base64.b64encode(hashlib.sha1(key + _WS_GUID).digest())
+        conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        connection = _WsConnection(conn, self)
+        self._ws_connections.append(connection)
+        connection.serve()
+        self._ws_connections.remove(connection)
+
+    def market_data_msg(self, channel, contract_code):
+        now = iso_now()
+        price = 100 + random.randint(-50, 50) / 100.0
+        if channel == "ticker":
+            data = {"bid": "{:.2f}".format(price - 0.01), "ask": "{:.2f}".format(price + 0.01),
+                    "last_trade_price": "{:.2f}".format(price), "mark_price": "{:.2f}".format(price),
+                    "timestamp": now}
+        elif channel == "trade":
+            data = {"price": "{:.2f}".format(price), "size": "1",
+                    "side": random.choice(("buy", "sell")), "timestamp": now}
+        else:
+            side = random.choice(("buy", "sell"))
+            data = {"changes": [[side, "{:.2f}".format(price), str(random.randint(0, 5))]],
+                    "sequence": next(self._sequence), "timestamp": now}
+        return {"channel": channel, "type": "update", "contract_code": contract_code, "data": data}
+
+    def _feed_loop(self):
+        # Sends in small batches so that high rates do not depend on sleep resolution
+        batch_interval = 0.005
+        while self._running:
+            if not self.md_rate:
+                time.sleep(0.05)
+                continue
+            per_batch = max(1, int(self.md_rate * batch_interval))
+            started = time.perf_counter()
+            for connection in list(self._ws_connections):
+                targets = [(channel, code) for channel, codes in connection.subscriptions.items()
+                           if channel in PUBLIC_CHANNELS for code in codes]
+                if not targets:
+                    continue
+                try:
+                    for i in range(per_batch):
+                        connection.send(self.market_data_msg(*targets[i % len(targets)]))
+                except OSError:
+                    connection.alive = False
+            elapsed = time.perf_counter() - started
+            time.sleep(max(0.0, per_batch / float(self.md_rate) - elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local EMX REST and WebSocket mock")
+    parser.add_argument("--rest-port", type=int, default=8080)
+    parser.add_argument("--ws-port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every REST response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max random seconds added on top of latency")
+    parser.add_argument("--md-rate", type=int, default=100, help="market data messages per second")
+    parser.add_argument("--contracts", type=int, default=10)
+    args = parser.parse_args()
+
+    server = MockEmxServer(args.rest_port, args.ws_port, args.latency, args.jitter,
+                           args.md_rate, args.contracts).start()
+    # First line of output is read by run_benchmarks to find the ports
+    print(server.rest_uri, server.ws_uri, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
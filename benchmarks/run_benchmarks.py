@@ -0,0 +1,192 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Client benchmarks against the local mock server, no testnet needed.
+
+* order entry throughput and latency percentiles, one by one, in bulk and
+  over the WebSocket,
+* WebSocket messages received per second,
+* client memory per 1k subscriptions.
+
+Run with ``python -m benchmarks.run_benchmarks [--latency 0.001] [--json out.json]``.
+"""
+
+import argparse
+import base64
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from emx.instrumentation import LatencyHistogram
+from emx.rest_api import RestApi
+from emx.utils import EmxApiTimeoutException
+from emx.ws_api import WebSocketApi
+
+
+API_KEY = "benchmark-key"
+API_SECRET = base64.b64encode(b"0123456789abcdef0123456789abcdef").decode()
+
+
+class MockServerProcess():
+    """ Runs :mod:`benchmarks.mock_server` in a child process, so the server does
+    not compete with the client for the GIL. """
+
+    def __init__(self, latency=0.0, jitter=0.0, md_rate=0, contracts=10):
+        self.contract_codes = ["C{:04d}".format(i) for i in range(contracts)]
+        self._args = [sys.executable, "-m", "benchmarks.mock_server", "--rest-port", "0", "--ws-port", "0",
+                      "--latency", str(latency), "--jitter", str(jitter), "--md-rate", str(md_rate),
+                      "--contracts", str(contracts)]
+        self._process = None
+
+    def __enter__(self):
+        self._process = subprocess.Popen(self._args, stdout=subprocess.PIPE, universal_newlines=True)
+        self.rest_uri, self.ws_uri = self._process.stdout.readline().split()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._process.terminate()
+        self._process.wait()
+
+
+def _order(i):
+    return {"contract_code": "C0000", "order_type": "limit", "order_side": "buy" if i % 2 else "sell",
+            "size": "1.0000", "price": "100.00", "client_id": "bench-{}".format(i)}
+
+
+def _latency_stats(histogram, elapsed, count):
+    stats = histogram.snapshot()
+    return {"per_sec": count / elapsed,
+            "p50_ms": stats["p50"] * 1e3,
+            "p99_ms": stats["p99"] * 1e3,
+            "max_ms": stats["max"] * 1e3}
+
+
+def bench_order_entry(server, orders):
+    api = RestApi(API_KEY, API_SECRET, uri=server.rest_uri)
+    api.create_new_order(**_order(0))  # warm up the connection pool
+    histogram = LatencyHistogram()
+    start = time.perf_counter()
+    for i in range(orders):
+        sent = time.perf_counter()
+        api.create_new_order(**_order(i))
+        histogram.record(time.perf_counter() - sent)
+    result = _latency_stats(histogram, time.perf_counter() - start, orders)
+    api.close()
+    return result
+
+
+def bench_bulk_order_entry(server, orders, batch):
+    api = RestApi(API_KEY, API_SECRET, uri=server.rest_uri, pool_size=batch)
+    histogram = LatencyHistogram()
+    start = time.perf_counter()
+    for first in range(0, orders, batch):
+        sent = time.perf_counter()
+        results = api.create_orders([_order(i) for i in range(first, min(orders, first + batch))])
+        histogram.record(time.perf_counter() - sent)
+        assert all(result.ok for result in results)
+    result = _latency_stats(histogram, time.perf_counter() - start, orders)
+    # latency percentiles are per batch here
+    api.close()
+    return result
+
+
+def bench_ws_order_entry(server, orders):
+    ws = WebSocketApi(API_KEY, API_SECRET, timeout=1, uri=server.ws_uri)
+    ws.subscribe(["C0000"], ["orders"])
+    ws.receive_msg()  # the "subscriptions" acknowledgement
+    histogram = LatencyHistogram()
+    start = time.perf_counter()
+    for i in range(orders):
+        sent = time.perf_counter()
+        future = ws.create_new_order(**_order(i))
+        while not future.done():
+            ws.receive_msg()
+        future.result()
+        histogram.record(time.perf_counter() - sent)
+    result = _latency_stats(histogram, time.perf_counter() - start, orders)
+    ws.close()
+    return result
+
+
+def bench_ws_throughput(server, duration):
+    ws = WebSocketApi(timeout=1, uri=server.ws_uri)
+    ws.subscribe(server.contract_codes, ["ticker", "trade", "level2"])
+    received = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        try:
+            ws.receive_msg()
+            received += 1
+        except EmxApiTimeoutException:
+            pass
+    elapsed = time.perf_counter() - start
+    ws.close()
+    return {"per_sec": received / elapsed, "messages": received}
+
+
+def bench_subscription_memory(server, subscriptions):
+    codes = ["S{:05d}".format(i) for i in range(subscriptions)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    ws = WebSocketApi(timeout=1, uri=server.ws_uri)
+    ws.subscribe(codes, ["ticker"])
+    ws.receive_msg()  # the "subscriptions" acknowledgement
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    ws.close()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {"bytes_per_1k": allocated * 1000.0 / subscriptions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every REST response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max random seconds added on top of latency")
+    parser.add_argument("--md-rate", type=int, default=50000, help="market data messages per second")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds of WebSocket streaming")
+    parser.add_argument("--subscriptions", type=int, default=1000)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    with MockServerProcess(args.latency, args.jitter, args.md_rate) as server:
+        # The feed only streams to connections with public subscriptions, so it
+        # stays idle during the REST benchmarks
+        results["order_entry"] = bench_order_entry(server, args.orders)
+        results["bulk_order_entry"] = bench_bulk_order_entry(server, args.orders, args.batch)
+        results["ws_order_entry"] = bench_ws_order_entry(server, args.orders)
+        results["ws_throughput"] = bench_ws_throughput(server, args.duration)
+        results["subscription_memory"] = bench_subscription_memory(server, args.subscriptions)
+
+    for name in ("order_entry", "bulk_order_entry", "ws_order_entry"):
+        stats = results[name]
+        print("{:<20}: {:>9.0f} orders/s  p50 {:.3f} ms  p99 {:.3f} ms  max {:.3f} ms".format(
+            name, stats["per_sec"], stats["p50_ms"], stats["p99_ms"], stats["max_ms"]))
+    print("{:<20}: {:>9.0f} msgs/s".format("ws_throughput", results["ws_throughput"]["per_sec"]))
+    print("{:<20}: {:>9.1f} KiB per 1k subscriptions".format(
+        "subscription_memory", results["subscription_memory"]["bytes_per_1k"] / 1024))
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
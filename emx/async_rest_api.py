@@ -0,0 +1,199 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import aiohttp
+from emx.rest_api import RestApi
+from emx.utils import (
+    handle_async_result,
+    Signer,
+)
+
+
+class AsyncRestApi():
+    """ Asyncio counterpart of :class:`emx.rest_api.RestApi`.
+    Every route is a coroutine, and all of them share one bounded pool of
+    keep-alive connections, so many concurrent requests run on a single event loop.
+
+    .. note::
+       No query rate limiting is performed.
+    """
+
+    def __init__(self, api_key='', key_secret='', uri='http://api.testnet.emx.com',
+                 pool_size=100, pool_size_per_host=0, keepalive_timeout=30):
+        """ Create an object with authentication information.
+
+        :param api_key: (optional) key identifier for queries to the API
+        :type api_key: str
+        :param key_secret: (optional) actual private key used to sign messages
+        :type key_secret: str
+        :param pool_size: maximum number of simultaneously open connections
+        :param pool_size_per_host: maximum number of connections per host (0 means no limit)
+        :param keepalive_timeout: seconds an idle connection is kept open for reuse
+        :returns: None
+        """
+
+        self.session = None
+
+        self.uri = uri
+        self._api_key = api_key
+        self._api_secret = key_secret
+        self._signer = Signer(api_key, key_secret)
+
+        self._pool_size = pool_size
+        self._pool_size_per_host = pool_size_per_host
+        self._keepalive_timeout = keepalive_timeout
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        # The session is created lazily, so that it binds to the running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size,
+                                             limit_per_host=self._pool_size_per_host,
+                                             keepalive_timeout=self._keepalive_timeout)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        """ Close all pooled connections
+
+        :returns: None
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @handle_async_result
+    async def _request(self, http_method, endpoint, body=None, authed=True):
+        if authed:
+            headers, data = self._signer.headers(http_method, endpoint, body)
+        else:
+            headers, data = {'content-type': 'application/json'}, None
+
+        url = self.uri + endpoint
+        return await self._get_session().request(http_method, url, data=data, headers=headers)
+
+
+    ### Public Market Data ###
+
+    async def _get_route_without_body(self, endpoint):
+        return await self._request("GET", endpoint, authed=False)
+
+    async def get_contracts(self):
+        return await self._get_route_without_body("/v1/contracts")
+
+    async def get_active_contracts(self):
+        return await self._get_route_without_body("/v1/contracts/active")
+
+    async def get_specific_contract(self, contract_code):
+        return await self._get_route_without_body("/v1/contracts/{}".format(contract_code))
+
+    async def get_contract_funding(self, contract_code):
+        return await self._get_route_without_body("/v1/contracts/{}/funding".format(contract_code))
+
+    async def get_contract_summary(self, contract_code):
+        return await self._get_route_without_body("/v1/contracts/{}/summary".format(contract_code))
+
+    async def get_contract_quote(self, contract_code):
+        return await self._get_route_without_body("/v1/contracts/{}/quote".format(contract_code))
+
+    async def get_contract_book(self, contract_code):
+        return await self._get_route_without_body("/v1/contracts/{}/book".format(contract_code))
+
+
+    ### Authenticated Routes ###
+
+    async def get_account(self):
+        """See :meth:`emx.rest_api.RestApi.get_account`"""
+        return await self._request("GET", "/v1/accounts")
+
+    async def get_balances(self, trader_id):
+        """See :meth:`emx.rest_api.RestApi.get_balances`"""
+        return await self._request("GET", "/v1/accounts/{}".format(trader_id))
+
+    async def get_positions(self, contract_code=None):
+        """See :meth:`emx.rest_api.RestApi.get_positions`"""
+        if contract_code:
+            endpoint = "/v1/positions/?contract_code={}".format(contract_code)
+        else:
+            endpoint = "/v1/positions/"
+        result = await self._request("GET", endpoint)
+        return result['positions']
+
+    async def list_fills(self, contract_code="", order_id="", before="", after=""):
+        """See :meth:`emx.rest_api.RestApi.list_fills`"""
+        body = {
+            "contract_code": contract_code,
+            "order_id": order_id,
+            "before": before,
+            "after": after
+        }
+        return await self._request("GET", "/v1/fills", body)
+
+    async def list_keys(self):
+        """See :meth:`emx.rest_api.RestApi.list_keys`"""
+        return await self._request("GET", "/v1/keys")
+
+    async def create_key(self):
+        """See :meth:`emx.rest_api.RestApi.create_key`"""
+        return await self._request("POST", "/v1/keys")
+
+    async def delete_key(self, key):
+        """See :meth:`emx.rest_api.RestApi.delete_key`"""
+        return await self._request("DELETE", "/v1/keys/{}".format(key))
+
+    async def list_orders(self, contract_code="", status="", before="", after=""):
+        """See :meth:`emx.rest_api.RestApi.list_orders`"""
+        body = {
+            "contract_code": contract_code,
+            "status": status,
+            "before": before,
+            "after": after
+        }
+        return await self._request("GET", "/v1/orders", body)
+
+    async def create_new_order(self, contract_code, order_type,
+                               order_side, size, client_id="", price="", stop_price="",
+                               stop_trigger="", peg_price_type="", peg_offset_value="",
+                               reduce_only=False, post_only=False):
+        """See :meth:`emx.rest_api.RestApi.create_new_order`"""
+        body = RestApi._new_order_body(contract_code, order_type, order_side, size,
+                                       client_id, price, stop_price, stop_trigger,
+                                       peg_price_type, peg_offset_value, reduce_only, post_only)
+        return await self._request("POST", "/v1/orders", body)
+
+    async def modify_order(self, exchange_orderid, order_type, order_side, order_size, order_price=None, order_stop_price=None):
+        """See :meth:`emx.rest_api.RestApi.modify_order`"""
+        body = RestApi._modify_order_body(order_type, order_side, order_size, order_price, order_stop_price)
+        return await self._request("PATCH", "/v1/orders/{}".format(exchange_orderid), body)
+
+    async def cancel_order(self, exchange_orderid):
+        """See :meth:`emx.rest_api.RestApi.cancel_order`"""
+        body = {
+          "order_id": exchange_orderid,
+        }
+        return await self._request("DELETE", "/v1/orders/{}".format(exchange_orderid), body)
+
+    async def cancel_all(self, contract_code=None):
+        """See :meth:`emx.rest_api.RestApi.cancel_all`"""
+        if contract_code is not None:
+            endpoint = "/v1/orders?contract_code={}".format(contract_code)
+        else:
+            endpoint = "/v1/orders"
+        return await self._request("DELETE", endpoint, {})
@@ -0,0 +1,251 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" OHLCV bars built from the trade stream, kept in fixed-size NumPy ring buffers.
+
+Requires NumPy. Every completed bar is written twice, at slot ``i`` and
+``i + capacity`` of a ``(6, 2 * capacity)`` array, so the last ``n`` bars are
+always one contiguous slice of each row. :meth:`BarSeries.bars` returns those
+slices as views: no copy, but they are overwritten as new bars arrive, so copy
+them to keep them.
+"""
+
+import math
+import threading
+from collections import namedtuple
+import numpy as np
+from emx.messages import as_dict
+from emx.utils import parse_timestamp
+
+
+FIELDS = ("start", "open", "high", "low", "close", "volume")
+START, OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(FIELDS))
+
+Bars = namedtuple("Bars", FIELDS)
+Bars.__doc__ = """Views of the last completed bars, oldest first. ``start`` is the bar
+open time in seconds since the epoch (time bars) or of its first trade (volume bars)."""
+
+VOLUME_BARS = "volume"
+
+
+class BarSeries():
+    """ Ring buffer of completed bars plus the bar being built.
+
+    :param capacity: number of completed bars kept
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self.current = None
+        self._data = np.zeros((len(FIELDS), 2 * capacity))
+        self._next = 0
+
+    def _append(self, bar):
+        i = self._next
+        self._data[:, i] = bar
+        self._data[:, i + self.capacity] = bar
+        self._next = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _open(self, start, price, size):
+        self.current = [start, price, price, price, price, size]
+
+    def _extend(self, price, size):
+        bar = self.current
+        if price > bar[HIGH]:
+            bar[HIGH] = price
+        if price < bar[LOW]:
+            bar[LOW] = price
+        bar[CLOSE] = price
+        bar[VOLUME] += size
+
+    def bars(self, n=None):
+        """Last n completed bars (all kept bars by default) as zero-copy views.
+
+        :returns: :class:`Bars`
+        """
+        n = self.count if n is None else min(n, self.count)
+        end = self._next + self.capacity
+        data = self._data
+        return Bars(*(data[field, end - n:end] for field in range(len(FIELDS))))
+
+    def __len__(self):
+        return self.count
+
+
+class TimeBarSeries(BarSeries):
+    """ Bars of a fixed duration, aligned on multiples of ``interval`` seconds.
+    Intervals without trades produce no bar. Late trades belonging to an
+    interval that was already completed are dropped.
+    """
+
+    def __init__(self, interval, capacity):
+        super().__init__(capacity)
+        self.interval = interval
+        # End of the last completed bar
+        self.closed_until = -math.inf
+
+    def _append(self, bar):
+        super()._append(bar)
+        self.closed_until = bar[START] + self.interval
+
+    def on_trade(self, timestamp, price, size):
+        """:returns: True if the trade completed a bar"""
+        start = math.floor(timestamp / self.interval) * self.interval
+        bar = self.current
+        if bar is not None and start == bar[START]:
+            self._extend(price, size)
+            return False
+        if start < self.closed_until or (bar is not None and start < bar[START]):
+            # Late trade from an already completed bar
+            return False
+        closed = bar is not None
+        if closed:
+            self._append(bar)
+        self._open(start, price, size)
+        return closed
+
+    def close_until(self, timestamp):
+        """Complete the current bar if its interval ended before ``timestamp``,
+        for quiet markets where no trade arrives to close it.
+
+        :returns: True if a bar was completed
+        """
+        bar = self.current
+        if bar is None or timestamp < bar[START] + self.interval:
+            return False
+        self._append(bar)
+        self.current = None
+        return True
+
+
+class VolumeBarSeries(BarSeries):
+    """ Bars holding ``volume`` traded contracts each. A trade crossing the
+    threshold is split between the completed bar and the next one.
+    """
+
+    def __init__(self, volume, capacity):
+        super().__init__(capacity)
+        self.volume = volume
+
+    def on_trade(self, timestamp, price, size):
+        """:returns: True if the trade completed at least one bar"""
+        closed = False
+        while size > 0:
+            bar = self.current
+            if bar is None:
+                part = min(size, self.volume)
+                self._open(timestamp, price, part)
+            else:
+                part = min(size, self.volume - bar[VOLUME])
+                self._extend(price, part)
+            size -= part
+            if self.current[VOLUME] >= self.volume:
+                self._append(self.current)
+                self.current = None
+                closed = True
+        return closed
+
+
+class BarAggregator():
+    """ Builds time bars at several resolutions, and optionally volume bars,
+    for every contract seen on the ``trade`` channel.
+
+    :param intervals: time bar durations in seconds
+    :param volume: (optional) contracts per volume bar, either one value or
+        {contract_code: value}
+    :param capacity: completed bars kept per contract and resolution
+    :param on_bar: (optional) callable(contract_code, resolution, series) called
+        when a bar completes; resolution is the interval or ``VOLUME_BARS``
+    """
+
+    def __init__(self, intervals=(1, 60, 300), volume=None, capacity=1024, on_bar=None):
+        self.intervals = tuple(intervals)
+        self.volume = volume
+        self.capacity = capacity
+        self.on_bar = on_bar
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _contract_series(self, contract_code):
+        series = self._series.get(contract_code)
+        if series is None:
+            series = {interval: TimeBarSeries(interval, self.capacity) for interval in self.intervals}
+            volume = self.volume.get(contract_code) if isinstance(self.volume, dict) else self.volume
+            if volume:
+                series[VOLUME_BARS] = VolumeBarSeries(volume, self.capacity)
+            self._series[contract_code] = series
+        return series
+
+    def on_trade(self, contract_code, timestamp, price, size):
+        """Add one trade.
+
+        :param timestamp: trade time in seconds since the epoch
+        :returns: None
+        """
+        completed = []
+        with self._lock:
+            for resolution, series in self._contract_series(contract_code).items():
+                if series.on_trade(timestamp, float(price), float(size)):
+                    completed.append((resolution, series))
+        if self.on_bar is not None:
+            for resolution, series in completed:
+                self.on_bar(contract_code, resolution, series)
+
+    def on_message(self, msg):
+        """Feed a message received from :class:`emx.ws_api.WebSocketApi`.
+        Messages from other channels are ignored.
+
+        :param msg: raw json string, decoded dict or :mod:`emx.messages` record
+        :returns: None
+        """
+        msg = as_dict(msg)
+        if msg.get("channel") not in ("trade", "trades"):
+            return
+        data = msg.get("data", {})
+        for trade in data if isinstance(data, list) else [data]:
+            price = trade.get("price")
+            size = trade.get("size")
+            timestamp = parse_timestamp(trade.get("timestamp") or "")
+            if price in (None, "") or size in (None, "") or timestamp is None:
+                continue
+            self.on_trade(trade.get("contract_code") or msg.get("contract_code"), timestamp, price, size)
+
+    def close_until(self, timestamp):
+        """Complete every time bar whose interval ended before ``timestamp``."""
+        completed = []
+        with self._lock:
+            for contract_code, contract_series in self._series.items():
+                for resolution, series in contract_series.items():
+                    if resolution != VOLUME_BARS and series.close_until(timestamp):
+                        completed.append((contract_code, resolution, series))
+        if self.on_bar is not None:
+            for contract_code, resolution, series in completed:
+                self.on_bar(contract_code, resolution, series)
+
+    def series(self, contract_code, resolution):
+        """:returns: :class:`TimeBarSeries` or :class:`VolumeBarSeries`
+        :raises: KeyError if nothing was recorded for this contract and resolution"""
+        return self._series[contract_code][resolution]
+
+    def bars(self, contract_code, resolution, n=None):
+        """Last completed bars of a contract as zero-copy views.
+
+        :param resolution: interval in seconds, or ``VOLUME_BARS``
+        :returns: :class:`Bars`
+        """
+        return self.series(contract_code, resolution).bars(n)
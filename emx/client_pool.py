@@ -0,0 +1,182 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from emx.rest_api import RestApi, BulkResult
+from emx.utils import EmxApiException
+
+
+class ClientPool():
+    """ Many key pairs over one connection pool.
+
+    Every key gets its own :class:`emx.rest_api.RestApi` (and so its own
+    signer), but all of them share a single ``requests.Session`` sized to
+    ``pool_size`` connections. Fan-out helpers run on one shared executor and
+    the bulk order calls of every client on another, so a fan-out of bulk
+    calls cannot wait on its own workers.
+
+    :param uri: API endpoint
+    :param pool_size: kept-alive connections, and concurrent requests of fan-out calls
+    :param client_options: keyword arguments given to every RestApi
+        (scheduler, typed, instrumentation, ...)
+    """
+
+    def __init__(self, uri='http://api.testnet.emx.com', pool_size=50, **client_options):
+        self.uri = uri
+        self.pool_size = pool_size
+        self.client_options = client_options
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="emx-pool")
+        self._bulk_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="emx-bulk")
+        self._clients = {}
+        self._trader_ids = {}
+        # name -> error of the last failed get_account of a key
+        self.account_errors = {}
+
+    def add(self, name, api_key, key_secret):
+        """Register a key pair.
+
+        :param name: name the client is looked up by
+        :returns: :class:`emx.rest_api.RestApi` using the shared session
+        """
+        client = RestApi(api_key, key_secret, uri=self.uri, pool_size=self.pool_size,
+                         session=self.session, executor=self._bulk_executor, **self.client_options)
+        self._clients[name] = client
+        self._trader_ids.pop(name, None)
+        self.account_errors.pop(name, None)
+        return client
+
+    def remove(self, name):
+        client = self._clients.pop(name)
+        self._trader_ids.pop(name, None)
+        self.account_errors.pop(name, None)
+        client.close()
+
+    def __getitem__(self, name):
+        return self._clients[name]
+
+    def __contains__(self, name):
+        return name in self._clients
+
+    def __len__(self):
+        return len(self._clients)
+
+    def names(self):
+        return list(self._clients)
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+        self._executor.shutdown(wait=False)
+        self._bulk_executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    ### Fan-out ###
+
+    def _run(self, calls):
+        """Run (key, callable) pairs concurrently.
+
+        :returns: {key: :class:`emx.rest_api.BulkResult`}
+        """
+        def run(call):
+            try:
+                return BulkResult(True, call(), None)
+            except Exception as err:
+                return BulkResult(False, None, err)
+
+        futures = [(key, self._executor.submit(run, call)) for key, call in calls]
+        return {key: future.result() for key, future in futures}
+
+    def map(self, func, names=None):
+        """Call ``func(client)`` for several clients concurrently.
+
+        :param names: (optional) clients to use, all of them by default
+        :returns: {name: :class:`emx.rest_api.BulkResult`}
+        """
+        names = self.names() if names is None else names
+        return self._run([(name, lambda client=self._clients[name]: func(client)) for name in names])
+
+    def trader_ids(self, refresh=False):
+        """Trader accounts reachable with every key, loaded once with concurrent
+        ``get_account`` calls. Keys whose accounts cannot be loaded are left out,
+        their error kept in ``account_errors``, and tried again on the next call.
+
+        :returns: {name: [trader_id]} of the keys whose accounts are known
+        """
+        missing = [name for name in self._clients if refresh or name not in self._trader_ids]
+        if missing:
+            for name, result in self.map(lambda client: client.get_account(), missing).items():
+                if not result.ok:
+                    self._trader_ids.pop(name, None)
+                    self.account_errors[name] = result.error
+                    continue
+                self.account_errors.pop(name, None)
+                self._trader_ids[name] = [account["trader_id"] for account in result.result.get("accounts", [])]
+        return {name: self._trader_ids[name] for name in self._clients if name in self._trader_ids}
+
+    def get_balances(self, trader_ids=None):
+        """Balances of every trader account, all requested concurrently.
+
+        Once the accounts are known (see :meth:`trader_ids`), this costs about
+        one round trip whatever the number of accounts.
+
+        :param trader_ids: (optional) accounts to query, all known accounts by default
+        :returns: {trader_id: :class:`emx.rest_api.BulkResult`}; by default, every key whose
+            accounts could not be loaded also gets a failed result under its name
+        """
+        owners = {}
+        for name, ids in self.trader_ids().items():
+            for trader_id in ids:
+                owners.setdefault(trader_id, self._clients[name])
+        calls = []
+        if trader_ids is None:
+            trader_ids = list(owners)
+            calls.extend((name, _raise(EmxApiException("Unable to load accounts of {}. Reason: {}".format(
+                name, err)))) for name, err in self.account_errors.items())
+        for trader_id in trader_ids:
+            client = owners.get(trader_id)
+            if client is None:
+                reason = "No key has access to trader {}".format(trader_id)
+                if self.account_errors:
+                    reason += " (accounts of {} could not be loaded)".format(", ".join(sorted(self.account_errors)))
+                calls.append((trader_id, _raise(EmxApiException(reason))))
+            else:
+                calls.append((trader_id, lambda client=client, trader_id=trader_id: client.get_balances(trader_id)))
+        return self._run(calls)
+
+    def get_positions(self, contract_code=None, names=None):
+        """Positions seen by every key, requested concurrently.
+
+        :returns: {name: :class:`emx.rest_api.BulkResult`}
+        """
+        return self.map(lambda client: client.get_positions(contract_code), names)
+
+
+def _raise(err):
+    def call():
+        raise err
+    return call
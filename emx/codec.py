@@ -0,0 +1,84 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" JSON codec shared by RestApi, WebSocketApi and the request signer.
+
+The fastest installed backend is picked at import time (orjson, then ujson,
+then the standard library). Call sites must go through the module attributes
+(``codec.loads(...)``) so that :func:`use` takes effect everywhere.
+
+``dumps`` always returns a compact ``str``; ``loads`` accepts ``str`` or ``bytes``.
+"""
+
+import json
+
+
+BACKEND = None
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _use_orjson():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+    return orjson.loads, dumps
+
+
+def _use_ujson():
+    import ujson
+    return ujson.loads, ujson.dumps
+
+
+def _use_json():
+    return json.loads, _stdlib_dumps
+
+
+_BACKENDS = {
+    "orjson": _use_orjson,
+    "ujson": _use_ujson,
+    "json": _use_json,
+}
+
+
+def use(backend, loads_func=None, dumps_func=None):
+    """Switch the JSON backend for the whole library.
+
+    :param backend: "orjson", "ujson", "json", or any name when custom functions are given
+    :param loads_func: (optional) custom decoder
+    :param dumps_func: (optional) custom encoder returning a compact str
+    :returns: None
+    :raises: ValueError if the backend is unknown, ImportError if it is not installed
+    """
+    global BACKEND, loads, dumps
+    if loads_func is not None and dumps_func is not None:
+        loads, dumps = loads_func, dumps_func
+    elif backend in _BACKENDS:
+        loads, dumps = _BACKENDS[backend]()
+    else:
+        raise ValueError("Unknown json backend: {}".format(backend))
+    BACKEND = backend
+
+
+loads, dumps = json.loads, _stdlib_dumps
+for _name in ("orjson", "ujson", "json"):
+    try:
+        use(_name)
+        break
+    except ImportError:
+        continue
@@ -0,0 +1,248 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_FLOOR, ROUND_CEILING
+from emx.utils import EmxApiException
+
+logger = logging.getLogger(__name__)
+
+
+ROUND_NEAREST = ROUND_HALF_EVEN
+ROUND_DOWN = ROUND_FLOOR
+ROUND_UP = ROUND_CEILING
+
+
+def _first(raw, *keys):
+    for key in keys:
+        value = raw.get(key)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _decimals(step, default=8):
+    if step is None:
+        return default
+    return max(0, -step.normalize().as_tuple().exponent)
+
+
+class Contract():
+    """ Reference data of one contract with precomputed rounding helpers.
+
+    :param raw: contract dict as returned by ``RestApi.get_contracts``
+    """
+
+    __slots__ = ('contract_code', 'tick_size', 'lot_size', 'expiration_time', 'status', 'raw',
+                 'price_decimals', 'size_decimals', '_tick', '_lot')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.contract_code = raw["contract_code"]
+        self.status = raw.get("status")
+        self.expiration_time = raw.get("expiration_time")
+
+        tick = _first(raw, "minimum_price_increment", "tick_size")
+        lot = _first(raw, "minimum_size_increment", "lot_size", "size_increment")
+        self._tick = Decimal(tick) if tick is not None else None
+        self._lot = Decimal(lot) if lot is not None else None
+        self.tick_size = float(tick) if tick is not None else None
+        self.lot_size = float(lot) if lot is not None else None
+        # Number of decimals needed to represent any price / size as an integer
+        self.price_decimals = _decimals(self._tick)
+        self.size_decimals = _decimals(self._lot)
+
+    @staticmethod
+    def _round(value, step, rounding):
+        if step is None:
+            return str(value)
+        steps = (Decimal(str(value)) / step).to_integral_value(rounding)
+        return str((steps * step).quantize(step))
+
+    def round_price(self, price, rounding=ROUND_NEAREST):
+        """Round a price to the contract tick size.
+
+        :param price: price as str, float or Decimal
+        :param rounding: ROUND_NEAREST, ROUND_DOWN (for bids) or ROUND_UP (for asks)
+        :returns: price as str, ready to be sent to the API
+        """
+        return self._round(price, self._tick, rounding)
+
+    def round_size(self, size, rounding=ROUND_DOWN):
+        """Round a size to the contract lot size (down by default).
+
+        :returns: size as str, ready to be sent to the API
+        """
+        return self._round(size, self._lot, rounding)
+
+    def _require_tick(self):
+        if self._tick is None:
+            raise EmxApiException("Contract {} has no tick size".format(self.contract_code))
+        return self._tick
+
+    def price_to_ticks(self, price):
+        """Integer number of ticks in a price.
+
+        :raises: EmxApiException if the contract has no tick size
+        """
+        return int((Decimal(str(price)) / self._require_tick()).to_integral_value(ROUND_NEAREST))
+
+    def ticks_to_price(self, ticks):
+        tick = self._require_tick()
+        return str((ticks * tick).quantize(tick))
+
+    def is_price_valid(self, price):
+        return self._tick is None or Decimal(str(price)) % self._tick == 0
+
+    def is_size_valid(self, size):
+        return self._lot is None or Decimal(str(size)) % self._lot == 0
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class ContractRegistry():
+    """ TTL cache of contract reference data with O(1) lookup by contract code.
+
+    Expired data keeps being served while a background thread refreshes it, so
+    lookups on the order path never wait for the network; only the very first
+    lookup loads the contracts synchronously. An unknown contract code fails at
+    once and schedules a background refresh, at most once per ``ttl`` for the
+    same code, so a newly listed contract shows up shortly after.
+
+    :param rest_api: :class:`emx.rest_api.RestApi` used to load ``get_contracts``
+    :param ttl: seconds before the cached data is refreshed
+    """
+
+    def __init__(self, rest_api, ttl=300):
+        self.rest_api = rest_api
+        self.ttl = ttl
+        self._contracts = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # contract_code -> time of the last lookup that missed it
+        self._misses = {}
+
+    @classmethod
+    def shared(cls, rest_api, ttl=300):
+        """Process-wide registry for the API endpoint of ``rest_api``.
+
+        Every client of the same ``uri`` gets the same registry; it keeps loading
+        through the client and ``ttl`` it was created with.
+        """
+        with _shared_lock:
+            registry = _shared.get(rest_api.uri)
+            if registry is None:
+                registry = _shared[rest_api.uri] = cls(rest_api, ttl)
+            return registry
+
+    def refresh(self):
+        """Reload every contract synchronously.
+
+        :returns: None
+        :raises: EmxApiException if the request fails
+        """
+        result = self.rest_api.get_contracts()
+        contracts = {}
+        for raw in result.get("contracts", []):
+            contract = Contract(raw)
+            contracts[contract.contract_code] = contract
+        # Swap the whole dict so readers never see a partially loaded registry
+        self._contracts = contracts
+        self._loaded_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                # Stale data keeps being served, the next lookup retries
+                logger.exception("Contract refresh failed")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="emx-contracts", daemon=True).start()
+
+    def is_expired(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def get(self, contract_code):
+        """Look up a contract.
+
+        :returns: :class:`Contract`
+        :raises: EmxApiException if the contract does not exist
+        """
+        contract = self._contracts.get(contract_code)
+        if contract is None:
+            if self._loaded_at is None:
+                self.refresh()
+                contract = self._contracts.get(contract_code)
+            if contract is None:
+                self._miss(contract_code)
+                raise EmxApiException("Unknown contract: {}".format(contract_code))
+        elif self.is_expired():
+            self._refresh_in_background()
+        return contract
+
+    def _miss(self, contract_code):
+        now = time.monotonic()
+        with self._lock:
+            missed_at = self._misses.get(contract_code)
+            if missed_at is not None and now - missed_at <= self.ttl:
+                return
+            if len(self._misses) >= 1024:
+                self._misses = {code: at for code, at in self._misses.items() if now - at <= self.ttl}
+            self._misses[contract_code] = now
+        self._refresh_in_background()
+
+    def __getitem__(self, contract_code):
+        return self.get(contract_code)
+
+    def __contains__(self, contract_code):
+        return contract_code in self._contracts
+
+    def contracts(self):
+        if self._loaded_at is None:
+            self.refresh()
+        return list(self._contracts.values())
+
+    def active(self):
+        return [contract for contract in self.contracts() if contract.status == "active"]
+
+    def on_ws_message(self, msg):
+        """Apply contract status changes received on the WebSocket.
+        A status for an unknown contract schedules a full refresh.
+
+        :param msg: decoded WebSocket message dict
+        :returns: None
+        """
+        if msg.get("channel") not in ("contracts", "contract_status"):
+            return
+        data = msg.get("data", msg)
+        for item in data if isinstance(data, list) else [data]:
+            contract = self._contracts.get(item.get("contract_code"))
+            if contract is None:
+                self._refresh_in_background()
+            elif "status" in item:
+                contract.status = item["status"]
@@ -0,0 +1,236 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from collections import deque, OrderedDict
+from emx.messages import as_dict
+from emx.utils import EmxApiException, EmxApiTimeoutException
+
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+CONFLATE = "conflate"
+
+
+class ChannelQueue():
+    """ Bounded queue feeding the callbacks of one channel.
+
+    With ``DROP_OLDEST`` the oldest pending message is discarded when the queue is
+    full. With ``CONFLATE`` only the latest pending message per contract is kept,
+    which suits quote-like channels where intermediate values are useless.
+    """
+
+    def __init__(self, maxsize, overflow=DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, CONFLATE):
+            raise EmxApiException("Unknown overflow policy: {}".format(overflow))
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self._cond = threading.Condition()
+        if overflow == CONFLATE:
+            self._pending = OrderedDict()
+        else:
+            self._pending = deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, msg):
+        with self._cond:
+            pending = self._pending
+            if self.overflow == CONFLATE:
+                key = msg.get("contract_code")
+                if key in pending:
+                    self.dropped += 1
+                pending[key] = msg
+                if len(pending) > self.maxsize:
+                    pending.popitem(last=False)
+                    self.dropped += 1
+            else:
+                if len(pending) >= self.maxsize:
+                    pending.popleft()
+                    self.dropped += 1
+                pending.append(msg)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Wait for the next message.
+
+        :returns: a message, or None on timeout
+        """
+        with self._cond:
+            if not self._pending and not self._cond.wait(timeout):
+                return None
+            if not self._pending:
+                return None
+            if self.overflow == CONFLATE:
+                return self._pending.popitem(last=False)[1]
+            return self._pending.popleft()
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+
+class WebSocketDispatcher():
+    """ Reads a :class:`emx.ws_api.WebSocketApi` on a background thread and routes
+    decoded messages to registered callbacks.
+
+    Each channel gets its own bounded queue and worker thread, so a slow
+    ``level2`` handler never delays ``orders`` callbacks. Messages without a
+    ``channel`` (e.g. ``subscriptions`` or ``error``) are routed by their ``type``.
+
+    :param ws_api: connected :class:`emx.ws_api.WebSocketApi`
+    :param queue_size: maximum number of pending messages per channel
+    :param overflow: mapping of channel name to ``DROP_OLDEST`` or ``CONFLATE``;
+        channels not listed use ``DROP_OLDEST``
+    :param on_error: (optional) callable invoked with the exception that stopped the reader,
+        with any exception raised by a callback, and with frames that cannot be decoded;
+        by default these are logged. The reader and workers keep running after a
+        callback or decoding error.
+    """
+
+    def __init__(self, ws_api, queue_size=1000, overflow=None, on_error=None):
+        self.ws_api = ws_api
+        self.queue_size = queue_size
+        self.overflow = overflow or {}
+        self.on_error = on_error
+
+        self._handlers = {}
+        self._queues = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._reader = None
+
+    def on(self, channel, callback, contract_code=None, msg_type=None):
+        """Register a callback.
+
+        :param channel: channel name, or message type for control messages
+        :param callback: callable receiving the decoded message dict
+        :param contract_code: (optional) only deliver messages for this contract
+        :param msg_type: (optional) only deliver messages of this type
+        :returns: None
+        """
+        with self._lock:
+            self._handlers.setdefault(channel, []).append((callback, contract_code, msg_type))
+            if channel not in self._queues:
+                queue = ChannelQueue(self.queue_size, self.overflow.get(channel, DROP_OLDEST))
+                self._queues[channel] = queue
+                if self._running:
+                    self._start_worker(channel, queue)
+
+    def queue_stats(self):
+        """Current depth and number of dropped messages per channel.
+
+        :returns: {"channel": {"pending": int, "dropped": int}}
+        """
+        return {channel: {"pending": len(queue), "dropped": queue.dropped}
+                for channel, queue in self._queues.items()}
+
+    def start(self):
+        """Start the reader thread and one worker per registered channel.
+
+        :returns: None
+        """
+        with self._lock:
+            # Under the lock, so that on() cannot start a second worker for a channel
+            if self._running:
+                return
+            self._running = True
+            for channel, queue in self._queues.items():
+                self._start_worker(channel, queue)
+        self._reader = threading.Thread(target=self._read_loop, name="emx-ws-reader", daemon=True)
+        self._reader.start()
+
+    def stop(self, timeout=None):
+        """Stop the reader and worker threads. Pending messages are discarded.
+
+        :returns: None
+        """
+        self._running = False
+        for queue in self._queues.values():
+            queue.wake()
+        if self._reader is not None and self._reader is not threading.current_thread():
+            self._reader.join(timeout)
+        with self._lock:
+            workers, self._workers = list(self._workers.values()), {}
+        for worker in workers:
+            if worker is not threading.current_thread():
+                worker.join(timeout)
+
+    def _start_worker(self, channel, queue):
+        if channel in self._workers:
+            return
+        worker = threading.Thread(target=self._work_loop, args=(channel, queue),
+                                  name="emx-ws-{}".format(channel), daemon=True)
+        self._workers[channel] = worker
+        worker.start()
+
+    def _report(self, err, what):
+        if self.on_error is None:
+            logger.error("%s: %r", what, err, exc_info=err)
+            return
+        try:
+            self.on_error(err)
+        except Exception:
+            logger.exception("on_error failed")
+
+    def dispatch(self, raw):
+        """Decode a raw frame and enqueue it for its channel.
+
+        :param raw: frame as returned by ``WebSocketApi.receive_msg``: json string, dict,
+            or :mod:`emx.messages` records, which callbacks receive as a message dict
+        :returns: None
+        """
+        msg = as_dict(raw)
+        queue = self._queues.get(msg.get("channel") or msg.get("type"))
+        if queue is not None:
+            queue.put(msg)
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                raw = self.ws_api.receive_msg()
+            except EmxApiTimeoutException:
+                continue
+            except EmxApiException as err:
+                self._running = False
+                self._report(err, "WebSocket reader stopped")
+                break
+            try:
+                self.dispatch(raw)
+            except Exception as err:
+                # One undecodable frame must not stop the reader
+                self._report(err, "Cannot dispatch frame")
+
+    def _work_loop(self, channel, queue):
+        while self._running:
+            msg = queue.get(timeout=1.0)
+            if msg is None:
+                continue
+            contract_code = msg.get("contract_code")
+            msg_type = msg.get("type")
+            for callback, want_contract, want_type in self._handlers.get(channel, ()):
+                if want_contract is not None and want_contract != contract_code:
+                    continue
+                if want_type is not None and want_type != msg_type:
+                    continue
+                try:
+                    callback(msg)
+                except Exception as err:
+                    self._report(err, "Callback of channel {} failed".format(channel))
@@ -1,6 +1,6 @@
 from emx.rest_api import RestApi
 from emx.ws_api import WebSocketApi
-from emx.utils import EmxApiException
+from emx.utils import EmxApiException, EmxApiTimeoutException
 
 def rest_api_examples():
     api = RestApi('your_api_key', 'your_b64_secret')
@@ -15,13 +15,15 @@ def rest_api_examples():
 
 
 def ws_api_examples():
-    api = WebSocketApi('your_api_key', 'your_b64_secret')
+    api = WebSocketApi('your_api_key', 'your_b64_secret', auto_reconnect=True)
     channels = ["orders", "trading"]
     api.subscribe(["ETHH19"], channels)
 
     while True:
         try:
             print(api.receive_msg())
+        except EmxApiTimeoutException:
+            continue
         except EmxApiException as err:
             print(err)
             break
@@ -0,0 +1,241 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" Latency and traffic instrumentation for RestApi and WebSocketApi.
+
+Pass the same :class:`Instrumentation` to ``RestApi(instrumentation=...)`` and
+``WebSocketApi(instrumentation=...)``. When no instrumentation is given, the
+clients only pay for one ``is None`` check per call.
+
+REST phases, recorded per route:
+
+* ``sign``: building the signed headers,
+* ``server``: from sending the request to parsing the response headers,
+* ``transfer``: the rest of the HTTP call (request preparation, connection
+  acquisition, body read),
+* ``decode``: status check and JSON decoding,
+* ``total``: the whole route call, including rate limiting.
+"""
+
+import re
+import threading
+import time
+from functools import wraps
+from emx.utils import parse_result, parse_timestamp
+
+
+_SUB_BUCKETS = 16
+_CHANNEL_RE = re.compile(r'"channel"\s*:\s*"([^"]*)"')
+_TIMESTAMP_RE = re.compile(r'"timestamp"\s*:\s*"([^"]*)"')
+
+
+class LatencyHistogram():
+    """ Log-linear histogram of durations with microsecond resolution.
+
+    Each power of two is split in 16 linear buckets, so recorded values are
+    accurate to about 6% and recording is O(1) without allocation.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (64 * _SUB_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _index(micros):
+        if micros < _SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - 5
+        return (shift + 1) * _SUB_BUCKETS + ((micros >> shift) - _SUB_BUCKETS)
+
+    @staticmethod
+    def _upper_bound(index):
+        major, minor = divmod(index, _SUB_BUCKETS)
+        if major == 0:
+            return minor
+        return (_SUB_BUCKETS + minor + 1) << (major - 1)
+
+    def record(self, seconds):
+        micros = int(seconds * 1e6)
+        if micros < 0:
+            micros = 0
+        self.counts[self._index(micros)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper bound in seconds of the bucket holding the q-th percentile (0-100)."""
+        if not self.count:
+            return 0.0
+        target = self.count * q / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(self._upper_bound(index) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max,
+        }
+
+
+class _ChannelStats():
+    __slots__ = ('messages', 'bytes', 'lag')
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.lag = LatencyHistogram()
+
+
+class Instrumentation():
+    """ Collects per-route latency histograms and per-channel WebSocket counters.
+
+    Hooks registered with :meth:`add_hook` are called synchronously on every
+    measurement as ``hook(kind, name, phase, value)`` with kind "rest" or "ws".
+    """
+
+    def __init__(self):
+        self._rest = {}
+        self._ws = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def _notify(self, kind, name, phase, value):
+        for hook in self._hooks:
+            hook(kind, name, phase, value)
+
+    def current_endpoint(self):
+        return getattr(self._local, "endpoint", None)
+
+    def record(self, endpoint, phase, seconds):
+        with self._lock:
+            histogram = self._rest.get((endpoint, phase))
+            if histogram is None:
+                histogram = self._rest[(endpoint, phase)] = LatencyHistogram()
+            histogram.record(seconds)
+        if self._hooks:
+            self._notify("rest", endpoint, phase, seconds)
+
+    def record_sign(self, seconds):
+        self._local.sign = seconds
+        self.record(self.current_endpoint() or "unknown", "sign", seconds)
+
+    def measure_route(self, name, func, args, kwargs):
+        """Run a whole route, recording its ``total`` phase."""
+        previous = self.current_endpoint()
+        self._local.endpoint = name
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(name, "total", time.perf_counter() - start)
+            self._local.endpoint = previous
+
+    def measure_request(self, func, args, kwargs, endpoint=None):
+        """Run a function returning a ``requests.Response`` and decode it,
+        recording the server, transfer and decode phases.
+
+        :param endpoint: (optional) name the phases are recorded under, defaults to the
+            route measured on this thread; worker threads of bulk calls must pass it
+        """
+        previous = self.current_endpoint()
+        if endpoint is None:
+            endpoint = previous or func.__name__
+        self._local.endpoint = endpoint
+        self._local.sign = 0.0
+        try:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            sent = time.perf_counter()
+            server = result.elapsed.total_seconds()
+            self.record(endpoint, "server", server)
+            self.record(endpoint, "transfer", max(0.0, sent - start - self._local.sign - server))
+            try:
+                return parse_result(result)
+            finally:
+                self.record(endpoint, "decode", time.perf_counter() - sent)
+        finally:
+            self._local.endpoint = previous
+
+    def on_ws_frame(self, frame, received_at=None):
+        """Count a raw WebSocket frame and measure the exchange-to-local lag
+        when the frame carries a timestamp."""
+        received_at = time.time() if received_at is None else received_at
+        if isinstance(frame, bytes):
+            frame = frame.decode("utf-8", "replace")
+        match = _CHANNEL_RE.search(frame)
+        channel = match.group(1) if match else "control"
+        match = _TIMESTAMP_RE.search(frame)
+        exchange_time = parse_timestamp(match.group(1)) if match else None
+
+        with self._lock:
+            stats = self._ws.get(channel)
+            if stats is None:
+                stats = self._ws[channel] = _ChannelStats()
+            stats.messages += 1
+            stats.bytes += len(frame)
+            if exchange_time is not None:
+                stats.lag.record(received_at - exchange_time)
+        if self._hooks:
+            self._notify("ws", channel, "bytes", len(frame))
+            if exchange_time is not None:
+                self._notify("ws", channel, "lag", received_at - exchange_time)
+
+    def stats(self):
+        """Snapshot of every measurement.
+
+        :returns: {"rest": {endpoint: {phase: {"count", "mean", "p50", "p99", "p999", "max"}}},
+                   "ws": {channel: {"messages", "bytes", "lag": {...}}}}
+        """
+        with self._lock:
+            rest = {}
+            for (endpoint, phase), histogram in self._rest.items():
+                rest.setdefault(endpoint, {})[phase] = histogram.snapshot()
+            ws = {channel: {"messages": stats.messages,
+                            "bytes": stats.bytes,
+                            "lag": stats.lag.snapshot()}
+                  for channel, stats in self._ws.items()}
+        return {"rest": rest, "ws": ws}
+
+    def reset(self):
+        with self._lock:
+            self._rest.clear()
+            self._ws.clear()
+
+
+def instrumented(func):
+    """Decorate a client route so its phases are attributed to the route name
+    when ``self.instrumentation`` is set."""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.instrumentation is None:
+            return func(self, *args, **kwargs)
+        return self.instrumentation.measure_route(func.__name__, func, (self,) + args, kwargs)
+    return wrapper
@@ -0,0 +1,252 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+import threading
+import time
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+from emx.contracts import ROUND_DOWN, ROUND_UP
+
+
+QuoteActions = namedtuple("QuoteActions", ["creates", "modifies", "cancels"])
+QuoteActions.__doc__ = """Requests needed to move the working orders of one contract to
+the target ladder, as accepted by ``RestApi.send_orders``."""
+
+
+def _key(value):
+    return round(float(value), 10)
+
+
+def _remaining(order):
+    remaining = order.remaining_size
+    return order.size if remaining is None else remaining
+
+
+class QuoteManager():
+    """ Keeps the orders of one or more contracts on a target ladder with the
+    fewest requests.
+
+    The caller declares the target (side, price, size) levels of a contract with
+    :meth:`set_quotes`. Working orders are read from an
+    :class:`emx.order_manager.OrderManager`; only orders whose client_id starts
+    with ``tag`` belong to the manager, so other orders are never touched.
+    Levels already in place (same price and remaining size) are kept, moved or
+    partially filled levels are modified, and the remaining levels are created
+    or cancelled, all in one concurrent batch. The batch is sent without
+    holding the manager lock, so other contracts can be requoted meanwhile.
+
+    A contract is requoted at most every ``min_interval`` seconds, and not
+    before the previous requote has been acknowledged (or ``ack_timeout``
+    passed). Targets set in between are kept, the latest one wins, and are
+    applied by :meth:`poll`.
+
+    :param rest_api: :class:`emx.rest_api.RestApi` sending the orders
+    :param order_manager: :class:`emx.order_manager.OrderManager` fed by the orders channel
+    :param registry: (optional) :class:`emx.contracts.ContractRegistry`; when given,
+        bid prices are rounded down, ask prices up and sizes down to the contract increments
+    :param min_interval: minimum seconds between two requotes of a contract
+    :param ack_timeout: seconds after which unacknowledged requests stop blocking requotes
+    :param post_only: send new orders as post only
+    :param tag: client_id prefix of the orders owned by the manager
+    """
+
+    def __init__(self, rest_api, order_manager, registry=None, min_interval=0.25, ack_timeout=2.0,
+                 post_only=False, tag="q"):
+        self.rest_api = rest_api
+        self.order_manager = order_manager
+        self.registry = registry
+        self.min_interval = min_interval
+        self.ack_timeout = ack_timeout
+        self.post_only = post_only
+        self.tag = "{}-{}-".format(tag, uuid.uuid4().hex[:6])
+        self.stats = {"requotes": 0, "throttled": 0, "creates": 0, "modifies": 0, "cancels": 0}
+
+        self._client_ids = itertools.count(1)
+        self._targets = {}
+        self._last_requote = {}
+        self._inflight = {}
+        # Contracts whose batch is being sent
+        self._sending = set()
+        self._lock = threading.RLock()
+
+    def owns(self, order):
+        return bool(order.client_id) and order.client_id.startswith(self.tag)
+
+    def _normalize(self, contract_code, quotes):
+        contract = self.registry.get(contract_code) if self.registry is not None else None
+        levels = []
+        for side, price, size in quotes:
+            if contract is not None:
+                price = contract.round_price(price, ROUND_DOWN if side == "buy" else ROUND_UP)
+                size = contract.round_size(size)
+            if _key(size) > 0:
+                levels.append((side, str(price), str(size)))
+        return levels
+
+    def diff(self, contract_code, quotes):
+        """Compute the requests moving the working orders to ``quotes``, without sending them.
+
+        :param quotes: iterable of (side, price, size)
+        :returns: :class:`QuoteActions`
+        """
+        levels = self._normalize(contract_code, quotes)
+        live = [order for order in self.order_manager.open_orders(contract_code) if self.owns(order)]
+        creates, modifies, cancels = [], [], []
+        for side in ("buy", "sell"):
+            wanted = [level for level in levels if level[0] == side]
+            working = [order for order in live if order.side == side]
+
+            # Levels already in place
+            missing = []
+            for level in wanted:
+                for order in working:
+                    if order.price is None or _remaining(order) is None:
+                        continue
+                    if _key(order.price) == _key(level[1]) and _key(_remaining(order)) == _key(level[2]):
+                        working.remove(order)
+                        break
+                else:
+                    missing.append(level)
+
+            # Move the closest working orders onto the missing levels, orders whose
+            # price is not known yet last. The order size includes what already
+            # filled, so the remaining size is the level size
+            missing.sort(key=lambda level: _key(level[1]))
+            working.sort(key=lambda order: (order.price is None, order.price or 0))
+            for level, order in zip(missing, working):
+                size = level[2]
+                if order.filled_size:
+                    size = str(Decimal(size) + Decimal(str(order.filled_size)))
+                modifies.append({"exchange_orderid": order.order_id, "order_type": order.type or "limit",
+                                 "order_side": side, "order_size": size, "order_price": level[1]})
+            for level in missing[len(working):]:
+                creates.append({"contract_code": contract_code, "order_type": "limit", "order_side": side,
+                                "size": level[2], "price": level[1], "post_only": self.post_only,
+                                "client_id": "{}{}".format(self.tag, next(self._client_ids))})
+            cancels.extend(order.order_id for order in working[len(missing):])
+        return QuoteActions(creates, modifies, cancels)
+
+    def set_quotes(self, contract_code, quotes, force=False):
+        """Declare the target ladder of a contract and requote it if allowed.
+
+        :param quotes: iterable of (side, price, size); an empty list cancels every level
+        :param force: ignore the requote throttle
+        :returns: (creates, modifies, cancels) lists of ``BulkResult`` as returned by
+            ``RestApi.send_orders``, or None when the requote is deferred or not needed
+        """
+        with self._lock:
+            self._targets[contract_code] = list(quotes)
+            if contract_code in self._sending or (not force and not self._due(contract_code)):
+                self.stats["throttled"] += 1
+                return None
+            quotes, actions = self._prepare(contract_code)
+        return self._send(contract_code, quotes, actions)
+
+    def cancel_quotes(self, contract_code):
+        """Cancel every level of a contract, ignoring the throttle."""
+        return self.set_quotes(contract_code, [], force=True)
+
+    def poll(self):
+        """Apply deferred targets that are now due.
+
+        :returns: {contract_code: results} of the requoted contracts
+        """
+        with self._lock:
+            due = [(contract_code,) + self._prepare(contract_code)
+                   for contract_code in list(self._targets) if self._due(contract_code)]
+        results = {}
+        for index, (contract_code, quotes, actions) in enumerate(due):
+            try:
+                result = self._send(contract_code, quotes, actions)
+            except Exception:
+                # Contracts not sent yet keep their target for the next poll
+                with self._lock:
+                    for other, other_quotes, other_actions in due[index + 1:]:
+                        if other_actions is not None:
+                            self._sending.discard(other)
+                            self._targets.setdefault(other, other_quotes)
+                raise
+            if result is not None:
+                results[contract_code] = result
+        return results
+
+    def _due(self, contract_code):
+        if contract_code in self._sending:
+            return False
+        last = self._last_requote.get(contract_code)
+        if last is not None and time.monotonic() - last < self.min_interval:
+            return False
+        return self._settled(contract_code)
+
+    def _settled(self, contract_code):
+        inflight = self._inflight.get(contract_code)
+        if inflight is None:
+            return True
+        deadline, client_ids, cancelled, moved = inflight
+        order_manager = self.order_manager
+        if time.monotonic() < deadline:
+            if any(order_manager.get_by_client_id(client_id) is None for client_id in client_ids):
+                return False
+            if any(order_id in order_manager for order_id in cancelled):
+                return False
+            for order_id, (price, size) in moved.items():
+                order = order_manager.get(order_id)
+                if order is not None and (_key(order.price) != _key(price) or _key(order.size) != _key(size)):
+                    return False
+        del self._inflight[contract_code]
+        return True
+
+    def _prepare(self, contract_code):
+        """Diff the target of a contract, under the lock. Returns (quotes, actions),
+        actions being None when nothing is to be sent; otherwise the contract is
+        marked as sending."""
+        quotes = self._targets.pop(contract_code)
+        actions = self.diff(contract_code, quotes)
+        if not (actions.creates or actions.modifies or actions.cancels):
+            return quotes, None
+        self._sending.add(contract_code)
+        return quotes, actions
+
+    def _send(self, contract_code, quotes, actions):
+        if actions is None:
+            return None
+        try:
+            create_results, modify_results, cancel_results = self.rest_api.send_orders(*actions)
+        except Exception:
+            with self._lock:
+                # Retried by the next poll, unless a newer target was set meanwhile
+                self._targets.setdefault(contract_code, quotes)
+            raise
+        finally:
+            with self._lock:
+                self._sending.discard(contract_code)
+                self._last_requote[contract_code] = time.monotonic()
+        with self._lock:
+            self.stats["requotes"] += 1
+            self.stats["creates"] += len(actions.creates)
+            self.stats["modifies"] += len(actions.modifies)
+            self.stats["cancels"] += len(actions.cancels)
+
+            # Only requests the exchange accepted are waited for
+            self._inflight[contract_code] = (
+                time.monotonic() + self.ack_timeout,
+                [order["client_id"] for order, result in zip(actions.creates, create_results) if result.ok],
+                [order_id for order_id, result in zip(actions.cancels, cancel_results) if result.ok],
+                {modify["exchange_orderid"]: (modify["order_price"], modify["order_size"])
+                 for modify, result in zip(actions.modifies, modify_results) if result.ok},
+            )
+        return create_results, modify_results, cancel_results
@@ -0,0 +1,151 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from emx import codec
+
+
+def _float(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+class Quote():
+    """Top of book update from the ``ticker`` channel."""
+
+    __slots__ = ('contract_code', 'bid', 'bid_size', 'ask', 'ask_size', 'last', 'mark', 'timestamp')
+    CHANNEL = "ticker"
+
+    def __init__(self, contract_code, data):
+        self.contract_code = contract_code
+        self.bid = _float(data.get("bid"))
+        self.bid_size = _float(data.get("bid_size"))
+        self.ask = _float(data.get("ask"))
+        self.ask_size = _float(data.get("ask_size"))
+        self.last = _float(data.get("last_trade_price", data.get("last")))
+        self.mark = _float(data.get("mark_price"))
+        self.timestamp = data.get("timestamp")
+
+    def to_dict(self):
+        return {"contract_code": self.contract_code, "bid": self.bid, "bid_size": self.bid_size,
+                "ask": self.ask, "ask_size": self.ask_size, "last_trade_price": self.last,
+                "mark_price": self.mark, "timestamp": self.timestamp}
+
+
+class Trade():
+    """Public trade from the ``trade`` channel."""
+
+    __slots__ = ('contract_code', 'price', 'size', 'side', 'timestamp')
+    CHANNEL = "trade"
+
+    def __init__(self, contract_code, data):
+        self.contract_code = contract_code
+        self.price = _float(data.get("price"))
+        self.size = _float(data.get("size"))
+        self.side = data.get("side")
+        self.timestamp = data.get("timestamp")
+
+    def to_dict(self):
+        return {"contract_code": self.contract_code, "price": self.price, "size": self.size,
+                "side": self.side, "timestamp": self.timestamp}
+
+
+class OrderUpdate():
+    """Private order event from the ``orders`` channel; ``type`` is the event
+    (received, accepted, modified, filled, canceled, ...)."""
+
+    __slots__ = ('contract_code', 'type', 'order_id', 'client_id', 'side', 'order_type',
+                 'size', 'price', 'fill_size', 'fill_price', 'status', 'timestamp')
+    CHANNEL = "orders"
+
+    def __init__(self, contract_code, msg_type, data):
+        self.contract_code = contract_code or data.get("contract_code")
+        self.type = msg_type
+        self.order_id = data.get("order_id")
+        self.client_id = data.get("client_id")
+        self.side = data.get("side")
+        self.order_type = data.get("type")
+        self.size = _float(data.get("size"))
+        self.price = _float(data.get("price"))
+        self.fill_size = _float(data.get("fill_size"))
+        self.fill_price = _float(data.get("fill_price"))
+        self.status = data.get("status")
+        self.timestamp = data.get("timestamp")
+
+    def to_dict(self):
+        data = {"contract_code": self.contract_code, "order_id": self.order_id, "client_id": self.client_id,
+                "side": self.side, "type": self.order_type, "status": self.status, "timestamp": self.timestamp}
+        # Absent numeric fields stay absent, as in the frame
+        for field in ('size', 'price', 'fill_size', 'fill_price'):
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        return data
+
+
+def _build(channel, contract_code, msg_type, data):
+    if channel == "ticker":
+        return Quote(contract_code, data)
+    if channel in ("trade", "trades"):
+        return Trade(contract_code, data)
+    return OrderUpdate(contract_code, msg_type, data)
+
+
+def decode_message(raw):
+    """Decode a WebSocket frame, turning known channels into typed records.
+
+    ``ticker`` messages become :class:`Quote`, ``trade`` messages :class:`Trade`
+    and ``orders`` messages :class:`OrderUpdate`. When ``data`` holds a list,
+    a list of records is returned. Any other message is returned as a dict.
+
+    :param raw: frame as returned by ``WebSocketApi.receive_msg`` (str, bytes or dict)
+    :returns: typed record, list of records, or dict
+    """
+    msg = raw if isinstance(raw, dict) else codec.loads(raw)
+    channel = msg.get("channel")
+    if channel not in ("ticker", "trade", "trades", "orders"):
+        return msg
+
+    data = msg.get("data", {})
+    contract_code = msg.get("contract_code")
+    msg_type = msg.get("type")
+    if isinstance(data, list):
+        return [_build(channel, contract_code, msg_type, item) for item in data]
+    return _build(channel, contract_code, msg_type, data)
+
+
+def as_dict(msg):
+    """Message dict of a frame in any form ``WebSocketApi.receive_msg`` returns.
+
+    Typed records from :func:`decode_message` are turned back into a message
+    dict, so consumers such as :class:`emx.order_manager.OrderManager` or
+    :class:`emx.dispatcher.WebSocketDispatcher` work with any decoder.
+
+    :param msg: raw json string or bytes, dict, typed record or list of records
+    :returns: dict; empty for an empty list of records
+    """
+    if isinstance(msg, dict):
+        return msg
+    if isinstance(msg, (str, bytes)):
+        return codec.loads(msg)
+    records = msg if isinstance(msg, list) else [msg]
+    if not records:
+        return {}
+    first = records[0]
+    data = [record.to_dict() for record in records] if isinstance(msg, list) else first.to_dict()
+    result = {"channel": first.CHANNEL, "contract_code": first.contract_code, "data": data}
+    if isinstance(first, OrderUpdate):
+        result["type"] = first.type
+    return result
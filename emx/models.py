@@ -0,0 +1,255 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" Compact records for orders, fills, positions and balances.
+
+Records keep only the fields they need in ``__slots__`` (no per-record dict).
+Numeric fields hold the raw API string until first read, then are converted
+once to a fixed-point ``int``:
+
+* prices use the contract price scale (``10 ** Scale.price_decimals``),
+* derived prices (averages, marks), which are not on the tick grid, use
+  ``DERIVED_PRICE_DECIMALS``,
+* sizes use the contract size scale (``10 ** Scale.size_decimals``),
+* money amounts use ``AMOUNT_DECIMALS``.
+
+Use :meth:`Record.to_float` to get a float back.
+"""
+
+from functools import wraps
+from emx.utils import EmxApiException
+
+
+AMOUNT_DECIMALS = 8
+DERIVED_PRICE_DECIMALS = 12
+DEFAULT_DECIMALS = 8
+
+
+def parse_fixed(value, decimals):
+    """Convert a decimal string to an integer scaled by ``10 ** decimals``.
+    Extra decimals are truncated.
+
+    :returns: int, or None for empty values
+    """
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str) or 'e' in value or 'E' in value:
+        return int(round(float(value) * 10 ** decimals))
+    negative = value[0] == '-'
+    if negative or value[0] == '+':
+        value = value[1:]
+    whole, _, frac = value.partition('.')
+    frac = (frac + '0' * decimals)[:decimals]
+    result = int(whole or '0') * 10 ** decimals + int(frac or '0')
+    return -result if negative else result
+
+
+class Scale():
+    """Price and size decimals of one contract, shared by all its records."""
+
+    __slots__ = ('price_decimals', 'size_decimals')
+
+    def __init__(self, price_decimals=DEFAULT_DECIMALS, size_decimals=DEFAULT_DECIMALS):
+        self.price_decimals = price_decimals
+        self.size_decimals = size_decimals
+
+
+DEFAULT_SCALE = Scale()
+
+
+class _Fixed():
+    """Descriptor converting a raw string slot to fixed point on first access."""
+
+    __slots__ = ('slot', 'kind')
+
+    def __init__(self, slot, kind):
+        self.slot = slot
+        self.kind = kind
+
+    def decimals(self, obj):
+        if self.kind == 'price':
+            return obj._scale.price_decimals
+        if self.kind == 'size':
+            return obj._scale.size_decimals
+        if self.kind == 'derived_price':
+            return DERIVED_PRICE_DECIMALS
+        return AMOUNT_DECIMALS
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if isinstance(value, str):
+            value = parse_fixed(value, self.decimals(obj))
+            setattr(obj, self.slot, value)
+        return value
+
+
+class _RecordMeta(type):
+    """Builds slots and descriptors from the ``_text``, ``_prices``,
+    ``_derived_prices``, ``_sizes`` and ``_amounts`` field lists of a record class."""
+
+    def __new__(mcs, name, bases, namespace):
+        if not bases:
+            return super().__new__(mcs, name, bases, namespace)
+        text = namespace.get('_text', ())
+        fixed = [(field, kind) for kind in ('price', 'derived_price', 'size', 'amount')
+                 for field in namespace.get('_{}s'.format(kind), ())]
+        namespace['__slots__'] = tuple(text) + tuple('_' + field for field, _ in fixed)
+        for field, kind in fixed:
+            namespace[field] = _Fixed('_' + field, kind)
+        namespace['_fields'] = tuple(text) + tuple(field for field, _ in fixed)
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class Record(metaclass=_RecordMeta):
+    """Base class of all records."""
+
+    __slots__ = ('_scale',)
+
+    def __init__(self, raw, scale=DEFAULT_SCALE):
+        self._scale = scale
+        for field in self._text:
+            setattr(self, field, raw.get(field))
+        for field in self._fixed_fields():
+            setattr(self, '_' + field, raw.get(field))
+
+    @classmethod
+    def _fixed_fields(cls):
+        return cls._prices + cls._derived_prices + cls._sizes + cls._amounts
+
+    def __getitem__(self, field):
+        # Allows records to be used where response dicts were expected
+        if field not in self._fields:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def to_float(self, field):
+        """Value of a fixed-point field as a float."""
+        value = getattr(self, field)
+        if value is None or field in self._text:
+            return value
+        return value / 10 ** type(self).__dict__[field].decimals(self)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            "{}={!r}".format(field, getattr(self, field)) for field in self._fields))
+
+
+class Order(Record):
+    _text = ('order_id', 'client_id', 'contract_code', 'type', 'side', 'status', 'timestamp')
+    _prices = ('price', 'stop_price')
+    _derived_prices = ('average_fill_price',)
+    _sizes = ('size', 'filled_size')
+    _amounts = ()
+
+
+class Fill(Record):
+    _text = ('fill_id', 'order_id', 'client_id', 'contract_code', 'side', 'timestamp')
+    _prices = ('price',)
+    _derived_prices = ()
+    _sizes = ('size',)
+    _amounts = ('fee',)
+
+
+class Position(Record):
+    _text = ('trader_id', 'contract_code', 'marking_time')
+    _prices = ()
+    _derived_prices = ('marking_price', 'average_entry_price')
+    _sizes = ('quantity',)
+    _amounts = ('cost', 'day_closed_pl', 'open_pl')
+
+
+class Balance(Record):
+    _text = ()
+    _prices = ()
+    _derived_prices = ()
+    _sizes = ()
+    _amounts = ('initial_margin_required', 'maintenance_margin_required', 'unrealized_profit',
+                'net_liquidation_value', 'available_funds', 'excess_liquidity', 'holds')
+
+
+class ScaleResolver():
+    """ Caches one :class:`Scale` per contract, taken from a
+    :class:`emx.contracts.ContractRegistry`. A contract missing from the registry
+    reloads it once, so a field of a contract is always parsed in the same units.
+    Without a registry, or for records without a contract, ``DEFAULT_SCALE`` is used.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry
+        self._scales = {}
+
+    def __call__(self, contract_code):
+        scale = self._scales.get(contract_code)
+        if scale is None:
+            if self.registry is None or not contract_code:
+                return DEFAULT_SCALE
+            if contract_code not in self.registry:
+                # Membership does not refresh the registry
+                self.registry.refresh()
+                if contract_code not in self.registry:
+                    raise EmxApiException("Unknown contract {}, no scale to parse it".format(contract_code))
+            contract = self.registry.get(contract_code)
+            scale = self._scales[contract_code] = Scale(contract.price_decimals, contract.size_decimals)
+        return scale
+
+
+def get_field(item, field):
+    """Read a field from a response dict or a record; None when missing."""
+    if isinstance(item, Record):
+        return getattr(item, field) if field in item._fields else None
+    return item.get(field)
+
+
+def get_float(item, field):
+    """Read a numeric field from a response dict or a record as a float."""
+    if isinstance(item, Record):
+        return item.to_float(field) if field in item._fields else None
+    value = item.get(field)
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def build_records(model, items, resolve_scale):
+    return [model(item, resolve_scale(item.get("contract_code"))) for item in items]
+
+
+def typed_result(model, key=None):
+    """Decorate a RestApi route so it returns records when ``self.typed`` is set.
+
+    :param model: record class
+    :param key: (optional) response key holding the record list; without it the
+        result itself is a record (dict response) or a list of records
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            result = func(self, *args, **kwargs)
+            if not self.typed:
+                return result
+            resolve_scale = self._scale_resolver()
+            if key is not None:
+                result[key] = build_records(model, result.get(key, []), resolve_scale)
+                return result
+            if isinstance(result, list):
+                return build_records(model, result, resolve_scale)
+            return model(result, resolve_scale(result.get("contract_code")))
+        return wrapper
+    return decorator
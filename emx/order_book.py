@@ -0,0 +1,370 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from emx.messages import as_dict
+from emx.utils import EmxApiException
+
+logger = logging.getLogger(__name__)
+
+
+BID_SIDES = ("buy", "bid", "bids")
+ASK_SIDES = ("sell", "ask", "asks")
+
+# Levels per chunk of a ladder before it is split in two
+CHUNK_SIZE = 64
+
+
+class Ladder():
+    """ One side of a book kept sorted in contiguous chunks.
+
+    Sort keys (prices, negated on the bid side) and sizes live in parallel
+    ``array('d')`` chunks of at most ``2 * CHUNK_SIZE`` levels, with the last
+    key of every chunk in ``_maxes``. An update is a binary search over
+    ``_maxes``, another inside one chunk and a bounded shift in that chunk, so
+    it is O(log n) whatever the depth of the book. Level 0 is always the best.
+    """
+
+    __slots__ = ('_keys', '_sizes', '_maxes', '_len', '_sign')
+
+    def __init__(self, is_bid):
+        self._sign = -1.0 if is_bid else 1.0
+        self._keys = []
+        self._sizes = []
+        self._maxes = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def clear(self):
+        self._keys = []
+        self._sizes = []
+        self._maxes = []
+        self._len = 0
+
+    def update(self, price, size):
+        """Set the size at a price level. A size of zero removes the level.
+
+        :param price: level price
+        :type price: float
+        :param size: new aggregated size at this level
+        :type size: float
+        :returns: None
+        """
+        key = self._sign * price
+        maxes = self._maxes
+        c = bisect_left(maxes, key)
+        if c == len(maxes):
+            if not size:
+                return
+            if not maxes:
+                self._keys.append(array('d', (key,)))
+                self._sizes.append(array('d', (size,)))
+                maxes.append(key)
+                self._len = 1
+                return
+            # Beyond the worst level: append to the last chunk
+            c -= 1
+        keys = self._keys[c]
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            if size:
+                self._sizes[c][i] = size
+                return
+            del keys[i]
+            del self._sizes[c][i]
+            self._len -= 1
+            if not keys:
+                del self._keys[c]
+                del self._sizes[c]
+                del maxes[c]
+            elif i == len(keys):
+                maxes[c] = keys[-1]
+        elif size:
+            keys.insert(i, key)
+            self._sizes[c].insert(i, size)
+            self._len += 1
+            if i == len(keys) - 1:
+                maxes[c] = key
+            if len(keys) > 2 * CHUNK_SIZE:
+                self._keys[c + 1:c + 1] = [keys[CHUNK_SIZE:]]
+                self._sizes[c + 1:c + 1] = [self._sizes[c][CHUNK_SIZE:]]
+                del keys[CHUNK_SIZE:]
+                del self._sizes[c][CHUNK_SIZE:]
+                maxes[c:c + 1] = [keys[-1], self._keys[c + 1][-1]]
+
+    def size_at(self, price):
+        key = self._sign * price
+        c = bisect_left(self._maxes, key)
+        if c == len(self._maxes):
+            return 0.0
+        keys = self._keys[c]
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return self._sizes[c][i]
+        return 0.0
+
+    def best_price(self):
+        return self._sign * self._keys[0][0] if self._len else None
+
+    def best_size(self):
+        return self._sizes[0][0] if self._len else 0.0
+
+    def copy_levels(self, n, prices_out, sizes_out):
+        """Copy the best n levels into preallocated buffers.
+
+        :returns: number of levels written
+        """
+        sign = self._sign
+        count = 0
+        for keys, sizes in zip(self._keys, self._sizes):
+            for i in range(min(len(keys), n - count)):
+                prices_out[count] = sign * keys[i]
+                sizes_out[count] = sizes[i]
+                count += 1
+            if count == n:
+                break
+        return count
+
+
+class OrderBook():
+    """ Level 2 book for a single contract.
+
+    .. note::
+       Query methods return plain floats or fill caller supplied buffers,
+       so reading the book on every tick does not allocate.
+    """
+
+    def __init__(self, contract_code):
+        self.contract_code = contract_code
+        self.bids = Ladder(is_bid=True)
+        self.asks = Ladder(is_bid=False)
+        self.sequence = None
+        self.synced = False
+
+    def apply_snapshot(self, bids, asks, sequence=None):
+        """Replace the book content.
+
+        :param bids: iterable of [price, size] pairs
+        :param asks: iterable of [price, size] pairs
+        :param sequence: (optional) sequence number of the snapshot
+        :returns: None
+        """
+        self.bids.clear()
+        self.asks.clear()
+        for level in bids:
+            self.bids.update(float(level[0]), float(level[1]))
+        for level in asks:
+            self.asks.update(float(level[0]), float(level[1]))
+        self.sequence = sequence
+        self.synced = True
+
+    def apply_changes(self, changes):
+        """Apply incremental level changes.
+
+        :param changes: iterable of [side, price, size] triples
+        :returns: None
+        """
+        for side, price, size in changes:
+            if side in BID_SIDES:
+                self.bids.update(float(price), float(size))
+            elif side in ASK_SIDES:
+                self.asks.update(float(price), float(size))
+            else:
+                raise EmxApiException("Unknown book side: {}".format(side))
+
+    def best_bid(self):
+        return self.bids.best_price()
+
+    def best_ask(self):
+        return self.asks.best_price()
+
+    def best_bid_size(self):
+        return self.bids.best_size()
+
+    def best_ask_size(self):
+        return self.asks.best_size()
+
+    def mid(self):
+        if not self.bids or not self.asks:
+            return None
+        return (self.bids.best_price() + self.asks.best_price()) / 2.0
+
+    def depth(self, side, n, prices_out, sizes_out):
+        """Copy the best n levels of one side into preallocated buffers.
+
+        :param side: 'buy'/'bid' or 'sell'/'ask'
+        :param n: number of levels requested
+        :param prices_out: mutable sequence with room for at least n items
+        :param sizes_out: mutable sequence with room for at least n items
+        :returns: number of levels actually written
+        """
+        ladder = self.bids if side in BID_SIDES else self.asks
+        return ladder.copy_levels(n, prices_out, sizes_out)
+
+
+def _get_sequence(msg, data):
+    seq = data.get("sequence")
+    if seq is None:
+        seq = msg.get("sequence")
+    return seq
+
+
+class OrderBookManager():
+    """ Keeps one :class:`OrderBook` per contract up to date from level2 messages.
+
+    When an update does not follow the previous sequence number, or arrives
+    before any snapshot, the book is marked out of sync (``book.synced`` is
+    False) and updates are buffered. With a ``rest_api``, a background thread
+    loads ``get_contract_book`` meanwhile, so the receive path never waits on
+    REST; the snapshot is applied by the next :meth:`on_message` call, followed
+    by the buffered updates it does not contain. Without one, the buffer is
+    replayed on the next ``snapshot`` message.
+
+    :param rest_api: (optional) :class:`emx.rest_api.RestApi` used for re-snapshots
+    :param max_buffered: updates buffered per out of sync book; older ones are dropped
+    :param retry_interval: minimum seconds between two REST snapshots of a contract
+    """
+
+    def __init__(self, rest_api=None, max_buffered=10000, retry_interval=1.0):
+        self.rest_api = rest_api
+        self.max_buffered = max_buffered
+        self.retry_interval = retry_interval
+        self.books = {}
+        self._buffered = {}
+        # contract_code -> REST snapshot loaded in the background, not applied yet
+        self._fetched = {}
+        self._fetching = set()
+        self._failed_at = {}
+        self._lock = threading.Lock()
+
+    def get_book(self, contract_code):
+        book = self.books.get(contract_code)
+        if book is None:
+            book = self.books[contract_code] = OrderBook(contract_code)
+        return book
+
+    def on_message(self, msg):
+        """Feed a level2 message received from :class:`emx.ws_api.WebSocketApi`.
+        Messages from other channels are ignored.
+
+        :param msg: raw json string, decoded dict or :mod:`emx.messages` record
+        :returns: the updated :class:`OrderBook` or None
+        """
+        if self._fetched:
+            self._apply_fetched()
+        msg = as_dict(msg)
+        if msg.get("channel") != "level2":
+            return None
+
+        book = self.get_book(msg["contract_code"])
+        data = msg.get("data", {})
+        seq = _get_sequence(msg, data)
+
+        if msg.get("type") == "snapshot":
+            self._apply_snapshot(book, data.get("bids", ()), data.get("asks", ()), seq)
+            return book
+
+        if book.synced and seq is not None and book.sequence is not None and seq > book.sequence + 1:
+            book.synced = False
+        if not book.synced:
+            self._buffer(book, seq, data.get("changes", ()))
+            return book
+        self._apply_changes(book, seq, data.get("changes", ()))
+        return book
+
+    @staticmethod
+    def _apply_changes(book, seq, changes):
+        if seq is not None and book.sequence is not None and seq <= book.sequence:
+            # Already contained in the current snapshot
+            return
+        book.apply_changes(changes)
+        if seq is not None:
+            book.sequence = seq
+
+    def _buffer(self, book, seq, changes):
+        buffered = self._buffered.get(book.contract_code)
+        if buffered is None:
+            buffered = self._buffered[book.contract_code] = deque(maxlen=self.max_buffered)
+        buffered.append((seq, changes))
+        if self.rest_api is not None:
+            self._fetch_in_background(book.contract_code)
+
+    def _apply_snapshot(self, book, bids, asks, seq):
+        book.apply_snapshot(bids, asks, seq)
+        buffered = self._buffered.pop(book.contract_code, ())
+        for update_seq, changes in buffered:
+            if update_seq is not None and book.sequence is not None and update_seq > book.sequence + 1:
+                # The snapshot is older than the buffered updates: try again
+                book.synced = False
+                self._buffer(book, update_seq, changes)
+                continue
+            if book.synced:
+                self._apply_changes(book, update_seq, changes)
+            else:
+                self._buffer(book, update_seq, changes)
+
+    def _fetch_in_background(self, contract_code):
+        with self._lock:
+            if contract_code in self._fetching:
+                return
+            failed_at = self._failed_at.get(contract_code)
+            if failed_at is not None and time.monotonic() - failed_at < self.retry_interval:
+                return
+            self._fetching.add(contract_code)
+
+        def run():
+            try:
+                self._fetched[contract_code] = self.rest_api.get_contract_book(contract_code)
+                self._failed_at.pop(contract_code, None)
+            except Exception:
+                logger.exception("Snapshot of book %s failed", contract_code)
+                self._failed_at[contract_code] = time.monotonic()
+            finally:
+                with self._lock:
+                    self._fetching.discard(contract_code)
+
+        threading.Thread(target=run, name="emx-book-snapshot", daemon=True).start()
+
+    def _apply_fetched(self):
+        for contract_code in list(self._fetched):
+            snapshot = self._fetched.pop(contract_code)
+            book = self.get_book(contract_code)
+            if not book.synced:
+                # Otherwise a snapshot message already resynced the book
+                self._apply_snapshot(book, snapshot.get("bids", ()), snapshot.get("asks", ()),
+                                     snapshot.get("sequence"))
+
+    def resnapshot(self, contract_code):
+        """Rebuild a book from a REST snapshot now, then replay the buffered updates.
+        Unlike the automatic re-snapshots, this waits for the request.
+
+        :param contract_code: contract to rebuild
+        :returns: None
+        :raises: EmxApiException if no rest_api was provided
+        """
+        book = self.get_book(contract_code)
+        book.synced = False
+        if self.rest_api is None:
+            raise EmxApiException("Book {} is out of sync and no rest_api is set".format(contract_code))
+        snapshot = self.rest_api.get_contract_book(contract_code)
+        self._apply_snapshot(book, snapshot.get("bids", ()), snapshot.get("asks", ()),
+                             snapshot.get("sequence"))
@@ -0,0 +1,301 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from emx.messages import as_dict
+from emx.models import get_field, get_float
+from emx.utils import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+TERMINAL_EVENTS = ("canceled", "cancelled", "done", "rejected", "expired")
+TERMINAL_STATUSES = ("canceled", "cancelled", "done", "rejected", "expired", "filled")
+
+
+class LiveOrder():
+    """State of one working order, as known from the ``orders`` channel."""
+
+    __slots__ = ('order_id', 'client_id', 'contract_code', 'side', 'type', 'price', 'stop_price',
+                 'size', 'filled_size', 'average_fill_price', 'status', 'timestamp')
+
+    def __init__(self, order_id):
+        self.order_id = order_id
+        self.client_id = None
+        self.contract_code = None
+        self.side = None
+        self.type = None
+        self.price = None
+        self.stop_price = None
+        self.size = None
+        self.filled_size = 0.0
+        self.average_fill_price = None
+        self.status = None
+        self.timestamp = None
+
+    @property
+    def remaining_size(self):
+        if self.size is None:
+            return None
+        return self.size - self.filled_size
+
+    def update(self, data):
+        """Copy the fields present in an order dict or :class:`emx.models.Order`."""
+        for field in ('client_id', 'contract_code', 'side', 'type', 'status', 'timestamp'):
+            value = get_field(data, field)
+            if value not in (None, ""):
+                setattr(self, field, value)
+        for field in ('price', 'stop_price', 'size', 'filled_size', 'average_fill_price'):
+            value = get_float(data, field)
+            if value is not None:
+                setattr(self, field, value)
+
+    def __repr__(self):
+        return "LiveOrder({})".format(", ".join(
+            "{}={!r}".format(field, getattr(self, field)) for field in self.__slots__))
+
+
+class OrderManager():
+    """ In-memory index of working orders fed by the ``orders`` channel.
+
+    Orders are indexed by order_id, client_id and contract code, so open order
+    queries never hit the API. The index is rebuilt from ``list_orders`` by
+    :meth:`reconcile`, at start up and, on a background thread, whenever
+    :class:`emx.ws_api.WebSocketApi` reports a ``resynced`` event for the
+    ``orders`` channel. Events received while the snapshot is loading are applied
+    on top of it, except those not newer than the snapshot of their order; a
+    ``fill_size`` without timestamps is not added to a snapshot order, whose
+    ``filled_size`` may already include it.
+
+    :param rest_api: :class:`emx.rest_api.RestApi` used to load the snapshot
+    :param ws_api: (optional) :class:`emx.ws_api.WebSocketApi` subscribed by :meth:`start`
+    :param open_status: ``list_orders`` status filter selecting working orders
+    :param on_error: (optional) callable receiving the exception of a failed background
+        reconcile; failures are logged by default
+    """
+
+    def __init__(self, rest_api, ws_api=None, open_status="accepted", on_error=None):
+        self.rest_api = rest_api
+        self.ws_api = ws_api
+        self.open_status = open_status
+        self.on_error = on_error
+
+        self._orders = {}
+        self._by_client_id = {}
+        self._by_contract = {}
+        self._lock = threading.RLock()
+        self._pending = None
+        self._reconciling = False
+        self._reconcile_again = False
+
+    def start(self, contract_codes):
+        """Subscribe to the ``orders`` channel and load the open orders snapshot.
+
+        :param contract_codes: contracts to track
+        :returns: None
+        """
+        if self.ws_api is not None:
+            self.ws_api.subscribe(contract_codes, ["orders"])
+        self.reconcile()
+
+    ### Queries ###
+
+    def get(self, order_id):
+        """:returns: :class:`LiveOrder` or None"""
+        return self._orders.get(order_id)
+
+    def get_by_client_id(self, client_id):
+        """:returns: :class:`LiveOrder` or None"""
+        order_id = self._by_client_id.get(client_id)
+        return self._orders.get(order_id) if order_id is not None else None
+
+    def open_orders(self, contract_code=None):
+        """Working orders, for one contract or for all of them.
+
+        :returns: list of :class:`LiveOrder`
+        """
+        with self._lock:
+            if contract_code is None:
+                return list(self._orders.values())
+            return [self._orders[order_id] for order_id in self._by_contract.get(contract_code, ())]
+
+    def count(self, contract_code=None):
+        if contract_code is None:
+            return len(self._orders)
+        return len(self._by_contract.get(contract_code, ()))
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def __len__(self):
+        return len(self._orders)
+
+    ### Updates ###
+
+    def on_message(self, msg):
+        """Apply a message received from :class:`emx.ws_api.WebSocketApi`.
+        Messages from other channels are ignored.
+
+        :param msg: raw json string, decoded dict or :mod:`emx.messages` record
+        :returns: the updated :class:`LiveOrder`, or None
+        """
+        msg = as_dict(msg)
+        if msg.get("type") == "resynced":
+            if any(channel.get("name") == "orders" for channel in msg.get("channels", ())):
+                self.reconcile_in_background()
+            return None
+        if msg.get("channel") != "orders":
+            return None
+
+        data = msg.get("data", {})
+        items = data if isinstance(data, list) else [data]
+        order = None
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(msg)
+                return None
+            for item in items:
+                order = self._apply(msg.get("type"), msg.get("contract_code"), item)
+        return order
+
+    def _apply(self, event, contract_code, data, snapshot_ids=()):
+        order_id = data.get("order_id")
+        if not order_id:
+            return None
+        order = self._orders.get(order_id)
+        from_snapshot = order is not None and order_id in snapshot_ids
+        if from_snapshot:
+            newer = _is_newer(data.get("timestamp"), order.timestamp)
+            if newer is False:
+                # Already contained in the snapshot
+                return order
+        if event in TERMINAL_EVENTS or data.get("status") in TERMINAL_STATUSES:
+            if order is not None:
+                order.update(data)
+                self._remove(order)
+            return order
+
+        if order is None:
+            order = LiveOrder(order_id)
+            order.contract_code = contract_code
+        if event == "filled" and "filled_size" not in data and not (from_snapshot and newer is None):
+            order.filled_size += get_float(data, "fill_size") or 0.0
+        order.update(data)
+        if order.remaining_size is not None and order.remaining_size <= 0:
+            self._remove(order)
+        else:
+            self._index(order)
+        return order
+
+    def _index(self, order):
+        self._orders[order.order_id] = order
+        if order.client_id:
+            self._by_client_id[order.client_id] = order.order_id
+        self._by_contract.setdefault(order.contract_code, set()).add(order.order_id)
+
+    def _remove(self, order):
+        if self._orders.pop(order.order_id, None) is None:
+            return
+        if self._by_client_id.get(order.client_id) == order.order_id:
+            del self._by_client_id[order.client_id]
+        order_ids = self._by_contract.get(order.contract_code)
+        if order_ids is not None:
+            order_ids.discard(order.order_id)
+            if not order_ids:
+                del self._by_contract[order.contract_code]
+
+    def reconcile(self):
+        """Rebuild the index from a ``list_orders`` snapshot of working orders.
+
+        :returns: None
+        :raises: EmxApiException if the snapshot cannot be loaded; the current
+            index is kept in that case
+        """
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        snapshot = None
+        try:
+            orders = []
+            for item in self.rest_api.iter_orders(status=self.open_status):
+                if get_field(item, "status") not in TERMINAL_STATUSES:
+                    order = LiveOrder(get_field(item, "order_id"))
+                    order.update(item)
+                    orders.append(order)
+            # Only a complete snapshot replaces the index
+            snapshot = orders
+        finally:
+            with self._lock:
+                if snapshot is not None:
+                    self._orders = {}
+                    self._by_client_id = {}
+                    self._by_contract = {}
+                    for order in snapshot:
+                        self._index(order)
+                pending, self._pending = self._pending, None
+                snapshot_ids = set(order.order_id for order in snapshot) if snapshot is not None else ()
+                for msg in pending:
+                    data = msg.get("data", {})
+                    for item in data if isinstance(data, list) else [data]:
+                        self._apply(msg.get("type"), msg.get("contract_code"), item, snapshot_ids)
+
+    def reconcile_in_background(self):
+        """Run :meth:`reconcile` on a background thread, so the receive loop never
+        waits for the snapshot. Events are buffered from now on. A request made
+        while a reconcile runs starts another one after it.
+
+        :returns: None
+        """
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+            if self._reconciling:
+                self._reconcile_again = True
+                return
+            self._reconciling = True
+
+        def run():
+            while True:
+                try:
+                    self.reconcile()
+                except Exception as err:
+                    if self.on_error is None:
+                        logger.exception("Order reconcile failed")
+                    else:
+                        try:
+                            self.on_error(err)
+                        except Exception:
+                            logger.exception("Order reconcile on_error callback failed")
+                with self._lock:
+                    if not self._reconcile_again:
+                        self._reconciling = False
+                        return
+                    self._reconcile_again = False
+                    if self._pending is None:
+                        self._pending = []
+
+        threading.Thread(target=run, name="emx-orders-reconcile", daemon=True).start()
+
+
+def _is_newer(event_time, snapshot_time):
+    """:returns: whether an event is newer than a snapshot, None when unknown"""
+    if not event_time or not snapshot_time:
+        return None
+    event_time = parse_timestamp(event_time)
+    snapshot_time = parse_timestamp(snapshot_time)
+    if event_time is None or snapshot_time is None:
+        return None
+    return event_time > snapshot_time
@@ -0,0 +1,74 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from concurrent.futures import ThreadPoolExecutor
+from emx.utils import EmxApiException
+
+
+class PageIterator():
+    """ Yields the records of a cursor-paginated route one at a time.
+
+    The next page is requested on a background thread as soon as the current
+    one arrives, so at most two pages are held in memory. ``cursor`` is the id of
+    the last record yielded; pass it back as ``after`` to resume later.
+
+    A page ending on a cursor already requested raises EmxApiException instead
+    of looping over the same pages forever.
+
+    :param fetch_page: callable taking an ``after`` cursor and returning the response dict
+    :param records_key: key of the record list in the response, e.g. "fills"
+    :param id_field: record field used as the ``after`` cursor of the next page
+    :param after: (optional) cursor to start from
+    """
+
+    def __init__(self, fetch_page, records_key, id_field, after=""):
+        self.cursor = after
+        self._fetch_page = fetch_page
+        self._records_key = records_key
+        self._id_field = id_field
+        self._records = self._iterate()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._records)
+
+    def close(self):
+        self._records.close()
+
+    def _fetch(self, after):
+        return self._fetch_page(after).get(self._records_key, [])
+
+    def _iterate(self):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="emx-pages")
+        try:
+            requested = {self.cursor}
+            pending = executor.submit(self._fetch, self.cursor)
+            while True:
+                page = pending.result()
+                if not page:
+                    return
+                after = page[-1][self._id_field]
+                if after in requested:
+                    raise EmxApiException("Pagination cursor did not advance past {}".format(after))
+                requested.add(after)
+                pending = executor.submit(self._fetch, after)
+                for record in page:
+                    self.cursor = record[self._id_field]
+                    yield record
+                del page
+        finally:
+            executor.shutdown(wait=False)
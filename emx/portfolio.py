@@ -0,0 +1,328 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" Local positions and PnL, updated from fills and revalued from marks.
+
+Requires NumPy. Every contract owns one row in a set of parallel arrays
+(quantity, entry cost, mark, margin rate, realized PnL). Fills update one row;
+marks are written in place and the whole book is revalued in a single
+vectorized pass the next time a figure is read.
+"""
+
+import logging
+import threading
+import numpy as np
+from emx.messages import as_dict
+from emx.models import get_field, get_float
+
+logger = logging.getLogger(__name__)
+
+
+class Portfolio():
+    """ Incremental position and PnL engine.
+
+    Quantities are signed (positive is long). ``cost`` is the signed entry
+    notional of the open quantity, so ``open_pnl = quantity * mark - cost``.
+    Margin usage is estimated as ``|quantity| * mark * margin_rate``.
+
+    :param rest_api: (optional) :class:`emx.rest_api.RestApi` used by :meth:`reconcile`
+    :param margin_rates: (optional) {contract_code: initial margin rate}
+    :param default_margin_rate: margin rate of contracts missing from ``margin_rates``
+    :param tolerance: quantity difference under which :meth:`reconcile` reports no drift
+    """
+
+    def __init__(self, rest_api=None, margin_rates=None, default_margin_rate=0.1, tolerance=1e-9,
+                 capacity=64):
+        self.rest_api = rest_api
+        self.margin_rates = dict(margin_rates or {})
+        self.default_margin_rate = default_margin_rate
+        self.tolerance = tolerance
+        self.last_drift = []
+
+        self._index = {}
+        self._codes = []
+        self._quantity = np.zeros(capacity)
+        self._cost = np.zeros(capacity)
+        self._mark = np.full(capacity, np.nan)
+        self._margin_rate = np.zeros(capacity)
+        self._realized = np.zeros(capacity)
+        self._open_pnl = np.zeros(capacity)
+        self._margin = np.zeros(capacity)
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._reconcile_stop = None
+        # Contracts filled while a reconcile snapshot is loading, None otherwise
+        self._filled_during_fetch = None
+        self._previous_drift = {}
+
+    def _row(self, contract_code):
+        row = self._index.get(contract_code)
+        if row is not None:
+            return row
+        row = len(self._codes)
+        if row == len(self._quantity):
+            self._grow()
+        self._index[contract_code] = row
+        self._codes.append(contract_code)
+        self._margin_rate[row] = self.margin_rates.get(contract_code, self.default_margin_rate)
+        return row
+
+    def _grow(self):
+        size = len(self._quantity)
+        for name in ('_quantity', '_cost', '_realized', '_margin_rate', '_open_pnl', '_margin'):
+            setattr(self, name, np.concatenate((getattr(self, name), np.zeros(size))))
+        self._mark = np.concatenate((self._mark, np.full(size, np.nan)))
+
+    ### Updates ###
+
+    def on_fill(self, contract_code, side, size, price, fee=0.0):
+        """Apply one execution.
+
+        :param side: 'buy' or 'sell'
+        :param size: filled size (positive)
+        :param price: fill price
+        :param fee: (optional) fee charged, booked in realized PnL
+        :returns: None
+        """
+        size = float(size)
+        price = float(price)
+        signed = size if side == "buy" else -size
+        with self._lock:
+            if self._filled_during_fetch is not None:
+                self._filled_during_fetch.add(contract_code)
+            row = self._row(contract_code)
+            quantity = self._quantity[row]
+            cost = self._cost[row]
+            if quantity == 0 or (quantity > 0) == (signed > 0):
+                cost += signed * price
+            else:
+                # Reduce at the average entry price, then open the remainder (if the fill flips the position)
+                closed = min(abs(signed), abs(quantity))
+                entry = cost / quantity
+                direction = 1.0 if quantity > 0 else -1.0
+                self._realized[row] += closed * (price - entry) * direction
+                cost -= closed * entry * direction
+                if abs(signed) > closed:
+                    cost = (signed + quantity) * price
+            self._quantity[row] = quantity + signed
+            self._cost[row] = 0.0 if abs(quantity + signed) <= self.tolerance else cost
+            self._realized[row] -= float(fee or 0.0)
+            self._dirty = True
+
+    def update_mark(self, contract_code, price):
+        """Set the mark price of one contract. Revaluation is deferred to the next read."""
+        with self._lock:
+            row = self._row(contract_code)
+            self._mark[row] = float(price)
+            self._dirty = True
+
+    def update_marks(self, marks):
+        """Set several mark prices at once.
+
+        :param marks: {contract_code: price}
+        """
+        with self._lock:
+            rows = [self._row(code) for code in marks]
+            self._mark[rows] = np.fromiter(marks.values(), dtype=float, count=len(rows))
+            self._dirty = True
+
+    def on_message(self, msg):
+        """Apply a WebSocket message: ``filled`` events of the ``orders`` channel
+        update positions, ``ticker`` messages update marks (mark price, else last
+        trade price). Other messages are ignored.
+
+        :param msg: raw json string, decoded dict or :mod:`emx.messages` record
+        :returns: None
+        """
+        msg = as_dict(msg)
+        channel = msg.get("channel")
+        data = msg.get("data", {})
+        items = data if isinstance(data, list) else [data]
+        if channel == "orders" and msg.get("type") == "filled":
+            for item in items:
+                size = get_float(item, "fill_size")
+                if size:
+                    self.on_fill(item.get("contract_code") or msg.get("contract_code"), item.get("side"),
+                                 size, item.get("fill_price"), item.get("fee") or 0.0)
+        elif channel == "ticker":
+            for item in items:
+                mark = get_float(item, "mark_price") or get_float(item, "last_trade_price")
+                if mark is not None:
+                    self.update_mark(item.get("contract_code") or msg.get("contract_code"), mark)
+
+    def revalue(self):
+        """Recompute open PnL and margin of every position in one vectorized pass."""
+        with self._lock:
+            n = len(self._codes)
+            quantity = self._quantity[:n]
+            mark = self._mark[:n]
+            priced = ~np.isnan(mark)
+            np.subtract(quantity * mark, self._cost[:n], out=self._open_pnl[:n], where=priced)
+            self._open_pnl[:n][~priced] = 0.0
+            np.multiply(np.abs(quantity) * mark, self._margin_rate[:n], out=self._margin[:n], where=priced)
+            self._margin[:n][~priced] = 0.0
+            self._dirty = False
+
+    ### Queries ###
+
+    def _read(self, values, contract_code):
+        with self._lock:
+            if self._dirty:
+                self.revalue()
+            if contract_code is None:
+                return float(values[:len(self._codes)].sum())
+            row = self._index.get(contract_code)
+            return 0.0 if row is None else float(values[row])
+
+    def open_pnl(self, contract_code=None):
+        """Open PnL of one contract, or of the whole portfolio."""
+        return self._read(self._open_pnl, contract_code)
+
+    def realized_pnl(self, contract_code=None):
+        return self._read(self._realized, contract_code)
+
+    def cost(self, contract_code=None):
+        """Signed entry notional of the open quantity."""
+        return self._read(self._cost, contract_code)
+
+    def margin_usage(self, contract_code=None):
+        """Estimated initial margin of one contract, or of the whole portfolio."""
+        return self._read(self._margin, contract_code)
+
+    def quantity(self, contract_code):
+        return self._read(self._quantity, contract_code)
+
+    def position(self, contract_code):
+        """Snapshot of one position.
+
+        :returns: {"contract_code", "quantity", "average_entry_price", "cost", "mark_price",
+                   "open_pnl", "realized_pnl", "margin"} or None for an unknown contract
+        """
+        with self._lock:
+            row = self._index.get(contract_code)
+            if row is None:
+                return None
+            if self._dirty:
+                self.revalue()
+            quantity = float(self._quantity[row])
+            mark = float(self._mark[row])
+            return {
+                "contract_code": contract_code,
+                "quantity": quantity,
+                "average_entry_price": float(self._cost[row]) / quantity if quantity else None,
+                "cost": float(self._cost[row]),
+                "mark_price": None if mark != mark else mark,
+                "open_pnl": float(self._open_pnl[row]),
+                "realized_pnl": float(self._realized[row]),
+                "margin": float(self._margin[row]),
+            }
+
+    def positions(self):
+        """:returns: {contract_code: position snapshot} of every non flat position"""
+        with self._lock:
+            return {code: self.position(code) for code in self._codes
+                    if abs(self._quantity[self._index[code]]) > self.tolerance}
+
+    ### Reconciliation ###
+
+    def reconcile(self, adopt=False):
+        """Compare local quantities with ``get_positions``.
+
+        The snapshot and the fill events are not ordered: a fill can be in the
+        snapshot before its event arrives. Contracts filled while the snapshot
+        loads are skipped, and with ``adopt`` the exchange values only replace
+        a drift already reported, with the same value, by the previous
+        reconcile, so a fill event still in flight is never counted twice.
+
+        :param adopt: replace local quantity and cost with the exchange values of
+            confirmed drifts
+        :returns: list of {"contract_code", "local", "exchange", "drift", "adopted"} for
+            every contract whose quantity differs by more than ``tolerance``; also kept
+            in ``last_drift``
+        :raises: EmxApiException if the request fails
+        """
+        with self._lock:
+            self._filled_during_fetch = set()
+        try:
+            # Positions of every trading account, summed per contract
+            exchange = {}
+            for item in self.rest_api.get_positions():
+                code = get_field(item, "contract_code")
+                quantity = get_float(item, "quantity") or 0.0
+                entry = get_float(item, "average_entry_price") or 0.0
+                totals = exchange.setdefault(code, [0.0, 0.0, None])
+                totals[0] += quantity
+                totals[1] += quantity * entry
+                totals[2] = get_float(item, "marking_price")
+        finally:
+            with self._lock:
+                filled, self._filled_during_fetch = self._filled_during_fetch, None
+
+        drift = []
+        with self._lock:
+            for code in sorted(set(exchange) | set(self._codes)):
+                remote, remote_cost, mark = exchange.get(code, (0.0, 0.0, None))
+                row = self._row(code)
+                if mark is not None:
+                    self._mark[row] = mark
+                    self._dirty = True
+                if code in filled:
+                    continue
+                local = self.quantity(code)
+                if abs(remote - local) <= self.tolerance:
+                    continue
+                previous = self._previous_drift.get(code)
+                confirmed = previous is not None and abs(previous - (local - remote)) <= self.tolerance
+                adopted = adopt and confirmed
+                drift.append({"contract_code": code, "local": local, "exchange": remote,
+                              "drift": local - remote, "adopted": adopted})
+                if adopted:
+                    self._quantity[row] = remote
+                    self._cost[row] = remote_cost
+                    self._dirty = True
+            self._previous_drift = {item["contract_code"]: item["drift"] for item in drift if not item["adopted"]}
+        self.last_drift = drift
+        return drift
+
+    def start_reconcile(self, interval, on_drift=None, adopt=False, on_error=None):
+        """Reconcile every ``interval`` seconds in a background thread.
+
+        :param on_drift: (optional) callable receiving the drift list when it is not empty
+        :param adopt: see :meth:`reconcile`
+        :param on_error: (optional) callable receiving the exception of a failed reconcile;
+            failures are logged by default
+        :returns: None
+        """
+        self.stop_reconcile()
+        stop = self._reconcile_stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    drift = self.reconcile(adopt)
+                    if drift and on_drift is not None:
+                        on_drift(drift)
+                except Exception as err:
+                    if on_error is None:
+                        logger.exception("Portfolio reconcile failed")
+                    else:
+                        on_error(err)
+
+        threading.Thread(target=run, name="emx-portfolio", daemon=True).start()
+
+    def stop_reconcile(self):
+        if self._reconcile_stop is not None:
+            self._reconcile_stop.set()
+            self._reconcile_stop = None
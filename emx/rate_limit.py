@@ -0,0 +1,170 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import threading
+import time
+from functools import wraps
+from emx.utils import EmxApiException
+
+
+# Endpoint classes
+PUBLIC = "public"
+ORDER_ENTRY = "order_entry"
+ACCOUNT = "account"
+
+# Priority lanes, lower value is served first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class TokenBucket():
+    """ Classic token bucket.
+
+    :param rate: tokens added per second
+    :param capacity: (optional) maximum burst size, defaults to one second worth of tokens
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise EmxApiException("Token bucket rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_to_token(self, now):
+        """Seconds until one token is available (0 if available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _LaneStats():
+    __slots__ = ('requests', 'total_wait', 'max_wait')
+
+    def __init__(self):
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def add(self, wait):
+        self.requests += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+
+class RequestScheduler():
+    """ Client-side rate limiter with priority lanes.
+
+    Every request consumes one token from the bucket of its endpoint class and,
+    if configured, from a global bucket shared by all classes. When requests
+    wait for the same bucket, the one with the lowest priority value goes first,
+    then the oldest one, so cancels overtake queued polling.
+
+    :param limits: mapping of endpoint class to ``(rate, burst)``;
+        classes not listed are not limited
+    :param global_limit: (optional) ``(rate, burst)`` applied to every request
+    """
+
+    def __init__(self, limits=None, global_limit=None):
+        self._buckets = {}
+        for endpoint_class, (rate, burst) in (limits or {}).items():
+            self._buckets[endpoint_class] = TokenBucket(rate, burst)
+        self._global = TokenBucket(*global_limit) if global_limit else None
+
+        self._waiting = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {}
+
+    def _buckets_for(self, endpoint_class):
+        buckets = []
+        bucket = self._buckets.get(endpoint_class)
+        if bucket is not None:
+            buckets.append(bucket)
+        if self._global is not None:
+            buckets.append(self._global)
+        return buckets
+
+    def acquire(self, endpoint_class, priority=PRIORITY_NORMAL):
+        """Block until a request of this class and priority may be sent.
+
+        :param endpoint_class: PUBLIC, ORDER_ENTRY or ACCOUNT
+        :param priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+        :returns: seconds spent waiting
+        """
+        start = time.monotonic()
+        buckets = self._buckets_for(endpoint_class)
+        with self._cond:
+            if buckets:
+                entry = (priority, next(self._counter))
+                for bucket in buckets:
+                    heapq.heappush(self._waiting.setdefault(id(bucket), []), entry)
+
+                while True:
+                    timeout = None
+                    if all(self._waiting[id(bucket)][0] == entry for bucket in buckets):
+                        now = time.monotonic()
+                        timeout = max(bucket.time_to_token(now) for bucket in buckets)
+                        if timeout == 0:
+                            break
+                    self._cond.wait(timeout)
+
+                for bucket in buckets:
+                    bucket.take()
+                    heapq.heappop(self._waiting[id(bucket)])
+                self._cond.notify_all()
+
+            wait = time.monotonic() - start
+            lane = self._stats.get((endpoint_class, priority))
+            if lane is None:
+                lane = self._stats[(endpoint_class, priority)] = _LaneStats()
+            lane.add(wait)
+        return wait
+
+    def stats(self):
+        """Queue wait metrics per endpoint class and priority lane.
+
+        :returns: {(endpoint_class, priority): {"requests": int, "avg_wait": float, "max_wait": float}}
+        """
+        with self._cond:
+            return {key: {"requests": lane.requests,
+                          "avg_wait": lane.total_wait / lane.requests,
+                          "max_wait": lane.max_wait}
+                    for key, lane in self._stats.items()}
+
+
+def rate_limited(endpoint_class, priority=PRIORITY_NORMAL):
+    """Decorate a client method so it goes through ``self.scheduler`` when one is set."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.scheduler is not None:
+                self.scheduler.acquire(endpoint_class, priority)
+            return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
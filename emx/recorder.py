@@ -0,0 +1,296 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" Append-only binary log of raw WebSocket frames.
+
+Frames are segmented per UTC day and contract::
+
+    <directory>/<YYYYMMDD>/<contract_code>.emxlog
+    <directory>/<YYYYMMDD>/<contract_code>.emxidx
+
+A log starts with ``MAGIC`` followed by records made of a ``RECORD_HEADER``
+(payload length, receive time in ns since the epoch, channel id) and the frame
+bytes, stored verbatim. The index holds one ``INDEX_ENTRY`` (receive time,
+record offset) every ``index_interval`` seconds, so a time range is found with
+a binary search instead of a scan. Frames without a contract code go to the
+``_control`` segment.
+"""
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from bisect import bisect_right
+from queue import Queue, Empty, Full
+from emx.utils import EmxApiException
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"EMXL\x01"
+RECORD_HEADER = struct.Struct("<IQB")
+INDEX_ENTRY = struct.Struct("<QQ")
+LOG_SUFFIX = ".emxlog"
+INDEX_SUFFIX = ".emxidx"
+CONTROL_SEGMENT = "_control"
+
+# Channel ids stored in record headers, 0 is any other channel
+CHANNELS = ("", "ticker", "trade", "trades", "level2", "orders", "contracts", "contract_status", "auction")
+CHANNEL_IDS = {name: i for i, name in enumerate(CHANNELS) if name}
+
+_CHANNEL_RE = re.compile(rb'"channel"\s*:\s*"([^"]*)"')
+_CONTRACT_RE = re.compile(rb'"contract_code"\s*:\s*"([^"]*)"')
+_UNSAFE_RE = re.compile(r'[^A-Za-z0-9_.-]')
+_STOP = object()
+
+
+class _Segment():
+    __slots__ = ('log', 'index', 'offset', 'indexed_at')
+
+    def __init__(self, path):
+        new = not os.path.exists(path + LOG_SUFFIX) or os.path.getsize(path + LOG_SUFFIX) == 0
+        self.log = open(path + LOG_SUFFIX, "ab")
+        self.index = open(path + INDEX_SUFFIX, "ab")
+        if new:
+            self.log.write(MAGIC)
+        self.offset = self.log.tell()
+        self.indexed_at = None
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+
+class Recorder():
+    """ Records raw frames to segmented binary logs from a dedicated writer thread.
+
+    :meth:`record` only timestamps the frame and queues it, so the receive loop
+    never waits for the disk. The writer drains the queue in batches and issues
+    one write per segment per batch. Pass the recorder to
+    ``WebSocketApi(recorder=...)`` to tee every received frame.
+
+    When the disk falls behind and ``max_queued`` frames are waiting, new frames
+    are dropped (counted in ``dropped``) rather than blocking the receive loop.
+    If writing fails, the writer stops and the error is kept in ``error``: it is
+    given to ``on_error``, or raised by the next :meth:`record` call otherwise.
+
+    :param directory: root directory of the logs
+    :param index_interval: seconds between two index entries of a segment
+    :param batch_size: maximum number of frames written per batch
+    :param max_queued: maximum number of frames waiting for the writer
+    :param on_error: (optional) callable receiving the exception that stopped the writer
+    """
+
+    def __init__(self, directory, index_interval=1.0, batch_size=4096, max_queued=100000, on_error=None):
+        self.directory = directory
+        self.index_interval_ns = int(index_interval * 1e9)
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.error = None
+
+        self._queue = Queue(max_queued)
+        self._segments = {}
+        self._buffers = {}
+        self._day = None
+        self._writer = threading.Thread(target=self._run, name="emx-recorder", daemon=True)
+        self._writer.start()
+
+    def record(self, frame, received_ns=None):
+        """Queue one frame for writing.
+
+        :param frame: frame as returned by ``WebSocketApi.receive_msg`` (str or bytes)
+        :param received_ns: (optional) receive time in ns since the epoch, defaults to now
+        :returns: None
+        :raises: EmxApiException if the writer failed and no ``on_error`` is set
+        """
+        if self.error is not None:
+            if self.on_error is None:
+                raise EmxApiException("Recorder stopped. Reason: {}".format(self.error))
+            return
+        if received_ns is None:
+            received_ns = time.time_ns()
+        try:
+            self._queue.put_nowait((received_ns, frame))
+        except Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write every queued frame and close the files."""
+        self._queue.put(_STOP)
+        self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        queue = self._queue
+        running = True
+        while running:
+            batch = [queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(queue.get_nowait())
+            except Empty:
+                pass
+            if batch[-1] is _STOP:
+                batch.pop()
+                running = False
+            if self.error is not None:
+                continue
+            try:
+                self._write(batch)
+            except Exception as err:
+                self.error = err
+                self._buffers.clear()
+                if self.on_error is None:
+                    logger.error("Recorder stopped. Reason: %s", err)
+                else:
+                    try:
+                        self.on_error(err)
+                    except Exception:
+                        logger.exception("Recorder on_error callback failed")
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except OSError:
+                pass
+        self._segments.clear()
+
+    def _write(self, batch):
+        for received_ns, frame in batch:
+            if isinstance(frame, str):
+                frame = frame.encode("utf-8")
+            match = _CONTRACT_RE.search(frame)
+            contract_code = match.group(1).decode() if match else CONTROL_SEGMENT
+            match = _CHANNEL_RE.search(frame)
+            channel_id = CHANNEL_IDS.get(match.group(1).decode(), 0) if match else 0
+
+            day = time.strftime("%Y%m%d", time.gmtime(received_ns // 1000000000))
+            segment = self._segment(day, contract_code)
+            buffer = self._buffers.get(segment)
+            if buffer is None:
+                buffer = self._buffers[segment] = bytearray()
+            if segment.indexed_at is None or received_ns - segment.indexed_at >= self.index_interval_ns:
+                segment.index.write(INDEX_ENTRY.pack(received_ns, segment.offset + len(buffer)))
+                segment.indexed_at = received_ns
+            buffer += RECORD_HEADER.pack(len(frame), received_ns, channel_id)
+            buffer += frame
+            self.frames += 1
+        self._flush()
+
+    def _flush(self):
+        for segment, buffer in self._buffers.items():
+            segment.log.write(buffer)
+            segment.log.flush()
+            segment.index.flush()
+            segment.offset += len(buffer)
+            self.bytes += len(buffer)
+        self._buffers.clear()
+
+    def _segment(self, day, contract_code):
+        if day != self._day:
+            # Segments of the previous day are complete
+            self._flush()
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+            self._day = day
+            os.makedirs(os.path.join(self.directory, day), exist_ok=True)
+        segment = self._segments.get(contract_code)
+        if segment is None:
+            name = _UNSAFE_RE.sub("_", contract_code)
+            segment = self._segments[contract_code] = _Segment(os.path.join(self.directory, day, name))
+        return segment
+
+
+def read_index(log_path):
+    """Load the index of a log.
+
+    :param log_path: path of the ``.emxlog`` file
+    :returns: (timestamps, offsets) lists sorted by time
+    """
+    index_path = log_path[:-len(LOG_SUFFIX)] + INDEX_SUFFIX
+    timestamps = []
+    offsets = []
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as index:
+            data = index.read()
+        for received_ns, offset in INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]):
+            timestamps.append(received_ns)
+            offsets.append(offset)
+    return timestamps, offsets
+
+
+class LogReader():
+    """ Memory-mapped reader of one log. Payloads are returned as ``memoryview``
+    slices of the mapping, without copying.
+
+    :param log_path: path of the ``.emxlog`` file
+    """
+
+    def __init__(self, log_path):
+        self.path = log_path
+        self._file = open(log_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._view = memoryview(self._map)
+        if size and self._view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{} is not an EMX log".format(log_path))
+
+    def find_offset(self, start_ns):
+        """Offset of an indexed record at or before the first record received at ``start_ns``."""
+        timestamps, offsets = read_index(self.path)
+        i = bisect_right(timestamps, start_ns) - 1
+        return offsets[i] if i >= 0 else len(MAGIC)
+
+    def records(self, start_ns=None, end_ns=None):
+        """Iterate over records received in [start_ns, end_ns).
+
+        :returns: iterator of (received_ns, channel_id, payload memoryview)
+        """
+        view = self._view
+        size = len(view)
+        offset = len(MAGIC) if start_ns is None else self.find_offset(start_ns)
+        header = RECORD_HEADER
+        while offset + header.size <= size:
+            length, received_ns, channel_id = header.unpack_from(view, offset)
+            start = offset + header.size
+            offset = start + length
+            if offset > size:
+                break  # incomplete record, still being written
+            if start_ns is not None and received_ns < start_ns:
+                continue
+            if end_ns is not None and received_ns >= end_ns:
+                break
+            yield received_ns, channel_id, view[start:offset]
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._map, mmap.mmap):
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # payloads are still referenced; unmapped once they are released
+        self._file.close()
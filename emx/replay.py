@@ -0,0 +1,158 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+import os
+import time
+from collections import deque
+from emx import codec
+from emx.recorder import LogReader, CHANNELS, CONTROL_SEGMENT, LOG_SUFFIX
+from emx.utils import EmxApiException, EmxApiTimeoutException
+
+
+def find_logs(directory):
+    """Every ``.emxlog`` file below a directory, sorted by path."""
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(LOG_SUFFIX))
+    return sorted(paths)
+
+
+class ReplayWebSocketApi():
+    """ Plays logs written by :class:`emx.recorder.Recorder` through the
+    ``subscribe`` / ``receive_msg`` interface of :class:`emx.ws_api.WebSocketApi`.
+
+    Logs are memory-mapped and merged in receive-time order. Like the live API,
+    nothing is delivered until :meth:`subscribe` is called, and only frames of
+    the subscribed channels and contracts are returned.
+
+    :param logs: directory of logs, or list of ``.emxlog`` paths
+    :param speed: 1.0 plays in real time, 10.0 ten times faster, None as fast as possible
+    :param start_ns: (optional) first receive time to play, in ns since the epoch
+    :param end_ns: (optional) receive time at which playback stops
+    :param timeout: seconds ``receive_msg`` waits for the next frame before raising
+        EmxApiTimeoutException, as the live API does
+    :param decoder: (optional) callable applied to every frame, see :class:`emx.ws_api.WebSocketApi`
+    """
+
+    def __init__(self, logs, speed=None, start_ns=None, end_ns=None, timeout=3, decoder=None):
+        paths = find_logs(logs) if isinstance(logs, str) else list(logs)
+        self.speed = speed
+        self.timeout = timeout
+        self.decoder = decoder
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+
+        # channel -> set of contract codes, as on WebSocketApi
+        self.subscriptions = {}
+        self._readers = [LogReader(path) for path in paths]
+        self._stream = None
+        self._next = None
+        self._pending = deque()
+        self._anchor = None
+        self.finished = False
+
+    def _merged(self):
+        def records(reader):
+            contract_code = os.path.basename(reader.path)[:-len(LOG_SUFFIX)]
+            for received_ns, channel_id, payload in reader.records(self.start_ns, self.end_ns):
+                yield received_ns, channel_id, contract_code, payload
+        return heapq.merge(*[records(reader) for reader in self._readers], key=lambda record: record[0])
+
+    def _accepts(self, channel_id, contract_code, payload):
+        if contract_code == CONTROL_SEGMENT:
+            return False
+        channel = CHANNELS[channel_id]
+        if not channel:
+            # Channel missing from the id table, read it from the frame
+            channel = codec.loads(bytes(payload)).get("channel")
+        codes = self.subscriptions.get(channel)
+        return codes is not None and contract_code in codes
+
+    def receive_raw(self):
+        """Next frame without decoding.
+
+        :returns: (received_ns, payload memoryview)
+        :raises: EmxApiTimeoutException if the next frame is not due within ``timeout``
+        :raises: EmxApiException when every log has been played
+        """
+        if self._stream is None:
+            self._stream = self._merged()
+        record = self._next
+        while record is None:
+            record = next(self._stream, None)
+            if record is None:
+                self.finished = True
+                raise EmxApiException("End of replay")
+            if not self._accepts(*record[1:]):
+                record = None
+        # Kept until due, so a timeout does not lose the frame
+        self._next = record
+        if self.speed:
+            self._wait(record[0])
+        self._next = None
+        return record[0], record[3]
+
+    def _wait(self, received_ns):
+        now = time.monotonic()
+        if self._anchor is None:
+            self._anchor = (now, received_ns)
+        wall, first_ns = self._anchor
+        delay = wall + (received_ns - first_ns) / 1e9 / self.speed - now
+        if delay > self.timeout:
+            time.sleep(self.timeout)
+            raise EmxApiTimeoutException("No messages received")
+        if delay > 0:
+            time.sleep(delay)
+
+    def receive_msg(self):
+        if self._pending:
+            msg = self._pending.popleft()
+        else:
+            msg = str(self.receive_raw()[1], "utf-8")
+        if self.decoder is not None:
+            return self.decoder(msg)
+        return msg
+
+    def subscribe(self, symbols, channels):
+        """Start delivering the given channels for the given contracts.
+        The next ``receive_msg`` returns the "subscriptions" acknowledgement.
+
+        :param symbols: instrument symbols list
+        :param channels: subscription channels list
+        :returns: None
+        """
+        for channel in channels:
+            self.subscriptions.setdefault(channel, set()).update(symbols)
+        self._pending.append(self._subscriptions_msg())
+
+    def unsubscribe(self, channels):
+        for channel in channels:
+            self.subscriptions.pop(channel, None)
+        self._pending.append(self._subscriptions_msg())
+
+    def _subscriptions_msg(self):
+        return codec.dumps({
+            "type": "subscriptions",
+            "channels": [{"name": channel, "contract_codes": sorted(codes)}
+                         for channel, codes in self.subscriptions.items()]
+        })
+
+    def close(self):
+        self._stream = None
+        self._next = None
+        for reader in self._readers:
+            reader.close()
+        self._readers = []
@@ -0,0 +1,131 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+class _Call():
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCache():
+    """ Single-flight coalescing of identical public requests, with an optional
+    LRU micro-cache.
+
+    Concurrent calls of the same route with the same arguments share one
+    in-flight request: the first caller sends it, the others wait for its
+    result (or its exception). With a TTL, a result is also served to later
+    callers for that many milliseconds. Cached results are shared between
+    callers and must not be modified.
+
+    :param ttl_ms: cache lifetime in milliseconds, either one value for every
+        route or {route name: ttl_ms}, e.g. {"get_contract_quote": 50};
+        0 only coalesces
+    :param max_entries: cached results kept, least recently used are evicted first
+    """
+
+    def __init__(self, ttl_ms=0, max_entries=1024):
+        self.ttl_ms = ttl_ms
+        self.max_entries = max_entries
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _ttl(self, route):
+        if isinstance(self.ttl_ms, dict):
+            return self.ttl_ms.get(route, 0) / 1000.0
+        return self.ttl_ms / 1000.0
+
+    def get(self, route, key, fetch):
+        """Return the result of ``fetch()`` for ``key``, sharing it with concurrent
+        and (within the TTL) later callers.
+
+        :param route: route name, selects the TTL
+        :param key: hashable identity of the request
+        :param fetch: callable sending the request
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, result = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fetch()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                ttl = self._ttl(route)
+                if call.error is None and ttl > 0:
+                    self._entries[key] = (time.monotonic() + ttl, call.result)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            call.done.set()
+        return call.result
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "coalesced": self.coalesced, "misses": self.misses,
+                    "entries": len(self._entries)}
+
+
+def coalesced(func):
+    """Decorate a public client route so identical calls go through ``self.cache``
+    when one is set."""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.cache is None:
+            return func(self, *args, **kwargs)
+        key = (self.uri, func.__name__, args, tuple(sorted(kwargs.items())))
+        return self.cache.get(func.__name__, key, lambda: func(self, *args, **kwargs))
+    return wrapper
@@ -14,11 +14,41 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import requests
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from emx.utils import (
     handle_result,
-    generate_signature,
-    get_timestamp,
+    parse_result,
+    Signer,
 )
+from emx.contracts import ContractRegistry
+from emx.models import (
+    typed_result,
+    ScaleResolver,
+    Order,
+    Fill,
+    Position,
+    Balance,
+)
+from emx.instrumentation import instrumented
+from emx.pagination import PageIterator
+from emx.request_cache import coalesced
+from emx.risk import placed_order_id, risk_checked
+from emx.rate_limit import (
+    rate_limited,
+    PUBLIC,
+    ORDER_ENTRY,
+    ACCOUNT,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PRIORITY_LOW,
+)
+
+
+BulkResult = namedtuple("BulkResult", ["ok", "result", "error"])
+BulkResult.__doc__ = """Outcome of one request of a bulk call: ``result`` holds the parsed
+response when ``ok`` is True, otherwise ``error`` holds the exception."""
 
 
 class RestApi():
@@ -27,66 +57,125 @@ class RestApi():
     queries will not be possible for authenticated requests (please see EMX API doc)
 
     .. note::
-       No query rate limiting is performed.
+       No query rate limiting is performed unless a scheduler is given.
     """
 
-    def __init__(self, api_key='', key_secret='', uri='http://api.testnet.emx.com'):
+    def __init__(self, api_key='', key_secret='', uri='http://api.testnet.emx.com', scheduler=None,
+                 pool_size=10, typed=False, instrumentation=None, session=None, cache=None,
+                 risk=None, executor=None):
         """ Create an object with authentication information.
 
         :param api_key: (optional) key identifier for queries to the API
         :type api_key: str
         :param key_secret: (optional) actual private key used to sign messages
         :type key_secret: str
+        :param scheduler: (optional) :class:`emx.rate_limit.RequestScheduler` every route goes through
+        :param pool_size: number of kept-alive connections, and of concurrent requests in bulk calls
+        :param typed: return :mod:`emx.models` records instead of dicts from get_balances,
+            get_positions, list_fills and list_orders
+        :param instrumentation: (optional) :class:`emx.instrumentation.Instrumentation`
+            collecting per-route latencies
+        :param session: (optional) ``requests.Session`` shared with other clients, see
+            :class:`emx.client_pool.ClientPool`; it is not closed by :meth:`close`
+        :param cache: (optional) :class:`emx.request_cache.RequestCache` coalescing identical
+            public market data requests
+        :param risk: (optional) :class:`emx.risk.RiskChecker` checking new orders before
+            they are sent
+        :param executor: (optional) ``concurrent.futures.Executor`` running bulk requests,
+            shared with other clients; it is not shut down by :meth:`close`
         :returns: None
         """
 
-        self.session = requests.Session()
+        self._owns_session = session is None
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.pool_size = pool_size
+        self._owns_executor = executor is None
+        self._executor = executor
 
         self.uri = uri
         self._api_key = api_key
         self._api_secret = key_secret
+        self._signer = Signer(api_key, key_secret)
+        self.scheduler = scheduler
+        self.typed = typed
+        self.instrumentation = instrumentation
+        self.cache = cache
+        self.risk = risk
+        self._signer.instrumentation = instrumentation
+        self._scales = None
 
         self._headers = {
                          'content-type': 'application/json'
                         }
 
+    def _scale_resolver(self):
+        if self._scales is None:
+            self._scales = ScaleResolver(ContractRegistry.shared(self))
+        return self._scales
+
     def close(self):
         """ Close an existing connection
 
         :returns: None
         """
-        self.session.close()
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._owns_session:
+            self.session.close()
 
 
     ### Public Market Data ###
 
     @handle_result
     def _get_route_without_body(self, endpoint):
-        self._headers = {
-                         'content-type': 'application/json'
-                        }
-
         url = self.uri + endpoint
         return self.session.get(url=url, params="{}", headers=self._headers)
 
+    @instrumented
+    @coalesced
+    @rate_limited(PUBLIC, PRIORITY_LOW)
     def get_contracts(self):
         return self._get_route_without_body("/v1/contracts")
 
+    @instrumented
+    @coalesced
+    @rate_limited(PUBLIC, PRIORITY_LOW)
     def get_active_contracts(self):
         return self._get_route_without_body("/v1/contracts/active")
 
+    @instrumented
+    @coalesced
+    @rate_limited(PUBLIC, PRIORITY_LOW)
     def get_specific_contract(self, contract_code):
         return self._get_route_without_body("/v1/contracts/{}".format(contract_code))
 
+    @instrumented
+    @coalesced
+    @rate_limited(PUBLIC, PRIORITY_LOW)
     def get_contract_funding(self, contract_code):
         return self._get_route_without_body("/v1/contracts/{}/funding".format(contract_code))
 
+    @instrumented
+    @coalesced
+    @rate_limited(PUBLIC, PRIORITY_LOW)
     def get_contract_summary(self, contract_code):
         return self._get_route_without_body("/v1/contracts/{}/summary".format(contract_code))
 
+    @instrumented
+    @coalesced
+    @rate_limited(PUBLIC, PRIORITY_LOW)
     def get_contract_quote(self, contract_code):
         return self._get_route_without_body("/v1/contracts/{}/quote".format(contract_code))
 
+    @instrumented
+    @coalesced
+    @rate_limited(PUBLIC, PRIORITY_LOW)
     def get_contract_book(self, contract_code):
         return self._get_route_without_body("/v1/contracts/{}/book".format(contract_code))
 
@@ -95,20 +184,12 @@ class RestApi():
 
     @handle_result
     def _get_authed_route_without_body(self, endpoint):
-        self._headers = {
-                         'content-type': 'application/json'
-                        }
-
         url = self.uri + endpoint
+        headers, data = self._signer.headers("GET", endpoint, None)
+        return self.session.get(url=url, data=data, headers=headers)
 
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp, "GET", endpoint, "")
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.get(url=url, params="", headers=self._headers)
-
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
     def get_account(self):
         """
         Get a list of all trader accounts for the current user.
@@ -118,6 +199,9 @@ class RestApi():
         """
         return self._get_authed_route_without_body("/v1/accounts")
 
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
+    @typed_result(Balance)
     def get_balances(self, trader_id):
         """Get trading account info including balances, margin requirements, and net liquidation value.
 
@@ -134,6 +218,9 @@ class RestApi():
         """
         return self._get_authed_route_without_body("/v1/accounts/{}".format(trader_id))
 
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
+    @typed_result(Position)
     def get_positions(self, contract_code=None):
         """Get positions for all trading accounts.
 
@@ -157,6 +244,9 @@ class RestApi():
             endpoint = "/v1/positions/"
         return self._get_authed_route_without_body(endpoint)['positions']
 
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
+    @typed_result(Fill, "fills")
     @handle_result
     def list_fills(self, contract_code="", order_id="", before="", after=""):
         """Returns all fills for the current trading account - in descending chronological order.
@@ -174,14 +264,11 @@ class RestApi():
             "before": before,
             "after": after
         }
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp, "GET", endpoint, body)
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.get(url=url, json=body, headers=self._headers)
+        headers, data = self._signer.headers("GET", endpoint, body)
+        return self.session.get(url=url, data=data, headers=headers)
 
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
     def list_keys(self):
         """Get a list of all API keys (but not secrets). Secrets are only returned at the time of key creation.
 
@@ -190,6 +277,8 @@ class RestApi():
         """
         return self._get_authed_route_without_body("/v1/keys")
 
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
     @handle_result
     def create_key(self):
         """Mint a new API key
@@ -201,14 +290,11 @@ class RestApi():
         endpoint = "/v1/keys"
         url = self.uri + endpoint
 
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp, "POST", endpoint, "")
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.post(url=url, params="", headers=self._headers)
+        headers, data = self._signer.headers("POST", endpoint, None)
+        return self.session.post(url=url, data=data, headers=headers)
 
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
     @handle_result
     def delete_key(self, key):
         """Revoke an existing API key.
@@ -221,14 +307,12 @@ class RestApi():
         endpoint = "/v1/keys/{}".format(key)
         url = self.uri + endpoint
 
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp, "DELETE", endpoint, "")
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.delete(url=url, params="", headers=self._headers)
+        headers, data = self._signer.headers("DELETE", endpoint, None)
+        return self.session.delete(url=url, data=data, headers=headers)
 
+    @instrumented
+    @rate_limited(ACCOUNT, PRIORITY_NORMAL)
+    @typed_result(Order, "orders")
     @handle_result
     def list_orders(self, contract_code="", status="", before="", after=""):
         """Returns orders for the current trading account - in descending chronological order.
@@ -259,15 +343,69 @@ class RestApi():
             "before": before,
             "after": after
         }
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp,
-                                       "GET", endpoint, body)
+        headers, data = self._signer.headers("GET", endpoint, body)
+        return self.session.get(url=url, data=data, headers=headers)
 
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.get(url=url, json=body, headers=self._headers)
+    def iter_fills(self, contract_code="", order_id="", before="", after=""):
+        """Iterate over all fills, following the pagination cursor automatically.
+        The next page is prefetched while the current one is consumed.
 
+        :param after: (optional) fill_id to resume from, e.g. a saved ``iterator.cursor``
+        :returns: :class:`emx.pagination.PageIterator` yielding fill dicts
+        """
+        def fetch_page(cursor):
+            return self.list_fills(contract_code, order_id, before, cursor)
+        return PageIterator(fetch_page, "fills", "fill_id", after)
+
+    def iter_orders(self, contract_code="", status="", before="", after=""):
+        """Iterate over all orders, following the pagination cursor automatically.
+        The next page is prefetched while the current one is consumed.
+
+        :param after: (optional) order_id to resume from, e.g. a saved ``iterator.cursor``
+        :returns: :class:`emx.pagination.PageIterator` yielding order dicts
+        """
+        def fetch_page(cursor):
+            return self.list_orders(contract_code, status, before, cursor)
+        return PageIterator(fetch_page, "orders", "order_id", after)
+
+    @staticmethod
+    def _new_order_body(contract_code, order_type, order_side, size, client_id="", price="",
+                        stop_price="", stop_trigger="", peg_price_type="", peg_offset_value="",
+                        reduce_only=False, post_only=False):
+        if order_type != "market" and price is None:
+            raise Exception("Specify the price, since order type is not market")
+
+        body = {
+          "client_id": client_id,
+          "contract_code": contract_code,
+          "type": order_type,
+          "side": order_side,
+          "size": size,
+          "price": price,
+          "stop_price": stop_price,
+          "peg_offset_value": peg_offset_value,
+          "reduce_only": reduce_only,
+          "post_only": post_only,
+        }
+
+        if stop_trigger:
+            body["stop_trigger"] = stop_trigger
+        if peg_price_type:
+            body["peg_price_type"] = peg_price_type
+
+        return body
+
+    @staticmethod
+    def _modify_order_body(order_type, order_side, order_size, order_price=None, order_stop_price=None):
+        body = {}
+        for elem in [(order_type, "type"), (order_side, "side"), (order_size, "size"), (order_price, "price"), (order_stop_price, "stop_price")]:
+            if elem[0] is not None:
+                body[elem[1]] = elem[0]
+        return body
+
+    @instrumented
+    @risk_checked
+    @rate_limited(ORDER_ENTRY, PRIORITY_NORMAL)
     @handle_result
     def create_new_order(self, contract_code, order_type,
                          order_side, size, client_id="", price="", stop_price="",
@@ -312,40 +450,20 @@ class RestApi():
                         },
                     "timestamp":""
                   }
+        :raises: EmxRiskCheckException if ``risk`` rejects the order
         :raises: Exception if requests.Response is not successful
         """
-        if order_type != "market" and price is None:
-            raise Exception("Specify the price, since order type is not market")
-
-        body = {
-          "client_id": client_id,
-          "contract_code": contract_code,
-          "type": order_type,
-          "side": order_side,
-          "size": size,
-          "price": price,
-          "stop_price": stop_price,
-          "peg_offset_value": peg_offset_value,
-          "reduce_only": reduce_only,
-          "post_only": post_only,
-        }
-
-        if stop_trigger:
-            body["stop_trigger"] = stop_trigger
-        if peg_price_type:
-            body["peg_price_type"] = peg_price_type
+        body = self._new_order_body(contract_code, order_type, order_side, size,
+                                    client_id, price, stop_price, stop_trigger,
+                                    peg_price_type, peg_offset_value, reduce_only, post_only)
 
         endpoint = "/v1/orders"
         url = self.uri + endpoint
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp,
-                                       "POST", endpoint, body)
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.post(url=url, json=body, headers=self._headers)
+        headers, data = self._signer.headers("POST", endpoint, body)
+        return self.session.post(url=url, data=data, headers=headers)
 
+    @instrumented
+    @rate_limited(ORDER_ENTRY, PRIORITY_NORMAL)
     @handle_result
     def modify_order(self, exchange_orderid, order_type, order_side, order_size, order_price=None, order_stop_price=None):
         """Modify an existing order
@@ -361,22 +479,15 @@ class RestApi():
         :raises: Exception if requests.Response is not successful
         """
 
-        body = {}
-        for elem in [(order_type, "type"), (order_side, "side"), (order_size, "size"), (order_price, "price"), (order_stop_price, "stop_price")]:
-            if elem[0] is not None:
-                body[elem[1]] = elem[0]
+        body = self._modify_order_body(order_type, order_side, order_size, order_price, order_stop_price)
 
         endpoint = "/v1/orders/{}".format(exchange_orderid)
         url = self.uri + endpoint
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp,
-                                       "PATCH", endpoint, body)
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.patch(url=url, json=body, headers=self._headers)
+        headers, data = self._signer.headers("PATCH", endpoint, body)
+        return self.session.patch(url=url, data=data, headers=headers)
 
+    @instrumented
+    @rate_limited(ORDER_ENTRY, PRIORITY_HIGH)
     @handle_result
     def cancel_order(self, exchange_orderid):
         """Cancel an existing order
@@ -392,15 +503,11 @@ class RestApi():
 
         endpoint = "/v1/orders/{}".format(exchange_orderid)
         url = self.uri + endpoint
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp,
-                                       "DELETE", endpoint, body)
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.delete(url=url, json=body, headers=self._headers)
+        headers, data = self._signer.headers("DELETE", endpoint, body)
+        return self.session.delete(url=url, data=data, headers=headers)
 
+    @instrumented
+    @rate_limited(ORDER_ENTRY, PRIORITY_HIGH)
     @handle_result
     def cancel_all(self, contract_code=None):
         """Cancel all active orders
@@ -416,11 +523,136 @@ class RestApi():
         else:
             endpoint = "/v1/orders"
         url = self.uri + endpoint
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp,
-                                       "DELETE", endpoint, body)
-
-        self._headers['EMX-ACCESS-KEY'] = self._api_key
-        self._headers['EMX-ACCESS-SIG'] = signature.decode().strip()
-        self._headers['EMX-ACCESS-TIMESTAMP'] = str(timestamp)
-        return self.session.delete(url=url, json=body, headers=self._headers)
+        headers, data = self._signer.headers("DELETE", endpoint, body)
+        return self.session.delete(url=url, data=data, headers=headers)
+
+
+    ### Bulk Order Entry ###
+
+    def _send_bulk(self, prepared, route):
+        """Send already built requests concurrently over the connection pool.
+
+        :param prepared: list of (http_method, endpoint, body, priority) tuples, or
+            exceptions raised while building a request
+        :param route: name of the bulk route, the requests are instrumented under it
+        :returns: list of :class:`BulkResult` in input order
+        """
+        def request(http_method, endpoint, body):
+            # Signed once the rate limit allows it, so the timestamp is fresh
+            headers, data = self._signer.headers(http_method, endpoint, body)
+            return self.session.request(http_method, self.uri + endpoint, data=data, headers=headers)
+
+        def send(prepared_request):
+            if isinstance(prepared_request, Exception):
+                return BulkResult(False, None, prepared_request)
+            http_method, endpoint, body, priority = prepared_request
+            try:
+                if self.scheduler is not None:
+                    self.scheduler.acquire(ORDER_ENTRY, priority)
+                if self.instrumentation is None:
+                    result = parse_result(request(http_method, endpoint, body))
+                else:
+                    # Worker threads do not see the route measured by the caller thread
+                    result = self.instrumentation.measure_request(request, (http_method, endpoint, body),
+                                                                  {}, route)
+                return BulkResult(True, result, None)
+            except Exception as err:
+                return BulkResult(False, None, err)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                thread_name_prefix="emx-bulk")
+        return list(self._executor.map(send, prepared))
+
+    def _prepare_creates(self, orders):
+        """:returns: (prepared requests, risk reservations in the same order)"""
+        prepared = []
+        reservations = []
+        for order in orders:
+            reservation = None
+            try:
+                if self.risk is not None:
+                    reservation = self.risk.check(**order)
+                prepared.append(("POST", "/v1/orders", self._new_order_body(**order), PRIORITY_NORMAL))
+            except Exception as err:
+                if reservation is not None:
+                    self.risk.release(reservation)
+                    reservation = None
+                prepared.append(err)
+            reservations.append(reservation)
+        return prepared, reservations
+
+    def _settle_creates(self, reservations, results):
+        """Bind the risk reservations of placed orders, release those of failed ones."""
+        for reservation, result in zip(reservations, results):
+            if reservation is None:
+                continue
+            if result.ok:
+                self.risk.bind(reservation, placed_order_id(result.result))
+            else:
+                self.risk.release(reservation)
+        return results
+
+    def _prepare_modifies(self, modifications):
+        prepared = []
+        for modification in modifications:
+            try:
+                modification = dict(modification)
+                endpoint = "/v1/orders/{}".format(modification.pop("exchange_orderid"))
+                prepared.append(("PATCH", endpoint, self._modify_order_body(**modification), PRIORITY_NORMAL))
+            except Exception as err:
+                prepared.append(err)
+        return prepared
+
+    @staticmethod
+    def _prepare_cancels(exchange_orderids):
+        return [("DELETE", "/v1/orders/{}".format(order_id), {"order_id": order_id}, PRIORITY_HIGH)
+                for order_id in exchange_orderids]
+
+    @instrumented
+    def create_orders(self, orders):
+        """Create several orders concurrently.
+
+        :param orders: list of dicts holding :meth:`create_new_order` keyword arguments
+        :returns: list of :class:`BulkResult` in input order; a failed order does not
+            prevent the others from being sent
+        """
+        prepared, reservations = self._prepare_creates(orders)
+        return self._settle_creates(reservations, self._send_bulk(prepared, "create_orders"))
+
+    @instrumented
+    def modify_orders(self, modifications):
+        """Modify several orders concurrently.
+
+        :param modifications: list of dicts holding :meth:`modify_order` keyword arguments
+        :returns: list of :class:`BulkResult` in input order
+        """
+        return self._send_bulk(self._prepare_modifies(modifications), "modify_orders")
+
+    @instrumented
+    def cancel_orders(self, exchange_orderids):
+        """Cancel several orders concurrently.
+
+        :param exchange_orderids: list of exchange order ids
+        :returns: list of :class:`BulkResult` in input order
+        """
+        return self._send_bulk(self._prepare_cancels(exchange_orderids), "cancel_orders")
+
+    @instrumented
+    def send_orders(self, creates=(), modifies=(), cancels=()):
+        """Send creations, modifications and cancellations as one concurrent batch.
+        Cancels are submitted first.
+
+        :param creates: list of :meth:`create_new_order` keyword argument dicts
+        :param modifies: list of :meth:`modify_order` keyword argument dicts
+        :param cancels: list of exchange order ids
+        :returns: (create results, modify results, cancel results), lists of
+            :class:`BulkResult` in input order
+        """
+        cancels = self._prepare_cancels(cancels)
+        modifies = self._prepare_modifies(modifies)
+        creates, reservations = self._prepare_creates(creates)
+        results = self._send_bulk(cancels + modifies + creates, "send_orders")
+        first_create = len(cancels) + len(modifies)
+        self._settle_creates(reservations, results[first_create:])
+        return results[first_create:], results[len(cancels):first_create], results[:len(cancels)]
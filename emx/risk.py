@@ -0,0 +1,347 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from emx.messages import as_dict
+from emx.models import get_float
+from emx.order_manager import TERMINAL_EVENTS, TERMINAL_STATUSES
+from emx.rate_limit import TokenBucket
+from emx.utils import EmxRiskCheckException
+
+logger = logging.getLogger(__name__)
+
+
+def _limit(value, contract_code):
+    if isinstance(value, dict):
+        return value.get(contract_code)
+    return value
+
+
+def _float(value):
+    if value in (None, ""):
+        return None
+    return float(value)
+
+
+class _Reservation():
+    """Exposure and margin held by one accepted order until it rests no more."""
+
+    __slots__ = ('contract_code', 'side', 'size', 'margin', 'order_id')
+
+    def __init__(self, contract_code, side, size, margin):
+        self.contract_code = contract_code
+        self.side = side
+        self.size = size
+        self.margin = margin
+        self.order_id = None
+
+
+class RiskChecker():
+    """ Local pre-trade checks, run before an order is sent.
+
+    An order failing a check raises EmxRiskCheckException without any request,
+    and without taking a rate limit token. Every check is optional and only
+    runs when its data or limit is set. Limits are either one value for every
+    contract or {contract_code: value}.
+
+    Positions and marks come from ``portfolio``, margin figures from the last
+    :meth:`refresh_balances`. Every accepted order reserves its size (counted
+    in the position limits as if it filled) and its margin, so a burst of
+    resting orders cannot break a limit one order at a time. A reservation is
+    released when the send fails or the order is rejected, and, once the
+    ``orders`` channel is fed to :meth:`on_message`, when the order fills or
+    stops working. Margin reservations are also dropped by each refresh, since
+    the exchange figures then include the orders.
+
+    :param registry: (optional) :class:`emx.contracts.ContractRegistry`, loaded on
+        creation; unknown contracts, and prices or sizes off the tick or lot size, are rejected
+    :param portfolio: (optional) :class:`emx.portfolio.Portfolio` giving positions and marks
+    :param rest_api: (optional) :class:`emx.rest_api.RestApi` used by :meth:`refresh_balances`
+    :param trader_id: trader account whose balances are checked
+    :param max_order_size: maximum contracts per order
+    :param max_order_notional: maximum ``size * price`` per order
+    :param max_position: maximum absolute position after the order is filled
+    :param max_position_notional: maximum absolute position notional after the order is filled
+    :param order_rate: maximum orders per second of a contract
+    :param order_burst: (optional) orders allowed at once, defaults to one second worth
+    :param margin_rate: initial margin rate used to estimate the margin of an order
+    """
+
+    def __init__(self, registry=None, portfolio=None, rest_api=None, trader_id=None,
+                 max_order_size=None, max_order_notional=None, max_position=None,
+                 max_position_notional=None, order_rate=None, order_burst=None, margin_rate=0.1):
+        self.registry = registry
+        self.portfolio = portfolio
+        self.rest_api = rest_api
+        self.trader_id = trader_id
+        self.max_order_size = max_order_size
+        self.max_order_notional = max_order_notional
+        self.max_position = max_position
+        self.max_position_notional = max_position_notional
+        self.order_rate = order_rate
+        self.order_burst = order_burst
+        self.margin_rate = margin_rate
+        self.accepted = 0
+        self.rejected = 0
+
+        self.available_funds = None
+        self._reserved = 0.0
+        # contract_code -> [buy size, sell size] of accepted orders still working
+        self._open = {}
+        self._reservations = {}
+        self._finished = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._refresh_stop = None
+        if registry is not None:
+            registry.contracts()
+
+    def check(self, contract_code, order_type, order_side, size, client_id="", price="", stop_price="",
+              stop_trigger="", peg_price_type="", peg_offset_value="", reduce_only=False, post_only=False):
+        """Check a new order and reserve its exposure and margin. Arguments are
+        those of ``RestApi.create_new_order``.
+
+        :returns: reservation to pass to :meth:`bind` once the exchange assigned an
+            order_id, or to :meth:`release` if the order was not placed
+        :raises: EmxRiskCheckException if the order breaks a limit
+        """
+        try:
+            reservation = self._check(contract_code, order_type, order_side, float(size), _float(price),
+                                      _float(stop_price), reduce_only)
+        except EmxRiskCheckException:
+            self.rejected += 1
+            raise
+        self.accepted += 1
+        return reservation
+
+    def _check(self, contract_code, order_type, order_side, size, price, stop_price, reduce_only):
+        if size <= 0:
+            raise EmxRiskCheckException("Order size must be positive: {}".format(size))
+
+        if self.registry is not None:
+            # Membership does not refresh the registry, so unknown codes cost no request
+            if contract_code not in self.registry:
+                raise EmxRiskCheckException("Unknown contract: {}".format(contract_code))
+            contract = self.registry.get(contract_code)
+            if not contract.is_size_valid(size):
+                raise EmxRiskCheckException("Size {} is not a multiple of the lot size {} of {}".format(
+                    size, contract.lot_size, contract_code))
+            for value in (price, stop_price):
+                if value is not None and not contract.is_price_valid(value):
+                    raise EmxRiskCheckException("Price {} is not a multiple of the tick size {} of {}".format(
+                        value, contract.tick_size, contract_code))
+
+        limit = _limit(self.max_order_size, contract_code)
+        if limit is not None and size > limit:
+            raise EmxRiskCheckException("Order size {} above the limit {} of {}".format(size, limit, contract_code))
+
+        position, mark = 0.0, None
+        if self.portfolio is not None:
+            snapshot = self.portfolio.position(contract_code)
+            if snapshot is not None:
+                position, mark = snapshot["quantity"], snapshot["mark_price"]
+        signed = size if order_side == "buy" else -size
+        after = position + signed
+
+        if reduce_only and self.portfolio is not None:
+            if position * signed >= 0 or size > abs(position):
+                raise EmxRiskCheckException("Reduce only order of {} {} would not reduce the position {}".format(
+                    order_side, size, position))
+
+        reference = price if price is not None and order_type != "market" else stop_price or mark
+        margin = 0.0
+        if reference is not None:
+            notional = size * reference
+            limit = _limit(self.max_order_notional, contract_code)
+            if limit is not None and notional > limit:
+                raise EmxRiskCheckException("Order notional {} above the limit {} of {}".format(
+                    notional, limit, contract_code))
+            # Only the part increasing the position needs margin
+            margin_rate = _limit(self.margin_rate, contract_code) or 0.0
+            margin = max(0.0, abs(after) - abs(position)) * reference * margin_rate
+
+        with self._lock:
+            # Worst case: every accepted order of the same side fills
+            open_size = self._open.get(contract_code, (0.0, 0.0))[0 if signed > 0 else 1]
+            base = position + (open_size if signed > 0 else -open_size)
+            worst = base + signed
+            increases = abs(worst) > abs(base)
+            limit = _limit(self.max_position, contract_code)
+            if limit is not None and increases and abs(worst) > limit:
+                raise EmxRiskCheckException("Position {} of {} with working orders would exceed the limit {}".format(
+                    worst, contract_code, limit))
+            limit = _limit(self.max_position_notional, contract_code)
+            if limit is not None and reference is not None and increases and abs(worst) * reference > limit:
+                raise EmxRiskCheckException(
+                    "Position notional {} of {} with working orders would exceed the limit {}".format(
+                        abs(worst) * reference, contract_code, limit))
+            if margin and self.available_funds is not None and margin > self.available_funds - self._reserved:
+                raise EmxRiskCheckException("Order margin {} above the available funds {}".format(
+                    margin, self.available_funds - self._reserved))
+            bucket = self._bucket(contract_code)
+            if bucket is not None:
+                if bucket.time_to_token(time.monotonic()) > 0:
+                    raise EmxRiskCheckException("Order rate limit of {} reached".format(contract_code))
+                bucket.take()
+            self._reserved += margin
+            self._open.setdefault(contract_code, [0.0, 0.0])[0 if signed > 0 else 1] += size
+        return _Reservation(contract_code, order_side, size, margin)
+
+    def _bucket(self, contract_code):
+        bucket = self._buckets.get(contract_code)
+        if bucket is None:
+            rate = _limit(self.order_rate, contract_code)
+            if rate is None:
+                return None
+            bucket = self._buckets[contract_code] = TokenBucket(rate, _limit(self.order_burst, contract_code))
+        return bucket
+
+    ### Reservations ###
+
+    def _reduce(self, reservation, size):
+        size = min(size, reservation.size)
+        side = 0 if reservation.side == "buy" else 1
+        self._open[reservation.contract_code][side] -= size
+        margin = reservation.margin * size / reservation.size if reservation.size else reservation.margin
+        self._reserved = max(0.0, self._reserved - margin)
+        reservation.margin -= margin
+        reservation.size -= size
+        if reservation.size <= 0 and reservation.order_id is not None:
+            self._reservations.pop(reservation.order_id, None)
+
+    def release(self, reservation):
+        """Free the exposure and margin of an order that is not working (any more)."""
+        if reservation is None:
+            return
+        with self._lock:
+            if reservation.size > 0:
+                self._reduce(reservation, reservation.size)
+
+    def bind(self, reservation, order_id):
+        """Attach the exchange order_id (or client_id) of a placed order, so that
+        :meth:`on_message` releases its reservation. Without an id the reservation
+        is released."""
+        if reservation is None:
+            return
+        if not order_id:
+            self.release(reservation)
+            return
+        with self._lock:
+            reservation.order_id = order_id
+            if self._finished.pop(order_id, None) is not None:
+                # The order stopped working before its placement was acknowledged
+                self._reduce(reservation, reservation.size)
+            elif reservation.size > 0:
+                self._reservations[order_id] = reservation
+
+    def on_message(self, msg):
+        """Feed the ``orders`` channel: fills and terminal events release reservations.
+        Other messages are ignored.
+
+        :param msg: raw json string, decoded dict or :mod:`emx.messages` record
+        :returns: None
+        """
+        msg = as_dict(msg)
+        if msg.get("channel") != "orders":
+            return
+        event = msg.get("type")
+        data = msg.get("data", {})
+        with self._lock:
+            for item in data if isinstance(data, list) else [data]:
+                ids = [key for key in (item.get("order_id"), item.get("client_id")) if key]
+                terminal = event in TERMINAL_EVENTS or item.get("status") in TERMINAL_STATUSES
+                reservation = next((self._reservations[key] for key in ids if key in self._reservations), None)
+                if reservation is None:
+                    if terminal:
+                        for key in ids:
+                            self._finished[key] = True
+                        while len(self._finished) > 1024:
+                            self._finished.popitem(last=False)
+                    continue
+                if terminal:
+                    self._reduce(reservation, reservation.size)
+                elif event == "filled":
+                    self._reduce(reservation, get_float(item, "fill_size") or 0.0)
+
+    ### Balances ###
+
+    def refresh_balances(self):
+        """Load the available funds of ``trader_id``. The margin reserved by orders
+        accepted so far is dropped: the exchange figures include them now.
+
+        :returns: available funds
+        """
+        balances = self.rest_api.get_balances(self.trader_id)
+        with self._lock:
+            self.available_funds = float(balances["available_funds"])
+            self._reserved = 0.0
+            for reservation in self._reservations.values():
+                reservation.margin = 0.0
+        return self.available_funds
+
+    def start_refresh(self, interval, on_error=None):
+        """Refresh the balances every ``interval`` seconds in a background thread.
+
+        :param on_error: (optional) callable receiving the exception of a failed refresh;
+            failures are logged by default
+        """
+        self.stop_refresh()
+        stop = self._refresh_stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.refresh_balances()
+                except Exception as err:
+                    if on_error is None:
+                        logger.exception("Balance refresh failed")
+                    else:
+                        on_error(err)
+
+        threading.Thread(target=run, name="emx-risk", daemon=True).start()
+
+    def stop_refresh(self):
+        if self._refresh_stop is not None:
+            self._refresh_stop.set()
+            self._refresh_stop = None
+
+
+def placed_order_id(result):
+    """Exchange order_id in a ``create_new_order`` response, or None."""
+    order = result.get("order") if isinstance(result, dict) else None
+    return order.get("order_id") if isinstance(order, dict) else None
+
+
+def risk_checked(func):
+    """Decorate an order entry method taking ``create_new_order`` arguments so
+    that ``self.risk`` checks the order first when one is set. The reservation
+    is released if the request fails."""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.risk is None:
+            return func(self, *args, **kwargs)
+        reservation = self.risk.check(*args, **kwargs)
+        try:
+            result = func(self, *args, **kwargs)
+        except Exception:
+            self.risk.release(reservation)
+            raise
+        self.risk.bind(reservation, placed_order_id(result))
+        return result
+    return wrapper
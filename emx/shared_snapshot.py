@@ -0,0 +1,292 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+""" Latest market snapshot per contract in shared memory, written by one
+process and read by any number of local processes.
+
+Segment layout (little endian)::
+
+    header   MAGIC, capacity (uint32), count (uint32), padded to HEADER_SIZE
+    slot[i]  sequence (uint64), contract_code (16 bytes), bid, bid_size, ask,
+             ask_size, last_price, last_size, mark_price (float64),
+             timestamp (uint64, ns), padded to SLOT_SIZE
+
+Every slot is a seqlock: the publisher makes ``sequence`` odd, writes the
+fields, then makes it even again. A reader unpacks the slot straight from the
+mapped buffer and retries if the sequence was odd or changed meanwhile, so
+reads take no lock and never block the publisher. Unknown values are NaN.
+"""
+
+import math
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+from emx.messages import as_dict
+from emx.models import get_float
+from emx.utils import EmxApiException, EmxApiTimeoutException
+
+
+MAGIC = b"EMXSNAP1"
+HEADER = struct.Struct("<8sII")
+HEADER_SIZE = 64
+SEQUENCE = struct.Struct("<Q")
+FIELDS = struct.Struct("<16s7dQ")
+SLOT_SIZE = 128
+CODE_SIZE = 16
+DEFAULT_NAME = "emx-snapshot"
+
+Snapshot = namedtuple("Snapshot", ["contract_code", "bid", "bid_size", "ask", "ask_size",
+                                   "last_price", "last_size", "mark_price", "timestamp", "sequence"])
+Snapshot.__doc__ = """Latest values of one contract. ``timestamp`` is the publish time in
+nanoseconds since the epoch; ``sequence`` grows with every update."""
+
+_VALUE_INDEX = {field: i for i, field in enumerate(Snapshot._fields[1:8])}
+
+
+def _slot_offset(slot):
+    return HEADER_SIZE + slot * SLOT_SIZE
+
+
+class SnapshotPublisher():
+    """ Owns the shared memory segment and writes the latest top of book, last
+    trade and mark price of every contract seen on the feed.
+
+    Feed it with :meth:`on_message`, or let :meth:`run` read a
+    :class:`emx.ws_api.WebSocketApi` subscribed to ``ticker`` (and optionally
+    ``trade`` and ``level2``). Only one publisher may write a segment.
+
+    :param name: shared memory segment name readers attach to
+    :param capacity: maximum number of contracts
+    :param books: (optional) :class:`emx.order_book.OrderBookManager`; when given,
+        ``level2`` messages update the top of book with its best levels
+    :param replace: remove a segment of the same name left behind by a publisher
+        that did not close it (e.g. after a crash) instead of raising FileExistsError
+    """
+
+    def __init__(self, name=DEFAULT_NAME, capacity=256, books=None, replace=False):
+        self.name = name
+        self.capacity = capacity
+        self.books = books
+        size = HEADER_SIZE + capacity * SLOT_SIZE
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise
+            # Readers still attached to the stale segment keep its mapping
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._buf = self._shm.buf
+        self._slots = {}
+        self._values = []
+        self._sequences = []
+        self._running = False
+        HEADER.pack_into(self._buf, 0, MAGIC, capacity, 0)
+
+    def _slot(self, contract_code):
+        slot = self._slots.get(contract_code)
+        if slot is None:
+            slot = len(self._slots)
+            if slot >= self.capacity:
+                raise EmxApiException("Snapshot segment {} is full ({} contracts)".format(self.name, self.capacity))
+            code = contract_code.encode()
+            if len(code) > CODE_SIZE:
+                raise EmxApiException("Contract code too long for the snapshot segment: {}".format(contract_code))
+            self._slots[contract_code] = slot
+            self._values.append([math.nan] * 7)
+            self._sequences.append(0)
+            self._write(slot, code)
+            # Readers only look at slots below count, so the code is in place first
+            HEADER.pack_into(self._buf, 0, MAGIC, self.capacity, slot + 1)
+        return slot
+
+    def _write(self, slot, code=None):
+        offset = _slot_offset(slot)
+        if code is None:
+            code = FIELDS.unpack_from(self._buf, offset + SEQUENCE.size)[0]
+        sequence = self._sequences[slot] + 1
+        SEQUENCE.pack_into(self._buf, offset, sequence)
+        FIELDS.pack_into(self._buf, offset + SEQUENCE.size, code, *self._values[slot], time.time_ns())
+        self._sequences[slot] = sequence + 1
+        SEQUENCE.pack_into(self._buf, offset, sequence + 1)
+
+    def update(self, contract_code, **values):
+        """Publish new values of a contract; fields not given keep their value.
+
+        :param values: any of bid, bid_size, ask, ask_size, last_price, last_size, mark_price
+        :returns: None
+        """
+        slot = self._slot(contract_code)
+        current = self._values[slot]
+        for field, value in values.items():
+            if value is not None:
+                current[_VALUE_INDEX[field]] = float(value)
+        self._write(slot)
+
+    def on_message(self, msg):
+        """Feed a message received from :class:`emx.ws_api.WebSocketApi`.
+        Messages from other channels are ignored.
+
+        :param msg: raw json string, decoded dict or :mod:`emx.messages` record
+        :returns: None
+        """
+        msg = as_dict(msg)
+        channel = msg.get("channel")
+        if channel == "level2":
+            if self.books is not None:
+                book = self.books.on_message(msg)
+                if book is not None and book.synced:
+                    self.update(book.contract_code, bid=book.best_bid(), bid_size=book.best_bid_size(),
+                                ask=book.best_ask(), ask_size=book.best_ask_size())
+            return
+        if channel not in ("ticker", "trade", "trades"):
+            return
+        data = msg.get("data", {})
+        for item in data if isinstance(data, list) else [data]:
+            contract_code = item.get("contract_code") or msg.get("contract_code")
+            if not contract_code:
+                continue
+            if channel == "ticker":
+                self.update(contract_code, bid=get_float(item, "bid"), bid_size=get_float(item, "bid_size"),
+                            ask=get_float(item, "ask"), ask_size=get_float(item, "ask_size"),
+                            last_price=get_float(item, "last_trade_price"),
+                            mark_price=get_float(item, "mark_price"))
+            else:
+                self.update(contract_code, last_price=get_float(item, "price"),
+                            last_size=get_float(item, "size"))
+
+    def run(self, ws_api):
+        """Publish every message of ``ws_api`` until :meth:`stop` is called."""
+        self._running = True
+        while self._running:
+            try:
+                msg = ws_api.receive_msg()
+            except EmxApiTimeoutException:
+                continue
+            self.on_message(msg)
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        """Release and remove the segment; attached readers keep their mapping."""
+        self._buf = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SnapshotReader():
+    """ Lock-free reader of a segment written by :class:`SnapshotPublisher`.
+
+    Values are unpacked directly from the shared mapping; nothing is copied
+    besides the returned tuple.
+
+    :param name: shared memory segment name
+    :param retries: attempts to get a consistent read before raising
+    """
+
+    def __init__(self, name=DEFAULT_NAME, retries=1000):
+        self.name = name
+        self.retries = retries
+        self._shm = _attach(name)
+        self._buf = self._shm.buf
+        magic, self.capacity, _ = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            self.close()
+            raise EmxApiException("{} is not an EMX snapshot segment".format(name))
+        self._slots = {}
+
+    def _refresh(self):
+        count = HEADER.unpack_from(self._buf, 0)[2]
+        for slot in range(len(self._slots), count):
+            code = FIELDS.unpack_from(self._buf, _slot_offset(slot) + SEQUENCE.size)[0]
+            self._slots[code.rstrip(b"\0").decode()] = slot
+
+    def _read(self, slot):
+        buf = self._buf
+        offset = _slot_offset(slot)
+        for _ in range(self.retries):
+            before = SEQUENCE.unpack_from(buf, offset)[0]
+            if not before & 1:
+                fields = FIELDS.unpack_from(buf, offset + SEQUENCE.size)
+                if SEQUENCE.unpack_from(buf, offset)[0] == before:
+                    return Snapshot(fields[0].rstrip(b"\0").decode(), *fields[1:], before)
+            # Let the publisher finish its write
+            time.sleep(0)
+        raise EmxApiException("No consistent read of snapshot slot {} in {} attempts".format(slot, self.retries))
+
+    def contracts(self):
+        """Contract codes published so far."""
+        self._refresh()
+        return list(self._slots)
+
+    def get(self, contract_code):
+        """:returns: :class:`Snapshot` of a contract, or None if it was never published"""
+        slot = self._slots.get(contract_code)
+        if slot is None:
+            self._refresh()
+            slot = self._slots.get(contract_code)
+            if slot is None:
+                return None
+        return self._read(slot)
+
+    def sequence(self, contract_code):
+        """Current sequence of a contract, a cheap way to poll for changes.
+
+        :returns: int, or None if the contract was never published
+        """
+        slot = self._slots.get(contract_code)
+        if slot is None:
+            self._refresh()
+            slot = self._slots.get(contract_code)
+            if slot is None:
+                return None
+        return SEQUENCE.unpack_from(self._buf, _slot_offset(slot))[0]
+
+    def snapshot(self):
+        """:returns: {contract_code: :class:`Snapshot`} of every published contract"""
+        self._refresh()
+        return {contract_code: self._read(slot) for contract_code, slot in self._slots.items()}
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 the resource tracker of an attaching process
+        # removes the segment when that process exits
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
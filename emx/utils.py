@@ -14,20 +14,38 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import time
-import json
 import hashlib
 import hmac
 import base64
 
+from datetime import datetime
 from functools import wraps
 
+from emx import codec
+
 
 class EmxApiException(Exception):
     pass
 
 
+class EmxApiTimeoutException(EmxApiException):
+    pass
+
+
+class EmxConnectionLostException(EmxApiException):
+    pass
+
+
+class EmxOrderRejectedException(EmxApiException):
+    pass
+
+
+class EmxRiskCheckException(EmxOrderRejectedException):
+    pass
+
+
 def body_to_string(body):
-    return json.dumps(body, separators=(',', ':'))
+    return codec.dumps(body)
 
 
 def generate_signature(api_secret, timestamp, http_method, request_path, body):
@@ -44,13 +62,87 @@ def generate_signature(api_secret, timestamp, http_method, request_path, body):
 
     signature = hmac.new(secret, message.encode(),
                          digestmod=hashlib.sha256).digest()
-    return base64.encodestring(signature)
+    return base64.b64encode(signature)
+
+
+class Signer():
+    """ Reusable request signer for one key pair.
+
+    The secret is decoded and the keyed HMAC state built once; every request
+    clones that state instead of re-keying. The body is serialized once and the
+    same string is both signed and sent.
+
+    :param api_key: key identifier
+    :param api_secret: base64 encoded secret
+    """
+
+    def __init__(self, api_key, api_secret):
+        self.api_key = api_key
+        self._api_secret = api_secret
+        self._hmac = None
+        # Set by clients created with an emx.instrumentation.Instrumentation
+        self.instrumentation = None
+
+    def _keyed_hmac(self):
+        if self._hmac is None:
+            try:
+                secret = base64.b64decode(self._api_secret)
+            except base64.binascii.Error as err:
+                raise EmxApiException("b64decode failed: {}".format(err))
+            self._hmac = hmac.new(secret, digestmod=hashlib.sha256)
+        return self._hmac
+
+    def sign(self, timestamp, http_method, request_path, body=''):
+        """Sign an already serialized body.
+
+        :returns: base64 signature as str
+        """
+        mac = self._keyed_hmac().copy()
+        mac.update((str(timestamp) + http_method + request_path + body).encode())
+        return base64.b64encode(mac.digest()).decode()
+
+    def headers(self, http_method, request_path, body=None):
+        """Build the authentication headers of a request.
+
+        :param body: (optional) request body as dict
+        :returns: (headers, data) where data is the serialized body to send, or None
+        """
+        if self.instrumentation is not None:
+            start = time.perf_counter()
+            result = self._headers(http_method, request_path, body)
+            self.instrumentation.record_sign(time.perf_counter() - start)
+            return result
+        return self._headers(http_method, request_path, body)
+
+    def _headers(self, http_method, request_path, body):
+        data = body_to_string(body) if body else None
+        timestamp = get_timestamp()
+        headers = {
+            'content-type': 'application/json',
+            'EMX-ACCESS-KEY': self.api_key,
+            'EMX-ACCESS-SIG': self.sign(timestamp, http_method, request_path, data or ''),
+            'EMX-ACCESS-TIMESTAMP': str(timestamp),
+        }
+        return headers, data
 
 
 def get_timestamp():
     return int(round(time.time()))
 
 
+def parse_timestamp(text):
+    """Convert an API timestamp ("2018-11-05T17:41:39.123Z") to seconds since the epoch.
+
+    :returns: float, or None if the text is not a timestamp
+    """
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
 class order_request:
     def __init__(self):
         self.instrument_name = ""
@@ -61,13 +153,33 @@ class order_request:
         self.orderid = ""  # optional client id
 
 
+def parse_result(result):
+    if result.status_code < 200 or result.status_code > 300:
+        raise EmxApiException("Request failed. Reason: {}".format(result.text))
+    return codec.loads(result.content)
+
+
 def handle_result(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        result = func(*args, **kwargs)
-        if result.status_code < 200 or result.status_code > 300:
-            raise EmxApiException("Request failed. Reason: {}".format(result.text))
-        return result.json()
+        instrumentation = getattr(args[0], "instrumentation", None) if args else None
+        if instrumentation is not None:
+            return instrumentation.measure_request(func, args, kwargs)
+        return parse_result(func(*args, **kwargs))
+    return wrapper
+
+
+def handle_async_result(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        result = await func(*args, **kwargs)
+        try:
+            text = await result.text()
+        finally:
+            result.release()
+        if result.status < 200 or result.status > 300:
+            raise EmxApiException("Request failed. Reason: {}".format(text))
+        return codec.loads(text)
     return wrapper
 
 
@@ -13,9 +13,47 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
-from websocket import create_connection, WebSocketTimeoutException
-from emx.utils import EmxApiException, generate_signature, get_timestamp
+import itertools
+import random
+import ssl
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from websocket import create_connection, WebSocketTimeoutException, ABNF
+from emx import codec
+from emx.rest_api import RestApi
+from emx.utils import (
+    EmxApiException,
+    EmxApiTimeoutException,
+    EmxConnectionLostException,
+    EmxOrderRejectedException,
+    EmxRiskCheckException,
+    Signer,
+    get_timestamp,
+)
+
+
+# orders channel events acknowledging a modify / cancel request
+ACK_EVENTS = {
+    "modify-order": ("modified",),
+    "cancel-order": ("canceled", "cancelled"),
+}
+
+
+class _PendingOrder():
+    __slots__ = ('action', 'deadline', 'future')
+
+    def __init__(self, action, deadline):
+        self.action = action
+        self.deadline = deadline
+        self.future = Future()
+
+    def resolve(self, result):
+        if isinstance(result, Exception):
+            self.future.set_exception(result)
+        else:
+            self.future.set_result(result)
 
 
 class WebSocketApi():
@@ -23,26 +61,257 @@ class WebSocketApi():
     Api key-secret key pair is optional, but private
     queries will not be possible for authenticated requests (please see EMX API doc)
 
+    With ``auto_reconnect`` enabled, an idle connection is probed with a ping on
+    every receive timeout. If no frame arrives within ``pong_timeout`` seconds, or the
+    socket fails, the client reconnects with jittered exponential backoff, replays
+    every active subscription and returns a synthetic message from ``receive_msg``::
+
+        {"type": "resynced", "channels": [{"name": "", "contract_codes": []}]}
+
+    so downstream state can refresh what went stale while disconnected.
+
     .. note::
        No query rate limiting is performed.
     """
 
-    def __init__(self, api_key='', key_secret='', timeout=3, uri="wss://api.testnet.emx.com"):
-        self.ws = create_connection(uri)
-        self.ws.settimeout(timeout)
+    def __init__(self, api_key='', key_secret='', timeout=3, uri="wss://api.testnet.emx.com",
+                 auto_reconnect=False, pong_timeout=None, max_backoff=30, max_retries=None,
+                 decoder=None, instrumentation=None, recorder=None, risk=None, order_timeout=10):
+        """
+        :param timeout: seconds to wait for a frame before ``receive_msg`` raises
+            EmxApiTimeoutException
+        :param auto_reconnect: reconnect and replay subscriptions when the connection dies
+        :param pong_timeout: seconds to wait for any frame after a ping (defaults to timeout)
+        :param max_backoff: upper bound in seconds of the delay between reconnection attempts
+        :param max_retries: (optional) give up after this many failed attempts
+        :param decoder: (optional) callable applied to every frame by ``receive_msg``,
+            e.g. ``emx.codec.loads`` or ``emx.messages.decode_message``
+        :param instrumentation: (optional) :class:`emx.instrumentation.Instrumentation`
+            counting messages, bytes and exchange-to-local lag per channel
+        :param recorder: (optional) :class:`emx.recorder.Recorder` receiving a copy of
+            every raw frame
+        :param risk: (optional) :class:`emx.risk.RiskChecker` checking new orders before
+            they are sent
+        :param order_timeout: seconds after which an unacknowledged order entry request
+            fails with EmxApiTimeoutException
+        """
+        self.uri = uri
+        self.timeout = timeout
+        self.auto_reconnect = auto_reconnect
+        self.pong_timeout = timeout if pong_timeout is None else pong_timeout
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.decoder = decoder
+        self.instrumentation = instrumentation
+        self.recorder = recorder
+        self.risk = risk
+        self.order_timeout = order_timeout
 
         self._api_key = api_key
         self._api_secret = key_secret
+        self._signer = Signer(api_key, key_secret)
+
+        # channel -> set of contract codes, replayed after a reconnection
+        self.subscriptions = {}
+        # client_id / order_id -> _PendingOrder sent on this socket, in sending order
+        self._pending_orders = {}
+        self._orders_lock = threading.Lock()
+        self._client_ids = itertools.count(1)
+        self._client_id_prefix = uuid.uuid4().hex[:8]
+        self._ping_sent_at = None
+        self._closed = False
+        # Last synthetic "resynced" message, never recorded
+        self._resync_msg = None
+
+        self.ws = self._connect()
+
+    def _connect(self):
+        ws = create_connection(self.uri)
+        ws.settimeout(self.timeout)
+        return ws
 
     def receive_msg(self):
         try:
-            msg = self.ws.recv()
-        except WebSocketTimeoutException:
-            raise EmxApiException("No messages received")
+            frame = self._receive_frame()
+        except EmxApiTimeoutException:
+            self._expire_pending_orders()
+            raise
+        return self._deliver(frame)
+
+    def poll_msg(self, reconnect=True):
+        """Read one frame from a socket known to be readable, e.g. through a
+        selector watching ``ws.sock`` (see :class:`emx.ws_manager.WebSocketManager`).
+
+        Unlike :meth:`receive_msg`, this never waits for a second frame: control
+        frames (ping, pong) are consumed and None is returned. On a non-blocking
+        socket, a frame not fully received yet is kept buffered and None is returned.
+
+        :param reconnect: with ``auto_reconnect``, reconnect inline when the connection
+            is lost; when False, raise EmxConnectionLostException instead so the caller
+            can run :meth:`reconnect` elsewhere
+        :returns: message as returned by ``receive_msg``, or None
+        """
+        try:
+            opcode, data = self.ws.recv_data(control_frame=True)
+        except (WebSocketTimeoutException, BlockingIOError, ssl.SSLWantReadError):
+            # The frame buffer keeps the part received so far
+            return None
         except Exception as err:
-            raise EmxApiException("Unable to receive msgs. Reason: {}".format(err))
+            if self._closed or not self.auto_reconnect:
+                raise EmxApiException("Unable to receive msgs. Reason: {}".format(err))
+            return self._lost(reconnect, err)
+
+        self._ping_sent_at = None
+        if opcode == ABNF.OPCODE_TEXT:
+            msg = data.decode("utf-8") if isinstance(data, bytes) else data
+        elif opcode == ABNF.OPCODE_BINARY:
+            msg = data
+        elif opcode == ABNF.OPCODE_CLOSE:
+            if self._closed or not self.auto_reconnect:
+                raise EmxApiException("Connection is closed")
+            return self._lost(reconnect, "close frame received")
+        else:
+            return None
+        return self._deliver(msg)
+
+    def on_idle(self, reconnect=True):
+        """Keep-alive step for callers polling the socket themselves, to call when
+        no frame arrived for ``timeout`` seconds. Sends a ping, or reconnects when
+        the previous ping got no answer within ``pong_timeout``.
+
+        :param reconnect: see :meth:`poll_msg`
+        :returns: the "resynced" message after a reconnection, otherwise None
+        """
+        self._expire_pending_orders()
+        if not self.auto_reconnect:
+            return None
+        if self._ping_sent_at is None:
+            self._ping()
+            return None
+        if time.time() - self._ping_sent_at >= self.pong_timeout:
+            return self._lost(reconnect, "no pong within {}s".format(self.pong_timeout))
+        return None
+
+    def _lost(self, reconnect, reason):
+        if not reconnect:
+            raise EmxConnectionLostException("Connection lost. Reason: {}".format(reason))
+        return self.reconnect()
+
+    def reconnect(self):
+        """Open a new connection and replay subscriptions, retrying with backoff.
+        Blocks until connected.
+
+        :returns: the "resynced" message, as returned by ``receive_msg``
+        :raises: EmxApiException if max_retries is exhausted
+        """
+        return self._deliver(self._reconnect())
+
+    def _deliver(self, msg):
+        if self._pending_orders:
+            self._match_order_ack(msg)
+            self._expire_pending_orders()
+        if self.recorder is not None and msg is not self._resync_msg:
+            self.recorder.record(msg)
+        if self.instrumentation is not None:
+            self.instrumentation.on_ws_frame(msg)
+        if self.decoder is not None:
+            return self.decoder(msg)
         return msg
 
+    def _receive_frame(self):
+        if not self.auto_reconnect:
+            try:
+                msg = self.ws.recv()
+            except WebSocketTimeoutException:
+                raise EmxApiTimeoutException("No messages received")
+            except Exception as err:
+                raise EmxApiException("Unable to receive msgs. Reason: {}".format(err))
+            return msg
+
+        while True:
+            try:
+                opcode, data = self.ws.recv_data(control_frame=True)
+            except WebSocketTimeoutException:
+                if self._ping_sent_at is None:
+                    self._ping()
+                    raise EmxApiTimeoutException("No messages received")
+                if time.time() - self._ping_sent_at < self.pong_timeout:
+                    raise EmxApiTimeoutException("No messages received")
+                return self._reconnect()
+            except Exception:
+                if self._closed:
+                    raise EmxApiException("Connection is closed")
+                return self._reconnect()
+
+            self._ping_sent_at = None
+            if opcode == ABNF.OPCODE_TEXT:
+                return data.decode("utf-8") if isinstance(data, bytes) else data
+            if opcode == ABNF.OPCODE_BINARY:
+                return data
+            if opcode == ABNF.OPCODE_CLOSE:
+                return self._reconnect()
+            # ping / pong frames only prove the connection is alive
+
+    def _ping(self):
+        try:
+            self.ws.ping()
+        except Exception:
+            pass
+        self._ping_sent_at = time.time()
+
+    def _reconnect(self):
+        """Open a new connection, replay subscriptions and build the resync event.
+
+        :returns: json string of the "resynced" message
+        :raises: EmxApiException if max_retries is exhausted
+        """
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+        self._fail_pending_orders("Connection lost before the order was acknowledged")
+
+        attempt = 0
+        while True:
+            if self._closed:
+                raise EmxApiException("Connection is closed")
+            try:
+                self.ws = self._connect()
+                self._ping_sent_at = None
+                self._replay_subscriptions()
+                break
+            except Exception as err:
+                attempt += 1
+                if self.max_retries is not None and attempt >= self.max_retries:
+                    raise EmxApiException("Unable to reconnect. Reason: {}".format(err))
+                delay = min(self.max_backoff, 0.5 * 2 ** attempt)
+                time.sleep(random.uniform(delay / 2, delay))
+
+        self._resync_msg = codec.dumps({
+            "type": "resynced",
+            "channels": [{"name": channel, "contract_codes": sorted(codes)}
+                         for channel, codes in self.subscriptions.items()]
+        })
+        return self._resync_msg
+
+    def _replay_subscriptions(self):
+        # Every replayed subscription is signed again with a fresh timestamp
+        for channel, codes in self.subscriptions.items():
+            self.ws.send(codec.dumps(self._subscribe_msg(sorted(codes), [channel])))
+
+    def _subscribe_msg(self, symbols, channels):
+        endpoint = "/v1/user/verify"
+        timestamp = get_timestamp()
+        signature = self._signer.sign(timestamp, "GET", endpoint)
+        return {
+                "type": "subscribe",
+                "contract_codes": symbols,
+                "channels": channels,
+                "key": self._api_key,
+                "sig": signature,
+                "timestamp": timestamp
+             }
+
     def subscribe(self, symbols, channels):
         """Subscribe to selected channels. EMX response looks like
         {
@@ -64,22 +333,15 @@ class WebSocketApi():
         :returns: None
         """
 
-        endpoint = "/v1/user/verify"
-        timestamp = get_timestamp()
-        signature = generate_signature(self._api_secret, timestamp, "GET", endpoint, None)
-        msg = {
-                "type": "subscribe",
-                "contract_codes": symbols,
-                "channels": channels,
-                "key": self._api_key,
-                "sig": signature.decode().strip(),
-                "timestamp": timestamp
-             }
+        msg = self._subscribe_msg(symbols, channels)
         try:
-            self.ws.send(json.dumps(msg))
+            self.ws.send(codec.dumps(msg))
         except Exception as err:
             raise EmxApiException("Unable to send request. Reason: {}".format(err))
 
+        for channel in channels:
+            self.subscriptions.setdefault(channel, set()).update(symbols)
+
     def unsubscribe(self, channels):
         """Unsubscribe from selected channels for all contacts. EMX response looks like {"type":"subscriptions","channels":[]}
 
@@ -90,12 +352,183 @@ class WebSocketApi():
         msg = {
             "type": "unsubscribe",
             "contract_codes": [],
-            "channels": ["orders"]
+            "channels": channels
+        }
+        try:
+            self.ws.send(codec.dumps(msg))
+        except Exception as err:
+            raise EmxApiException("Unable to send request. Reason: {}".format(err))
+
+        for channel in channels:
+            self.subscriptions.pop(channel, None)
+
+    ### Order Entry ###
+
+    def _send_order_request(self, action, http_method, endpoint, body, key):
+        """Sign and send a request on the ``trading`` channel.
+
+        The signature covers the equivalent REST request, as for RestApi.
+        Acknowledgements are matched on ``key`` (client_id or order_id) and on
+        the event types expected for ``action``.
+        """
+        timestamp = get_timestamp()
+        msg = {
+            "type": "request",
+            "channel": "trading",
+            "action": action,
+            "data": body,
+            "key": self._api_key,
+            "sig": self._signer.sign(timestamp, http_method, endpoint, codec.dumps(body)),
+            "timestamp": timestamp
         }
+        pending = _PendingOrder(action, time.monotonic() + self.order_timeout)
+        with self._orders_lock:
+            self._pending_orders[key] = pending
         try:
-            self.ws.send(json.dumps(msg))
+            self.ws.send(codec.dumps(msg))
         except Exception as err:
+            with self._orders_lock:
+                self._pending_orders.pop(key, None)
             raise EmxApiException("Unable to send request. Reason: {}".format(err))
+        return pending.future
+
+    def create_new_order(self, contract_code, order_type, order_side, size, client_id="", price="", stop_price="",
+                     stop_trigger="", peg_price_type="", peg_offset_value="", reduce_only=False, post_only=False):
+        """Send a new order on the socket. Arguments are those of ``RestApi.create_new_order``.
+
+        The connection must be subscribed to the ``orders`` channel of the contract:
+        the returned future is resolved by the first event carrying the order
+        client_id, while ``receive_msg`` (or ``poll_msg``) is being called.
+        A client_id is generated when none is given.
+
+        :returns: ``concurrent.futures.Future`` resolved with the acknowledgement data,
+            or failed with EmxOrderRejectedException (EmxRiskCheckException when ``risk``
+            rejects the order, without sending it), or with EmxApiTimeoutException after
+            ``order_timeout`` seconds
+        """
+        reservation = None
+        if self.risk is not None:
+            try:
+                reservation = self.risk.check(contract_code, order_type, order_side, size, client_id, price,
+                                              stop_price, stop_trigger, peg_price_type, peg_offset_value,
+                                              reduce_only, post_only)
+            except EmxRiskCheckException as err:
+                future = Future()
+                future.set_exception(err)
+                return future
+        if not client_id:
+            client_id = "{}-{}".format(self._client_id_prefix, next(self._client_ids))
+        try:
+            body = RestApi._new_order_body(contract_code, order_type, order_side, size, client_id, price,
+                                           stop_price, stop_trigger, peg_price_type, peg_offset_value,
+                                           reduce_only, post_only)
+            future = self._send_order_request("create-order", "POST", "/v1/orders", body, client_id)
+        except Exception:
+            if reservation is not None:
+                self.risk.release(reservation)
+            raise
+        if reservation is not None:
+            # Events of the order carry its client_id; an order without a
+            # verdict (timeout, lost connection) stays reserved meanwhile
+            self.risk.bind(reservation, client_id)
+            future.add_done_callback(lambda done: self._release_rejected(reservation, done))
+        return future
+
+    def _release_rejected(self, reservation, future):
+        if not future.cancelled() and isinstance(future.exception(), EmxOrderRejectedException):
+            self.risk.release(reservation)
+
+    def modify_order(self, exchange_orderid, order_type, order_side, order_size, order_price=None,
+                     order_stop_price=None):
+        """Modify an order on the socket. Arguments are those of ``RestApi.modify_order``.
+
+        :returns: ``concurrent.futures.Future`` resolved by the ``modified`` event of the order
+        """
+        body = RestApi._modify_order_body(order_type, order_side, order_size, order_price, order_stop_price)
+        body["order_id"] = exchange_orderid
+        return self._send_order_request("modify-order", "PATCH", "/v1/orders/{}".format(exchange_orderid),
+                                        body, exchange_orderid)
+
+    def cancel_order(self, exchange_orderid):
+        """Cancel an order on the socket.
+
+        :returns: ``concurrent.futures.Future`` resolved by the ``canceled`` event of the order
+        """
+        return self._send_order_request("cancel-order", "DELETE", "/v1/orders/{}".format(exchange_orderid),
+                                        {"order_id": exchange_orderid}, exchange_orderid)
+
+    def _match_order_ack(self, msg):
+        if isinstance(msg, bytes):
+            msg = msg.decode("utf-8", "replace")
+        # Cheap test before decoding: only order events and errors can carry acks
+        if '"orders"' not in msg and '"error"' not in msg:
+            return
+        try:
+            parsed = codec.loads(msg)
+        except ValueError:
+            return
+        msg_type = parsed.get("type") or ""
+        if msg_type == "error":
+            self._match_error(parsed)
+            return
+        if parsed.get("channel") != "orders":
+            return
+        data = parsed.get("data", {})
+        for item in data if isinstance(data, list) else [data]:
+            with self._orders_lock:
+                key, pending = self._find_pending(item)
+                if pending is None:
+                    continue
+                if msg_type.endswith("rejected"):
+                    result = EmxOrderRejectedException(item.get("message") or item.get("reason") or msg_type)
+                elif pending.action == "create-order" or msg_type in ACK_EVENTS[pending.action]:
+                    result = item
+                else:
+                    # Fill or stale update of an order with a modify / cancel in flight
+                    continue
+                del self._pending_orders[key]
+            pending.resolve(result)
+
+    def _find_pending(self, item):
+        for key in (item.get("client_id"), item.get("order_id")):
+            pending = self._pending_orders.get(key)
+            if pending is not None:
+                return key, pending
+        return None, None
+
+    def _match_error(self, parsed):
+        data = parsed.get("data")
+        item = data if isinstance(data, dict) else parsed
+        with self._orders_lock:
+            key, pending = self._find_pending(item)
+            if pending is None and self._pending_orders:
+                # Requests are answered in order: an error naming no order
+                # belongs to the oldest unacknowledged request
+                key = next(iter(self._pending_orders))
+                pending = self._pending_orders[key]
+            if pending is None:
+                return
+            del self._pending_orders[key]
+        pending.resolve(EmxOrderRejectedException(item.get("message") or item.get("reason") or "error"))
+
+    def _expire_pending_orders(self):
+        if not self._pending_orders:
+            return
+        now = time.monotonic()
+        with self._orders_lock:
+            expired = [key for key, pending in self._pending_orders.items() if pending.deadline <= now]
+            expired = [self._pending_orders.pop(key) for key in expired]
+        for pending in expired:
+            pending.resolve(EmxApiTimeoutException(
+                "No acknowledgement of {} within {}s".format(pending.action, self.order_timeout)))
+
+    def _fail_pending_orders(self, reason):
+        with self._orders_lock:
+            pending, self._pending_orders = self._pending_orders, {}
+        for request in pending.values():
+            request.resolve(EmxApiException(reason))
 
     def close(self):
+        self._closed = True
+        self._fail_pending_orders("Connection closed before the order was acknowledged")
         self.ws.close()
@@ -0,0 +1,289 @@
+# This file is part of EMX client python library
+
+# EMX client library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import selectors
+import socket
+import threading
+import time
+import zlib
+from collections import deque
+from emx.utils import EmxApiException, EmxApiTimeoutException, EmxConnectionLostException
+from emx.ws_api import WebSocketApi
+
+
+PRIVATE_CHANNELS = ("orders", "positions", "balances", "fills")
+
+
+def by_channel_class(channel, contract_code):
+    """Default policy: private channels, level2 and the other public channels
+    each get their own connection."""
+    if channel in PRIVATE_CHANNELS:
+        return "private"
+    if channel == "level2":
+        return "level2"
+    return "public"
+
+
+def by_channel(channel, contract_code):
+    """One connection per channel."""
+    return channel
+
+
+def by_contract(shards):
+    """Policy spreading public subscriptions over ``shards`` connections by
+    contract code, with private channels on a connection of their own."""
+    def policy(channel, contract_code):
+        if channel in PRIVATE_CHANNELS:
+            return "private"
+        return "public-{}".format(zlib.crc32(contract_code.encode()) % shards)
+    return policy
+
+
+class WebSocketManager():
+    """ Spreads subscriptions over several :class:`emx.ws_api.WebSocketApi`
+    connections and merges them into one stream, from a single thread.
+
+    The policy maps every (channel, contract_code) pair to a shard name; each
+    shard is one connection, opened on first use. All sockets are watched by
+    one selector. When several shards have messages ready, the shards listed
+    in ``priority`` are served first, so a busy ``level2`` feed never delays
+    ``orders`` messages.
+
+    A lost connection is reconnected on a background thread, with the backoff
+    of :class:`emx.ws_api.WebSocketApi`, while the other shards keep being
+    served; its "resynced" message is then returned by :meth:`receive`.
+
+    :param policy: callable(channel, contract_code) returning a shard name
+    :param priority: shard names served before the others, in order
+    :param timeout: seconds ``receive_msg`` waits before raising EmxApiTimeoutException
+    :param ws_options: keyword arguments given to every WebSocketApi
+        (auto_reconnect, decoder, instrumentation, recorder, ...)
+    """
+
+    def __init__(self, api_key='', key_secret='', uri="wss://api.testnet.emx.com",
+                 policy=by_channel_class, priority=("private",), timeout=3, **ws_options):
+        self.api_key = api_key
+        self.key_secret = key_secret
+        self.uri = uri
+        self.policy = policy
+        self.priority = tuple(priority)
+        self.timeout = timeout
+        self.ws_options = ws_options
+
+        self.connections = {}
+        self._selector = selectors.DefaultSelector()
+        self._sockets = {}
+        self._ready = {}
+        self._last_frame = {}
+        # shard -> reconnection thread; finished reconnections are queued in _reconnected
+        self._reconnecting = {}
+        self._reconnected = deque()
+        self._waker, self._wake_writer = socket.socketpair()
+        self._waker.setblocking(False)
+        self._selector.register(self._waker, selectors.EVENT_READ, None)
+
+    def connection(self, shard):
+        """Connection of a shard, opened on first use."""
+        conn = self.connections.get(shard)
+        if conn is None:
+            conn = WebSocketApi(self.api_key, self.key_secret, timeout=self.timeout, uri=self.uri,
+                                **self.ws_options)
+            self.connections[shard] = conn
+            self._ready[shard] = deque()
+            self._last_frame[shard] = time.monotonic()
+            self._register(shard)
+        return conn
+
+    def _register(self, shard):
+        # A reconnection replaces the socket of a WebSocketApi
+        sock = self.connections[shard].ws.sock
+        previous = self._sockets.get(shard)
+        if previous is sock:
+            return
+        if previous is not None:
+            try:
+                self._selector.unregister(previous)
+            except (KeyError, ValueError):
+                pass
+        self._selector.register(sock, selectors.EVENT_READ, shard)
+        self._sockets[shard] = sock
+
+    def subscribe(self, symbols, channels):
+        """Subscribe every (channel, symbol) pair on the connection chosen by the policy.
+
+        :param symbols: instrument symbols list
+        :param channels: subscription channels list
+        :returns: None
+        """
+        groups = {}
+        for channel in channels:
+            for symbol in symbols:
+                shard = self.policy(channel, symbol)
+                groups.setdefault((shard, channel), []).append(symbol)
+        for (shard, channel), shard_symbols in groups.items():
+            if shard in self._reconnecting:
+                raise EmxApiException("Shard {} is reconnecting".format(shard))
+            self.connection(shard).subscribe(shard_symbols, [channel])
+
+    def unsubscribe(self, channels):
+        """Unsubscribe from channels on every connection carrying them."""
+        for shard, conn in self.connections.items():
+            subscribed = [channel for channel in channels if channel in conn.subscriptions]
+            if subscribed:
+                if shard in self._reconnecting:
+                    raise EmxApiException("Shard {} is reconnecting".format(shard))
+                conn.unsubscribe(subscribed)
+
+    @property
+    def subscriptions(self):
+        """Merged {channel: set of contract codes} of every connection."""
+        merged = {}
+        for conn in self.connections.values():
+            for channel, codes in conn.subscriptions.items():
+                merged.setdefault(channel, set()).update(codes)
+        return merged
+
+    def receive(self):
+        """Next message of the merged stream.
+
+        :returns: (shard, message)
+        :raises: EmxApiTimeoutException if no message arrives within ``timeout``
+        :raises: EmxApiException if a shard could not reconnect
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            self._finish_reconnects()
+            shard = self._next_ready()
+            if shard is not None:
+                return shard, self._ready[shard].popleft()
+
+            now = time.monotonic()
+            if now >= deadline:
+                raise EmxApiTimeoutException("No messages received")
+            for key, _ in self._selector.select(min(deadline - now, self.timeout)):
+                if key.data is None:
+                    self._drain_waker()
+                elif key.data not in self._reconnecting:
+                    self._read(key.data)
+            self._check_idle()
+
+    def receive_msg(self):
+        return self.receive()[1]
+
+    def _next_ready(self):
+        for shard in self.priority:
+            ready = self._ready.get(shard)
+            if ready:
+                return shard
+        for shard, ready in self._ready.items():
+            if ready:
+                return shard
+        return None
+
+    def _read(self, shard):
+        conn = self.connections[shard]
+        sock = conn.ws.sock
+        # Non-blocking while reading, so a partially received frame is buffered
+        # by the connection instead of stalling every other shard
+        sock.settimeout(0)
+        try:
+            while True:
+                try:
+                    msg = conn.poll_msg(reconnect=False)
+                except EmxConnectionLostException:
+                    self._start_reconnect(shard)
+                    return
+                self._last_frame[shard] = time.monotonic()
+                if msg is not None:
+                    self._ready[shard].append(msg)
+                # TLS may hold decrypted frames the selector cannot see
+                pending = getattr(sock, "pending", None)
+                if pending is None or not pending():
+                    return
+        finally:
+            # Sends (subscriptions, orders) need the blocking socket back; a lost
+            # socket now belongs to the reconnection thread
+            if shard not in self._reconnecting:
+                sock.settimeout(conn.timeout)
+
+    def _check_idle(self):
+        now = time.monotonic()
+        for shard, conn in list(self.connections.items()):
+            if shard in self._reconnecting or now - self._last_frame[shard] < self.timeout:
+                continue
+            self._last_frame[shard] = now
+            try:
+                conn.on_idle(reconnect=False)
+            except EmxConnectionLostException:
+                self._start_reconnect(shard)
+
+    ### Reconnection ###
+
+    def _start_reconnect(self, shard):
+        # The dead socket leaves the selector until the new one is registered
+        sock = self._sockets.pop(shard, None)
+        if sock is not None:
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+        conn = self.connections[shard]
+
+        def run():
+            try:
+                result = conn.reconnect()
+            except Exception as err:
+                result = err
+            self._reconnected.append((shard, result))
+            try:
+                self._wake_writer.send(b"\0")
+            except OSError:
+                pass
+
+        thread = threading.Thread(target=run, name="emx-ws-reconnect-{}".format(shard), daemon=True)
+        self._reconnecting[shard] = thread
+        thread.start()
+
+    def _finish_reconnects(self):
+        while self._reconnected:
+            shard, result = self._reconnected.popleft()
+            del self._reconnecting[shard]
+            if shard not in self.connections:
+                continue
+            if isinstance(result, Exception):
+                raise EmxApiException("Shard {} could not reconnect. Reason: {}".format(shard, result))
+            self._register(shard)
+            self._last_frame[shard] = time.monotonic()
+            self._ready[shard].append(result)
+
+    def _drain_waker(self):
+        try:
+            while self._waker.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def close(self):
+        for shard, conn in self.connections.items():
+            try:
+                self._selector.unregister(self._sockets[shard])
+            except (KeyError, ValueError):
+                pass
+            conn.close()
+        self._selector.close()
+        self._waker.close()
+        self._wake_writer.close()
+        self.connections.clear()
+        self._sockets.clear()
@@ -11,6 +11,10 @@ setuptools.setup(
         packages=setuptools.find_packages(),
         long_description=open('README.md').read(),
         zip_safe=False,
+        extras_require={
+            'numpy': ['numpy>=1.17'],
+            'async': ['aiohttp>=3.3'],
+        },
         classifiers=[
             "Programming Language :: Python :: 3",
             "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
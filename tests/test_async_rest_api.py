@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+
+web = pytest.importorskip("aiohttp.web")
+
+from emx.async_rest_api import AsyncRestApi
+from emx.utils import EmxApiException
+
+
+async def _run(check):
+    requests = []
+
+    async def accounts(request):
+        requests.append(request)
+        return web.json_response({"accounts": [{"trader_id": "T1"}]})
+
+    async def quote(request):
+        requests.append(request)
+        if request.match_info["code"] == "BAD":
+            return web.json_response({"message": "unknown contract"}, status=404)
+        return web.json_response({"contract_code": request.match_info["code"]})
+
+    app = web.Application()
+    app.router.add_get("/v1/accounts", accounts)
+    app.router.add_get("/v1/contracts/{code}/quote", quote)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with AsyncRestApi("key", "c2VjcmV0", uri="http://127.0.0.1:{}".format(port), pool_size=4) as api:
+            await check(api, requests)
+    finally:
+        await runner.cleanup()
+
+
+def test_routes_are_signed_and_concurrent():
+    async def check(api, requests):
+        account = await api.get_account()
+        assert account["accounts"][0]["trader_id"] == "T1"
+        assert requests[0].headers["EMX-ACCESS-KEY"] == "key" and "EMX-ACCESS-SIG" in requests[0].headers
+
+        codes = ["C{}".format(i) for i in range(20)]
+        quotes = await asyncio.gather(*[api.get_contract_quote(code) for code in codes])
+        assert [quote["contract_code"] for quote in quotes] == codes
+        assert "EMX-ACCESS-SIG" not in requests[-1].headers
+
+    asyncio.run(_run(check))
+
+
+def test_failed_request_raises():
+    async def check(api, requests):
+        with pytest.raises(EmxApiException):
+            await api.get_contract_quote("BAD")
+
+    asyncio.run(_run(check))
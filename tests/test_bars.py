@@ -0,0 +1,15 @@
+from emx.bars import TimeBarSeries
+
+
+def test_late_trade_after_close_until_is_dropped():
+    series = TimeBarSeries(60, capacity=8)
+    series.on_trade(0.0, 100.0, 1.0)
+    series.on_trade(30.0, 101.0, 1.0)
+    assert series.close_until(61.0)
+    # Still inside the completed [0, 60) bar
+    assert not series.on_trade(59.0, 90.0, 5.0)
+    assert series.current is None and len(series) == 1
+    assert series.bars().close[-1] == 101.0 and series.bars().volume[-1] == 2.0
+
+    series.on_trade(61.0, 102.0, 1.0)
+    assert series.current[1] == 102.0
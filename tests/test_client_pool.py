@@ -0,0 +1,30 @@
+from emx.client_pool import ClientPool
+from emx.utils import EmxApiException
+
+
+def _fail(*args):
+    raise EmxApiException("invalid key")
+
+
+def test_failed_key_does_not_hide_other_balances():
+    with ClientPool() as pool:
+        main = pool.add("main", "key", "c2VjcmV0")
+        main.get_account = lambda: {"accounts": [{"trader_id": "T1"}, {"trader_id": "T2"}]}
+        main.get_balances = lambda trader_id: {"trader_id": trader_id}
+        pool.add("broken", "key", "c2VjcmV0").get_account = _fail
+
+        assert pool.trader_ids() == {"main": ["T1", "T2"]}
+        assert isinstance(pool.account_errors["broken"], EmxApiException)
+        balances = pool.get_balances()
+        assert balances["T1"].result == {"trader_id": "T1"} and balances["T2"].ok
+        assert not balances["broken"].ok
+        assert "broken" in str(pool.get_balances(["T3"])["T3"].error)
+
+
+def test_clients_share_the_bulk_executor():
+    with ClientPool() as pool:
+        first = pool.add("first", "key", "c2VjcmV0")
+        second = pool.add("second", "key", "c2VjcmV0")
+        assert first._executor is second._executor is not None
+        first.close()
+        assert second._executor.submit(lambda: 1).result() == 1
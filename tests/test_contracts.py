@@ -0,0 +1,83 @@
+import logging
+import time
+import pytest
+import emx.contracts
+from emx.contracts import Contract, ContractRegistry
+from emx.utils import EmxApiException
+
+
+class FakeRestApi():
+    uri = "http://contracts.test"
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.calls = 0
+
+    def get_contracts(self):
+        self.calls += 1
+        return {"contracts": [{"contract_code": code, "minimum_price_increment": "0.5"} for code in self.codes]}
+
+
+@pytest.fixture(autouse=True)
+def shared_registries(monkeypatch):
+    # Registries shared by uri must not leak between tests
+    monkeypatch.setattr(emx.contracts, "_shared", {})
+
+
+def _wait(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.005)
+
+
+def test_unknown_codes_refresh_in_background_once_per_ttl():
+    rest_api = FakeRestApi(["BTCZ18"])
+    registry = ContractRegistry(rest_api, ttl=60)
+    assert registry.get("BTCZ18").price_to_ticks("100") == 200
+    rest_api.codes.append("ETHZ18")
+    for _ in range(5):
+        with pytest.raises(EmxApiException):
+            registry.get("XXX")
+    _wait(lambda: "ETHZ18" in registry)
+    assert rest_api.calls == 2
+    assert registry.get("ETHZ18").contract_code == "ETHZ18"
+
+
+def test_price_to_ticks_without_tick_size():
+    contract = Contract({"contract_code": "BTCZ18"})
+    with pytest.raises(EmxApiException):
+        contract.price_to_ticks("100")
+
+
+def test_shared_is_reused_by_every_client_of_a_uri():
+    rest_api = FakeRestApi([])
+    registry = ContractRegistry.shared(rest_api, ttl=30)
+    assert ContractRegistry.shared(rest_api) is registry
+    # Another client of the same endpoint reuses it, with the first client and ttl
+    assert ContractRegistry.shared(FakeRestApi([]), ttl=60) is registry
+    assert registry.rest_api is rest_api and registry.ttl == 30
+
+    other = FakeRestApi([])
+    other.uri = "http://other.test"
+    assert ContractRegistry.shared(other) is not registry
+
+
+def test_failed_background_refresh_is_logged(caplog):
+    class FailingRestApi(FakeRestApi):
+        def get_contracts(self):
+            if self.calls:
+                self.calls += 1
+                raise ValueError("bad payload")
+            return super().get_contracts()
+
+    rest_api = FailingRestApi(["BTCZ18"])
+    registry = ContractRegistry(rest_api, ttl=0)
+    registry.get("BTCZ18")
+    with caplog.at_level(logging.ERROR, logger="emx.contracts"):
+        time.sleep(0.001)
+        # Expired data is still served while the refresh fails
+        assert registry.get("BTCZ18").contract_code == "BTCZ18"
+        _wait(lambda: not registry._refreshing)
+    assert rest_api.calls == 2
+    assert "Contract refresh failed" in caplog.text
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from emx.dispatcher import WebSocketDispatcher
+from emx.messages import decode_message
+from emx.order_manager import OrderManager
+from emx.utils import EmxApiTimeoutException
+
+
+class FakeWebSocketApi():
+    def __init__(self, frames, decoder=None):
+        self.frames = list(frames)
+        self.decoder = decoder
+
+    def receive_msg(self):
+        if not self.frames:
+            time.sleep(0.01)
+            raise EmxApiTimeoutException("No messages received")
+        frame = self.frames.pop(0)
+        return self.decoder(frame) if self.decoder is not None else frame
+
+
+class EmptyRestApi():
+    def iter_orders(self, status=None):
+        return iter(())
+
+
+def _wait(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+FRAMES = [
+    json.dumps({"channel": "ticker", "type": "update", "contract_code": "BTCZ18",
+                "data": {"bid": "99.5", "ask": "100.5", "mark_price": "100"}}),
+    json.dumps({"channel": "orders", "type": "accepted", "contract_code": "BTCZ18",
+                "data": {"order_id": "1", "client_id": "a", "side": "buy", "type": "limit",
+                         "size": "2", "price": "99", "status": "accepted"}}),
+    json.dumps({"channel": "orders", "type": "filled", "contract_code": "BTCZ18",
+                "data": {"order_id": "1", "fill_size": "0.5", "fill_price": "99", "status": "accepted"}}),
+]
+
+
+def test_dispatch_decoded_records():
+    quotes = []
+    order_manager = OrderManager(EmptyRestApi())
+    order_manager.reconcile()
+    done = threading.Event()
+
+    def on_order(msg):
+        order_manager.on_message(msg)
+        if msg.get("type") == "filled":
+            done.set()
+
+    dispatcher = WebSocketDispatcher(FakeWebSocketApi(FRAMES, decoder=decode_message))
+    dispatcher.on("ticker", quotes.append)
+    dispatcher.on("orders", on_order)
+    dispatcher.start()
+    try:
+        assert done.wait(2.0)
+        assert _wait(lambda: quotes)
+    finally:
+        dispatcher.stop()
+
+    assert quotes[0]["contract_code"] == "BTCZ18"
+    assert quotes[0]["data"]["bid"] == 99.5
+    order = order_manager.get("1")
+    assert order.type == "limit"
+    assert order.filled_size == 0.5
+    assert order.remaining_size == 1.5
+
+
+def test_errors_do_not_stop_reader_or_workers():
+    errors = []
+    received = []
+
+    def callback(msg):
+        if msg["data"].get("fail"):
+            raise RuntimeError("callback failed")
+        received.append(msg)
+
+    frames = [
+        json.dumps({"channel": "ticker", "contract_code": "A", "data": {"fail": True}}),
+        "not json",
+        json.dumps({"channel": "ticker", "contract_code": "A", "data": {"bid": "1"}}),
+    ]
+    dispatcher = WebSocketDispatcher(FakeWebSocketApi(frames), on_error=errors.append)
+    dispatcher.on("ticker", callback)
+    dispatcher.start()
+    try:
+        assert _wait(lambda: received and len(errors) == 2)
+    finally:
+        dispatcher.stop()
+    assert isinstance(errors[0], (RuntimeError, ValueError))
+    assert received[0]["data"]["bid"] == "1"
+
+
+def test_start_and_on_start_one_worker_per_channel():
+    dispatcher = WebSocketDispatcher(FakeWebSocketApi([]))
+    dispatcher.on("ticker", lambda msg: None)
+    dispatcher.start()
+    try:
+        dispatcher.start()
+        dispatcher.on("ticker", lambda msg: None)
+        dispatcher.on("trade", lambda msg: None)
+        assert sorted(dispatcher._workers) == ["ticker", "trade"]
+    finally:
+        dispatcher.stop()
@@ -0,0 +1,85 @@
+import json
+from datetime import timedelta
+import pytest
+from emx.instrumentation import Instrumentation, LatencyHistogram
+from emx.rest_api import RestApi
+from emx.utils import EmxApiException
+
+
+def test_buckets_bound_values_within_resolution():
+    for micros in list(range(0, 40)) + [100, 1000, 12345, 10 ** 6, 3 * 10 ** 9]:
+        upper = LatencyHistogram._upper_bound(LatencyHistogram._index(micros))
+        # Below 16us buckets are exact, above they are 1/16 of a power of two wide
+        assert micros <= upper <= max(micros, micros * 17 // 16 + 1)
+    # Bucket indexes grow with the value
+    indexes = [LatencyHistogram._index(micros) for micros in range(0, 5000)]
+    assert indexes == sorted(indexes)
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.0
+    for millis in range(1, 101):
+        histogram.record(millis / 1000.0)
+    assert 0.050 <= histogram.percentile(50) <= 0.050 * 17 / 16
+    assert 0.099 <= histogram.percentile(99) <= 0.1
+    # Never above the largest recorded value
+    assert histogram.percentile(100) == histogram.max == 0.1
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["mean"] == pytest.approx(0.0505)
+
+
+class FakeResponse():
+    def __init__(self, status_code=200, payload=None, elapsed=0.002):
+        self.status_code = status_code
+        self.content = json.dumps(payload or {}).encode()
+        self.text = self.content.decode()
+        self.elapsed = timedelta(seconds=elapsed)
+
+
+def test_measure_request_records_phases_under_the_route():
+    instrumentation = Instrumentation()
+    hooks = []
+    instrumentation.add_hook(lambda *event: hooks.append(event[:3]))
+
+    def route():
+        return instrumentation.measure_request(lambda: FakeResponse(payload={"ok": 1}), (), {})
+
+    assert instrumentation.measure_route("get_balances", route, (), {}) == {"ok": 1}
+    rest = instrumentation.stats()["rest"]
+    assert set(rest) == {"get_balances"}
+    assert set(rest["get_balances"]) == {"server", "transfer", "decode", "total"}
+    assert rest["get_balances"]["server"]["max"] == 0.002
+    assert hooks[0] == ("rest", "get_balances", "server")
+
+    # Without a route the function name is used, and failed decodes are measured too
+    def failing():
+        return FakeResponse(status_code=500)
+
+    with pytest.raises(EmxApiException):
+        instrumentation.measure_request(failing, (), {})
+    assert instrumentation.stats()["rest"]["failing"]["decode"]["count"] == 1
+    assert instrumentation.current_endpoint() is None
+
+
+class FakeSession():
+    def request(self, http_method, url, data=None, headers=None):
+        return FakeResponse(payload={"order": {"order_id": "1"}})
+
+
+def test_bulk_requests_are_recorded_under_their_route():
+    instrumentation = Instrumentation()
+    api = RestApi("key", "c2VjcmV0", session=FakeSession(), instrumentation=instrumentation, pool_size=2)
+    orders = [{"contract_code": "BTCZ18", "order_type": "limit", "order_side": "buy", "size": "1",
+               "price": "100"}] * 3
+    assert all(result.ok for result in api.create_orders(orders))
+    assert all(result.ok for result in api.cancel_orders(["1", "2"]))
+    api.close()
+
+    rest = instrumentation.stats()["rest"]
+    assert "unknown" not in rest
+    assert rest["create_orders"]["sign"]["count"] == 3
+    assert rest["create_orders"]["server"]["count"] == 3
+    assert rest["create_orders"]["total"]["count"] == 1
+    assert rest["cancel_orders"]["decode"]["count"] == 2
@@ -0,0 +1,108 @@
+import threading
+import pytest
+from emx.ladder import QuoteManager
+from emx.order_manager import LiveOrder
+from emx.rest_api import BulkResult
+
+
+class FakeOrderManager():
+    def __init__(self, orders=()):
+        self.orders = list(orders)
+
+    def open_orders(self, contract_code=None):
+        return [order for order in self.orders if contract_code in (None, order.contract_code)]
+
+    def get(self, order_id):
+        return next((order for order in self.orders if order.order_id == order_id), None)
+
+    def get_by_client_id(self, client_id):
+        return next((order for order in self.orders if order.client_id == client_id), None)
+
+    def __contains__(self, order_id):
+        return self.get(order_id) is not None
+
+
+class FakeRestApi():
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.batches = []
+
+    def send_orders(self, creates=(), modifies=(), cancels=()):
+        self.batches.append((creates, modifies, cancels))
+        if self.gate is not None and any(order["contract_code"] == "BTCZ18" for order in creates):
+            self.gate.wait(5)
+        return ([BulkResult(True, {}, None)] * len(creates), [BulkResult(True, {}, None)] * len(modifies),
+                [BulkResult(True, {}, None)] * len(cancels))
+
+
+def _order(quoter, order_id, price, size, filled=0.0):
+    order = LiveOrder(order_id)
+    order.update({"client_id": quoter.tag + order_id, "contract_code": "BTCZ18", "side": "buy",
+                  "type": "limit", "price": price, "size": size, "filled_size": filled})
+    return order
+
+
+def test_partially_filled_level_is_topped_up():
+    quoter = QuoteManager(FakeRestApi(), FakeOrderManager())
+    quoter.order_manager.orders = [_order(quoter, "1", "100", "3", filled="1"), _order(quoter, "2", "99", "3")]
+    actions = quoter.diff("BTCZ18", [("buy", "100", "3"), ("buy", "99", "3")])
+    assert not actions.creates and not actions.cancels
+    assert actions.modifies == [{"exchange_orderid": "1", "order_type": "limit", "order_side": "buy",
+                                 "order_size": "4.0", "order_price": "100"}]
+
+
+def test_lock_is_not_held_while_sending():
+    gate = threading.Event()
+    quoter = QuoteManager(FakeRestApi(gate), FakeOrderManager(), min_interval=0)
+    sender = threading.Thread(target=quoter.set_quotes, args=("BTCZ18", [("buy", "100", "1")]))
+    sender.start()
+    while not quoter.rest_api.batches:
+        pass
+    # Another contract does not wait for the batch in flight, the same one is deferred
+    assert quoter.set_quotes("ETHZ18", [("buy", "10", "1")]) is not None
+    assert quoter.set_quotes("BTCZ18", [("buy", "101", "1")]) is None
+    gate.set()
+    sender.join(5)
+    assert len(quoter.rest_api.batches) == 2
+
+
+def test_working_order_without_price_is_moved_last():
+    quoter = QuoteManager(FakeRestApi(), FakeOrderManager())
+    unpriced = _order(quoter, "1", None, "1")
+    quoter.order_manager.orders = [unpriced, _order(quoter, "2", "98", "1")]
+    actions = quoter.diff("BTCZ18", [("buy", "100", "1")])
+    assert [modify["exchange_orderid"] for modify in actions.modifies] == ["2"]
+    assert actions.cancels == ["1"] and not actions.creates
+
+
+class FailingRestApi(FakeRestApi):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def send_orders(self, creates=(), modifies=(), cancels=()):
+        if self.failures:
+            self.failures -= 1
+            self.batches.append(None)
+            raise ConnectionError("down")
+        return super().send_orders(creates, modifies, cancels)
+
+
+def test_failed_send_keeps_the_target():
+    quoter = QuoteManager(FailingRestApi(1), FakeOrderManager(), min_interval=0)
+    with pytest.raises(ConnectionError):
+        quoter.set_quotes("BTCZ18", [("buy", "100", "1")])
+    # The next poll sends the same target again
+    results = quoter.poll()
+    assert list(results) == ["BTCZ18"]
+    assert quoter.rest_api.batches[-1][0][0]["price"] == "100"
+    assert quoter.poll() == {}
+
+
+def test_failed_poll_keeps_unsent_targets():
+    quoter = QuoteManager(FailingRestApi(1), FakeOrderManager(), min_interval=0)
+    quoter._targets = {"BTCZ18": [("buy", "100", "1")], "ETHZ18": [("buy", "10", "1")]}
+    with pytest.raises(ConnectionError):
+        quoter.poll()
+    assert len(quoter.rest_api.batches) == 1
+    assert sorted(quoter.poll()) == ["BTCZ18", "ETHZ18"]
@@ -0,0 +1,41 @@
+import pytest
+from emx.contracts import ContractRegistry
+from emx.models import Order, ScaleResolver
+from emx.utils import EmxApiException
+
+
+class FakeRestApi():
+    uri = "http://models.test"
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    def get_contracts(self):
+        return {"contracts": [{"contract_code": code, "minimum_price_increment": "0.5",
+                               "minimum_size_increment": "1"} for code in self.codes]}
+
+
+def _order(contract_code):
+    return {"order_id": "1", "contract_code": contract_code, "price": "100.5", "size": "3"}
+
+
+def test_contract_loaded_later_keeps_the_same_units():
+    rest_api = FakeRestApi(["BTCZ18"])
+    registry = ContractRegistry(rest_api)
+    registry.refresh()
+    resolve = ScaleResolver(registry)
+
+    # Listed after the registry was loaded: resolved from a reload, not a default scale
+    rest_api.codes.append("ETHZ18")
+    first = Order(_order("ETHZ18"), resolve("ETHZ18"))
+    later = Order(_order("ETHZ18"), resolve("ETHZ18"))
+    known = Order(_order("BTCZ18"), resolve("BTCZ18"))
+    assert (first.price, first.size) == (later.price, later.size) == (known.price, known.size) == (1005, 3)
+
+
+def test_unknown_contract_raises():
+    resolve = ScaleResolver(ContractRegistry(FakeRestApi(["BTCZ18"])))
+    with pytest.raises(EmxApiException):
+        resolve("XXX")
+    assert resolve("BTCZ18").price_decimals == 1
+    assert ScaleResolver()("XXX") is ScaleResolver()(None)
@@ -0,0 +1,68 @@
+import random
+import threading
+import time
+from array import array
+from emx.order_book import Ladder, OrderBookManager
+
+
+def _level2(msg_type, seq, **data):
+    return {"channel": "level2", "type": msg_type, "contract_code": "BTCZ18", "data": dict(data, sequence=seq)}
+
+
+def test_ladder_matches_a_sorted_reference():
+    rng = random.Random(7)
+    bids = Ladder(is_bid=True)
+    reference = {}
+    for _ in range(20000):
+        price = float(rng.randrange(1000))
+        size = float(rng.choice([0, 0, 1, 2, 3]))
+        bids.update(price, size)
+        if size:
+            reference[price] = size
+        else:
+            reference.pop(price, None)
+    expected = sorted(reference.items(), reverse=True)
+    prices, sizes = array('d', bytes(8 * 1000)), array('d', bytes(8 * 1000))
+    count = bids.copy_levels(1000, prices, sizes)
+    assert len(bids) == count == len(expected)
+    assert list(zip(prices[:count], sizes[:count])) == expected
+    assert bids.best_price() == expected[0][0]
+    assert bids.size_at(expected[-1][0]) == expected[-1][1] and bids.size_at(1000.5) == 0.0
+
+
+def test_updates_before_snapshot_are_buffered():
+    books = OrderBookManager()
+    book = books.on_message(_level2("update", 11, changes=[["buy", "99", "5"]]))
+    assert not book.synced
+    books.on_message(_level2("update", 12, changes=[["sell", "101", "2"]]))
+    books.on_message(_level2("snapshot", 11, bids=[["99", "1"]], asks=[["102", "1"]]))
+    assert book.synced and book.sequence == 12
+    assert (book.best_bid(), book.best_bid_size(), book.best_ask()) == (99.0, 1.0, 101.0)
+
+
+def test_gap_resnapshots_without_blocking_receive():
+    release = threading.Event()
+
+    class SlowRestApi():
+        calls = 0
+
+        def get_contract_book(self, contract_code):
+            self.calls += 1
+            release.wait(5)
+            return {"bids": [["98", "1"]], "asks": [["101", "1"]], "sequence": 3}
+
+    rest_api = SlowRestApi()
+    books = OrderBookManager(rest_api)
+    books.on_message(_level2("snapshot", 1, bids=[["99", "1"]], asks=[["100", "1"]]))
+    started = time.monotonic()
+    book = books.on_message(_level2("update", 3, changes=[["buy", "99", "0"]]))
+    books.on_message(_level2("update", 4, changes=[["sell", "100.5", "1"]]))
+    assert time.monotonic() - started < 1 and not book.synced and rest_api.calls == 1
+    release.set()
+    for _ in range(200):
+        if books._fetched:
+            break
+        time.sleep(0.005)
+    books.on_message({"channel": "ticker", "data": {}})
+    assert book.synced and book.sequence == 4
+    assert (book.best_bid(), book.best_ask()) == (98.0, 100.5)
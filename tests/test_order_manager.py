@@ -0,0 +1,119 @@
+import threading
+import pytest
+from emx.order_manager import OrderManager
+from emx.utils import EmxApiException
+
+
+def _order(order_id, status="accepted"):
+    return {"order_id": order_id, "client_id": "c" + order_id, "contract_code": "BTCZ18", "side": "buy",
+            "type": "limit", "price": "100", "size": "1", "filled_size": "0", "status": status}
+
+
+class FakeRestApi():
+    def __init__(self, pages):
+        self.pages = pages
+
+    def iter_orders(self, status=None):
+        for page in self.pages:
+            if isinstance(page, Exception):
+                raise page
+            for item in page:
+                yield item
+
+
+def test_reconcile_replaces_index():
+    manager = OrderManager(FakeRestApi([[_order("1"), _order("2")], [_order("3")]]))
+    manager.reconcile()
+    assert sorted(order.order_id for order in manager.open_orders()) == ["1", "2", "3"]
+    assert manager.get_by_client_id("c2").order_id == "2"
+
+
+def test_failed_reconcile_keeps_index():
+    rest_api = FakeRestApi([[_order("1"), _order("2")]])
+    manager = OrderManager(rest_api)
+    manager.reconcile()
+
+    # Second page of the next snapshot fails
+    rest_api.pages = [[_order("1")], EmxApiException("page 2 failed")]
+    with pytest.raises(EmxApiException):
+        manager.reconcile()
+    assert sorted(order.order_id for order in manager.open_orders()) == ["1", "2"]
+    assert manager.get_by_client_id("c2").order_id == "2"
+
+
+def test_events_during_failed_reconcile_are_applied():
+    manager = OrderManager(FakeRestApi([[_order("1")]]))
+    manager.reconcile()
+
+    def pages(status=None):
+        manager.on_message({"channel": "orders", "type": "canceled", "contract_code": "BTCZ18",
+                            "data": {"order_id": "1", "status": "canceled"}})
+        raise EmxApiException("page 1 failed")
+        yield
+
+    manager.rest_api.iter_orders = pages
+    with pytest.raises(EmxApiException):
+        manager.reconcile()
+    assert "1" not in manager
+
+
+def _fill(order_id, fill_size, timestamp=None):
+    data = {"order_id": order_id, "fill_size": fill_size, "status": "accepted"}
+    if timestamp:
+        data["timestamp"] = timestamp
+    return {"channel": "orders", "type": "filled", "contract_code": "BTCZ18", "data": data}
+
+
+def _snapshot_order(order_id, filled_size, timestamp=None):
+    item = dict(_order(order_id), size="3", filled_size=filled_size)
+    if timestamp:
+        item["timestamp"] = timestamp
+    return item
+
+
+def test_fill_during_reconcile_is_counted_once():
+    manager = OrderManager(None)
+
+    def pages(status=None):
+        # Both fills arrive while the snapshot loads; it already includes the first one
+        manager.on_message(_fill("1", "1"))
+        manager.on_message(_fill("2", "1", "2018-11-05T17:41:39.000Z"))
+        manager.on_message(_fill("2", "1", "2018-11-05T17:41:41.000Z"))
+        yield _snapshot_order("1", "1")
+        yield _snapshot_order("2", "1", "2018-11-05T17:41:40.000Z")
+
+    manager.rest_api = FakeRestApi([])
+    manager.rest_api.iter_orders = pages
+    manager.reconcile()
+    assert manager.get("1").filled_size == 1.0
+    assert manager.get("2").filled_size == 2.0 and "2" in manager
+
+
+def test_resynced_reconciles_in_background():
+    release = threading.Event()
+    errors = []
+    calls = []
+
+    def pages(status=None):
+        # Whether the event queued during the first reconcile was applied
+        calls.append("2" in manager)
+        release.wait(5)
+        if len(calls) == 1:
+            raise EmxApiException("page 1 failed")
+        yield _order("1")
+
+    manager = OrderManager(FakeRestApi([]), on_error=errors.append)
+    manager.rest_api.iter_orders = pages
+    resynced = {"type": "resynced", "channels": [{"name": "orders", "contract_codes": ["BTCZ18"]}]}
+    assert manager.on_message(resynced) is None
+    manager.on_message({"channel": "orders", "type": "accepted", "contract_code": "BTCZ18",
+                        "data": _order("2")})
+    # A second resync during the reconcile keeps the queued events and runs another reconcile
+    manager.on_message(resynced)
+    release.set()
+    for _ in range(200):
+        if len(calls) == 2 and not manager._reconciling:
+            break
+        threading.Event().wait(0.01)
+    assert isinstance(errors[0], EmxApiException) and calls == [False, True]
+    assert [order.order_id for order in manager.open_orders()] == ["1"]
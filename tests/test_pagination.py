@@ -0,0 +1,46 @@
+import pytest
+from emx.pagination import PageIterator
+from emx.utils import EmxApiException
+
+
+class FakePages():
+    """Serves {after cursor: page of ids} and records the requested cursors."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def __call__(self, after):
+        self.requested.append(after)
+        return {"fills": [{"fill_id": fill_id} for fill_id in self.pages.get(after, [])]}
+
+
+def test_iterates_over_every_page():
+    fetch = FakePages({"": ["1", "2"], "2": ["3", "4"], "4": ["5"]})
+    pages = PageIterator(fetch, "fills", "fill_id")
+    assert [fill["fill_id"] for fill in pages] == ["1", "2", "3", "4", "5"]
+    assert fetch.requested == ["", "2", "4", "5"]
+    assert pages.cursor == "5"
+
+
+def test_resumes_from_cursor_and_stops_on_empty_page():
+    fetch = FakePages({"2": ["3", "4"]})
+    pages = PageIterator(fetch, "fills", "fill_id", after="2")
+    assert next(pages)["fill_id"] == "3"
+    assert pages.cursor == "3"
+    assert [fill["fill_id"] for fill in pages] == ["4"]
+    assert fetch.requested == ["2", "4"]
+
+
+@pytest.mark.parametrize("pages", [
+    {"": ["1", "2"], "2": ["2"]},
+    # The cursor goes back to a page already read
+    {"": ["1", "2"], "2": ["3", "4"], "4": ["2"]},
+])
+def test_repeated_cursor_raises(pages):
+    fetch = FakePages(pages)
+    received = []
+    with pytest.raises(EmxApiException):
+        for fill in PageIterator(fetch, "fills", "fill_id"):
+            received.append(fill["fill_id"])
+    assert received == [fill_id for page in list(pages.values())[:-1] for fill_id in page]
@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from emx.portfolio import Portfolio
+
+
+class FakeRestApi():
+    def __init__(self, positions, during_fetch=None):
+        self.positions = positions
+        self.during_fetch = during_fetch
+
+    def get_positions(self):
+        if self.during_fetch is not None:
+            self.during_fetch()
+        return self.positions
+
+
+def _position(quantity, entry="100", mark="110"):
+    return {"contract_code": "BTCZ18", "quantity": quantity, "average_entry_price": entry,
+            "marking_price": mark}
+
+
+def test_open_add_reduce_and_flip():
+    portfolio = Portfolio()
+    portfolio.on_fill("BTCZ18", "buy", 2, 100)
+    portfolio.on_fill("BTCZ18", "buy", 2, 110)
+    assert portfolio.quantity("BTCZ18") == 4
+    assert portfolio.cost("BTCZ18") == 420
+    assert portfolio.position("BTCZ18")["average_entry_price"] == 105
+
+    # Reduce at the average entry price
+    portfolio.on_fill("BTCZ18", "sell", 1, 115, fee=0.5)
+    assert portfolio.realized_pnl("BTCZ18") == 9.5
+    assert portfolio.cost("BTCZ18") == 315
+
+    # Flip: close 3 at 105, then open 2 short at 100
+    portfolio.on_fill("BTCZ18", "sell", 5, 100)
+    assert portfolio.quantity("BTCZ18") == -2
+    assert portfolio.realized_pnl("BTCZ18") == 9.5 - 15
+    assert portfolio.cost("BTCZ18") == -200
+
+    portfolio.update_mark("BTCZ18", 90)
+    assert portfolio.open_pnl("BTCZ18") == 20
+    assert portfolio.margin_usage() == pytest.approx(18)
+
+    portfolio.on_fill("BTCZ18", "buy", 2, 95)
+    assert portfolio.quantity("BTCZ18") == 0 and portfolio.cost("BTCZ18") == 0
+    assert portfolio.realized_pnl() == pytest.approx(9.5 - 15 + 10)
+    assert portfolio.positions() == {}
+
+
+def test_fill_during_reconcile_fetch_is_not_counted_twice():
+    portfolio = Portfolio(FakeRestApi([_position("3")]))
+    portfolio.on_fill("BTCZ18", "buy", 2, 100)
+    # The snapshot already holds the next fill, whose event arrives while it loads
+    portfolio.rest_api.during_fetch = lambda: portfolio.on_fill("BTCZ18", "buy", 1, 100)
+    assert portfolio.reconcile(adopt=True) == []
+    assert portfolio.quantity("BTCZ18") == 3
+
+
+def test_only_confirmed_drift_is_adopted():
+    portfolio = Portfolio(FakeRestApi([_position("3")]))
+    portfolio.on_fill("BTCZ18", "buy", 2, 100)
+    drift = portfolio.reconcile(adopt=True)
+    assert drift == [{"contract_code": "BTCZ18", "local": 2.0, "exchange": 3.0, "drift": -1.0,
+                      "adopted": False}]
+    assert portfolio.quantity("BTCZ18") == 2
+
+    # Same drift on the next reconcile: the exchange values replace the local ones
+    assert portfolio.reconcile(adopt=True)[0]["adopted"]
+    assert portfolio.quantity("BTCZ18") == 3 and portfolio.cost("BTCZ18") == 300
+    assert portfolio.position("BTCZ18")["mark_price"] == 110
+    assert portfolio.reconcile(adopt=True) == []
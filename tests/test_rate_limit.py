@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+from emx.rate_limit import (ORDER_ENTRY, PRIORITY_HIGH, PRIORITY_LOW, PUBLIC, RequestScheduler,
+                            TokenBucket, rate_limited)
+from emx.utils import EmxApiException
+
+
+def _queued(scheduler, count):
+    for _ in range(500):
+        with scheduler._cond:
+            if sum(len(queue) for queue in scheduler._waiting.values()) == count:
+                return
+        time.sleep(0.01)
+    raise AssertionError("requests were not queued")
+
+
+def test_high_priority_overtakes_queued_low_priority():
+    scheduler = RequestScheduler({ORDER_ENTRY: (5, 1)})
+    scheduler.acquire(ORDER_ENTRY)
+    served = []
+
+    def request(name, priority):
+        scheduler.acquire(ORDER_ENTRY, priority)
+        served.append(name)
+
+    low = [threading.Thread(target=request, args=("low{}".format(i), PRIORITY_LOW)) for i in range(2)]
+    for thread in low:
+        thread.start()
+        _queued(scheduler, low.index(thread) + 1)
+    high = threading.Thread(target=request, args=("high", PRIORITY_HIGH))
+    high.start()
+    for thread in low + [high]:
+        thread.join(5)
+    # Low priority requests keep their arrival order behind the cancel
+    assert served == ["high", "low0", "low1"]
+
+
+def test_bucket_enforces_its_rate():
+    scheduler = RequestScheduler({PUBLIC: (50, 2)})
+    start = time.monotonic()
+    waits = [scheduler.acquire(PUBLIC) for _ in range(7)]
+    elapsed = time.monotonic() - start
+    # The burst of 2 is free, the 5 others wait 1/50s each
+    assert waits[0] < 0.01 and waits[1] < 0.01
+    assert 5 / 50.0 * 0.9 <= elapsed < 1
+    # Classes without a limit are not delayed
+    assert scheduler.acquire("unlisted") < 0.01
+
+
+def test_global_limit_applies_across_classes():
+    scheduler = RequestScheduler({PUBLIC: (1000, 10)}, global_limit=(50, 1))
+    start = time.monotonic()
+    scheduler.acquire(PUBLIC)
+    scheduler.acquire(ORDER_ENTRY)
+    scheduler.acquire(PUBLIC)
+    assert time.monotonic() - start >= 2 / 50.0 * 0.9
+
+
+def test_stats_per_lane():
+    scheduler = RequestScheduler({PUBLIC: (50, 1)})
+    scheduler.acquire(PUBLIC, PRIORITY_LOW)
+    scheduler.acquire(PUBLIC, PRIORITY_LOW)
+    scheduler.acquire(ORDER_ENTRY, PRIORITY_HIGH)
+    stats = scheduler.stats()
+    assert set(stats) == {(PUBLIC, PRIORITY_LOW), (ORDER_ENTRY, PRIORITY_HIGH)}
+    low = stats[(PUBLIC, PRIORITY_LOW)]
+    assert low["requests"] == 2
+    assert low["max_wait"] >= 0.9 / 50
+    assert low["avg_wait"] == pytest.approx(low["max_wait"] / 2, rel=0.5)
+    assert stats[(ORDER_ENTRY, PRIORITY_HIGH)]["requests"] == 1
+
+
+def test_rate_limited_uses_the_scheduler_when_set():
+    class Client():
+        def __init__(self, scheduler):
+            self.scheduler = scheduler
+
+        @rate_limited(ORDER_ENTRY, PRIORITY_HIGH)
+        def cancel(self):
+            return "canceled"
+
+    scheduler = RequestScheduler()
+    assert Client(scheduler).cancel() == "canceled"
+    assert Client(None).cancel() == "canceled"
+    assert scheduler.stats()[(ORDER_ENTRY, PRIORITY_HIGH)]["requests"] == 1
+
+
+def test_bucket_rate_must_be_positive():
+    with pytest.raises(EmxApiException):
+        TokenBucket(0)
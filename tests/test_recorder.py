@@ -0,0 +1,54 @@
+import os
+import threading
+import pytest
+from emx.recorder import LogReader, Recorder
+from emx.utils import EmxApiException
+
+
+def test_frames_are_written_per_contract(tmp_path):
+    with Recorder(str(tmp_path)) as recorder:
+        recorder.record('{"channel": "trade", "contract_code": "BTCZ18", "data": {}}', received_ns=10 ** 18)
+    day = os.listdir(str(tmp_path))[0]
+    reader = LogReader(os.path.join(str(tmp_path), day, "BTCZ18.emxlog"))
+    assert [bytes(payload) for _, _, payload in reader.records()][0].startswith(b'{"channel": "trade"')
+    reader.close()
+
+
+def test_full_queue_drops_frames(tmp_path):
+    recorder = Recorder(str(tmp_path), max_queued=2)
+    blocked = threading.Event()
+    release = threading.Event()
+    write = recorder._write
+
+    def slow_write(batch):
+        blocked.set()
+        release.wait(5)
+        write(batch)
+
+    recorder._write = slow_write
+    recorder.record('{"contract_code": "BTCZ18"}')
+    blocked.wait(5)
+    for _ in range(5):
+        recorder.record('{"contract_code": "BTCZ18"}')
+    assert recorder.dropped == 3
+    release.set()
+    recorder.close()
+    assert recorder.frames == 3
+
+
+def test_writer_error_is_raised_by_record(tmp_path):
+    target = tmp_path / "file"
+    target.write_text("not a directory")
+    recorder = Recorder(str(target))
+    recorder.record('{"contract_code": "BTCZ18"}')
+    recorder.close()
+    assert recorder.error is not None
+    with pytest.raises(EmxApiException):
+        recorder.record('{"contract_code": "BTCZ18"}')
+
+    errors = []
+    recorder = Recorder(str(target), on_error=errors.append)
+    recorder.record('{"contract_code": "BTCZ18"}')
+    recorder.close()
+    assert errors == [recorder.error]
+    recorder.record('{"contract_code": "BTCZ18"}')
@@ -0,0 +1,104 @@
+import json
+import pytest
+import emx.replay
+from emx.recorder import Recorder
+from emx.replay import ReplayWebSocketApi
+from emx.utils import EmxApiException, EmxApiTimeoutException
+
+START_NS = 1541439700 * 10 ** 9
+
+
+def _frame(channel, contract_code, n):
+    return json.dumps({"channel": channel, "contract_code": contract_code, "data": {"n": n}})
+
+
+@pytest.fixture
+def logs(tmp_path):
+    """Frames of two contracts, interleaved in time, and one control frame."""
+    frames = [
+        (0, _frame("trade", "BTCZ18", 0)),
+        (1, _frame("level2", "ETHZ18", 1)),
+        (2, _frame("trade", "ETHZ18", 2)),
+        (3, json.dumps({"type": "subscriptions", "channels": []})),
+        (4, _frame("trade", "BTCZ18", 3)),
+        (6, _frame("ticker", "BTCZ18", 4)),
+        (7, _frame("trade", "ETHZ18", 5)),
+    ]
+    with Recorder(str(tmp_path)) as recorder:
+        for offset, frame in frames:
+            recorder.record(frame, received_ns=START_NS + offset * 10 ** 8)
+    return str(tmp_path)
+
+
+def _play(replay):
+    received = []
+    while True:
+        try:
+            received.append(replay.receive_msg())
+        except EmxApiException:
+            return received
+
+
+def test_round_trip_merges_logs_in_receive_order(logs):
+    replay = ReplayWebSocketApi(logs)
+    replay.subscribe(["BTCZ18", "ETHZ18"], ["trade", "level2"])
+    assert json.loads(replay.receive_msg())["type"] == "subscriptions"
+    received = _play(replay)
+    # Frames come back verbatim
+    assert received == [_frame(channel, code, n) for channel, code, n in [
+        ("trade", "BTCZ18", 0), ("level2", "ETHZ18", 1), ("trade", "ETHZ18", 2),
+        ("trade", "BTCZ18", 3), ("trade", "ETHZ18", 5)]]
+    assert replay.finished
+    replay.close()
+
+
+def test_only_subscribed_contracts_are_played(logs):
+    replay = ReplayWebSocketApi(logs, decoder=json.loads)
+    # Nothing is played before a subscription
+    with pytest.raises(EmxApiException):
+        replay.receive_msg()
+    replay.close()
+
+    replay = ReplayWebSocketApi(logs, start_ns=START_NS + 10 ** 8, decoder=json.loads)
+    replay.subscribe(["ETHZ18"], ["trade", "ticker"])
+    replay.receive_msg()
+    assert [msg["data"]["n"] for msg in _play(replay)] == [2, 5]
+    replay.close()
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+def test_speed_paces_frames(logs, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(emx.replay, "time", clock)
+    replay = ReplayWebSocketApi(logs, speed=2.0, decoder=json.loads)
+    replay.subscribe(["BTCZ18"], ["trade", "ticker"])
+    replay.receive_msg()
+    assert [msg["data"]["n"] for msg in _play(replay)] == [0, 3, 4]
+    # 0.4s then 0.2s of recorded time, played twice as fast
+    assert clock.sleeps == [0.2, 0.1]
+
+
+def test_frame_not_due_within_timeout_is_kept(logs, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(emx.replay, "time", clock)
+    replay = ReplayWebSocketApi(logs, speed=1.0, timeout=0.25, decoder=json.loads)
+    replay.subscribe(["BTCZ18"], ["trade"])
+    replay.receive_msg()
+    assert replay.receive_msg()["data"]["n"] == 0
+    # The next frame is 0.4s later
+    with pytest.raises(EmxApiTimeoutException):
+        replay.receive_msg()
+    assert replay.receive_msg()["data"]["n"] == 3
+    assert clock.sleeps == [0.25, 0.15]
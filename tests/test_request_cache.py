@@ -0,0 +1,147 @@
+import json
+import threading
+import pytest
+import emx.request_cache
+from emx.request_cache import RequestCache
+from emx.rest_api import RestApi
+from emx.utils import EmxApiException
+
+
+class FakeResponse():
+    status_code = 200
+
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode()
+        self.text = self.content.decode()
+
+
+class FakeSession():
+    """Answers every GET with the requested url; ``gate`` holds the answers back."""
+
+    def __init__(self):
+        self.urls = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def get(self, url, params=None, headers=None):
+        self.urls.append(url)
+        self.gate.wait(5)
+        return FakeResponse({"url": url})
+
+
+def test_concurrent_callers_share_one_fetch():
+    session = FakeSession()
+    session.gate.clear()
+    cache = RequestCache()
+    api = RestApi(session=session, cache=cache)
+    results = []
+
+    def call():
+        results.append(api.get_contract_quote("BTCZ18"))
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # Release the leader only once every other caller waits on it
+    for _ in range(500):
+        if cache.coalesced == 4:
+            break
+        threading.Event().wait(0.01)
+    session.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(session.urls) == 1
+    assert results == [{"url": "http://api.testnet.emx.com/v1/contracts/BTCZ18/quote"}] * 5
+    assert cache.stats() == {"hits": 0, "coalesced": 4, "misses": 1, "entries": 0}
+    # Without a TTL nothing is kept for later callers
+    api.get_contract_quote("BTCZ18")
+    assert len(session.urls) == 2
+
+
+def test_waiting_callers_get_the_leader_error():
+    cache = RequestCache()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        raise EmxApiException("down")
+
+    def call():
+        try:
+            cache.get("route", "key", fetch)
+        except EmxApiException as err:
+            errors.append(err)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    for _ in range(500):
+        if cache.coalesced == 1:
+            break
+        threading.Event().wait(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(emx.request_cache.time, "monotonic", lambda: now[0])
+    cache = RequestCache(ttl_ms={"quote": 50})
+    fetches = []
+
+    def fetch():
+        fetches.append(now[0])
+        return len(fetches)
+
+    assert cache.get("quote", "key", fetch) == 1
+    now[0] += 0.049
+    assert cache.get("quote", "key", fetch) == 1
+    now[0] += 0.002
+    assert cache.get("quote", "key", fetch) == 2
+    # Routes without a TTL only coalesce
+    assert cache.get("book", "other", fetch) == 3
+    assert cache.get("book", "other", fetch) == 4
+    assert cache.stats() == {"hits": 1, "coalesced": 0, "misses": 4, "entries": 1}
+
+
+def test_lru_size_cap():
+    cache = RequestCache(ttl_ms=60000, max_entries=2)
+    cache.get("route", "a", lambda: "a1")
+    cache.get("route", "b", lambda: "b1")
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("route", "a", lambda: "a2") == "a1"
+    cache.get("route", "c", lambda: "c1")
+    assert cache.stats()["entries"] == 2
+    assert cache.get("route", "b", lambda: "b2") == "b2"
+    assert cache.get("route", "c", lambda: "c2") == "c1"
+    assert cache.get("route", "a", lambda: "a3") == "a3"
+
+
+@pytest.mark.parametrize("other", [
+    lambda api, other_uri: api.get_contract_book("BTCZ18"),
+    lambda api, other_uri: api.get_contract_quote("ETHZ18"),
+    lambda api, other_uri: other_uri.get_contract_quote("BTCZ18"),
+    # Keyword arguments are part of the key as given
+    lambda api, other_uri: api.get_contract_quote(contract_code="BTCZ18"),
+])
+def test_coalesced_key(other):
+    cache = RequestCache(ttl_ms=60000)
+    session = FakeSession()
+    api = RestApi(session=session, cache=cache)
+    other_uri = RestApi(uri="http://other.test", session=session, cache=cache)
+
+    api.get_contract_quote("BTCZ18")
+    # Same route, arguments and uri, from another client sharing the cache
+    RestApi(session=session, cache=cache).get_contract_quote("BTCZ18")
+    assert len(session.urls) == 1
+    # A different route, argument or uri is another request
+    other(api, other_uri)
+    assert len(session.urls) == 2
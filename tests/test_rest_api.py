@@ -0,0 +1,43 @@
+import json
+from emx.rest_api import RestApi
+
+
+class FakeResponse():
+    status_code = 200
+    content = b'{"order": {"order_id": "1"}}'
+    text = content.decode()
+
+
+class FakeSession():
+    def __init__(self, events):
+        self.events = events
+
+    def request(self, http_method, url, data=None, headers=None):
+        self.events.append(("send", json.loads(data)["client_id"]))
+        return FakeResponse()
+
+
+class FakeScheduler():
+    def __init__(self, events):
+        self.events = events
+
+    def acquire(self, endpoint_class, priority):
+        self.events.append(("acquire", None))
+
+
+def test_bulk_requests_are_signed_after_the_rate_limit():
+    events = []
+    api = RestApi(session=FakeSession(events), scheduler=FakeScheduler(events), pool_size=1)
+    headers = api._signer.headers
+
+    def sign(http_method, endpoint, body):
+        events.append(("sign", body["client_id"]))
+        return headers(http_method, endpoint, body)
+
+    api._signer.headers = sign
+    orders = [{"contract_code": "BTCZ18", "order_type": "limit", "order_side": "buy", "size": "1",
+               "price": "100", "client_id": client_id} for client_id in ("a", "b")]
+    assert all(result.ok for result in api.create_orders(orders))
+    assert events == [("acquire", None), ("sign", "a"), ("send", "a"),
+                      ("acquire", None), ("sign", "b"), ("send", "b")]
+    api.close()
@@ -0,0 +1,97 @@
+import json
+import time
+import pytest
+from emx.rest_api import RestApi
+from emx.risk import RiskChecker
+from emx.utils import EmxApiException, EmxRiskCheckException
+
+
+class FakeResponse():
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode()
+        self.text = self.content.decode()
+
+
+class FakeSession():
+    """Accepts orders with increasing order ids; orders whose client_id starts
+    with "bad" fail with a HTTP error."""
+
+    def __init__(self):
+        self.count = 0
+
+    def post(self, url, data, headers):
+        return self.request("POST", url, data, headers)
+
+    def request(self, http_method, url, data=None, headers=None):
+        body = json.loads(data)
+        if body.get("client_id", "").startswith("bad"):
+            return FakeResponse(400, {"message": "rejected"})
+        self.count += 1
+        return FakeResponse(200, {"order": dict(body, order_id=str(self.count))})
+
+
+def _order(size=1, client_id=""):
+    return {"contract_code": "BTCZ18", "order_type": "limit", "order_side": "buy", "size": str(size),
+            "client_id": client_id, "price": "100"}
+
+
+def test_working_orders_count_in_position_limits():
+    risk = RiskChecker(max_position=3, max_position_notional=250)
+    risk.check(**_order(size=1))
+    risk.check(**_order(size=1))
+    # Third contract would be 300 of notional with the two working orders
+    with pytest.raises(EmxRiskCheckException):
+        risk.check(**_order(size=1))
+    # Sells reduce the worst case long position, they are not limited
+    risk.check("BTCZ18", "limit", "sell", "2", price="100")
+
+
+def test_failed_orders_release_their_reservation():
+    risk = RiskChecker(max_position=2)
+    api = RestApi(session=FakeSession(), risk=risk)
+    for _ in range(3):
+        with pytest.raises(EmxApiException):
+            api.create_new_order(**_order(client_id="bad"))
+    results = api.create_orders([_order(client_id="bad"), _order()])
+    assert [result.ok for result in results] == [False, True]
+    api.create_new_order(**_order())
+    with pytest.raises(EmxRiskCheckException):
+        api.create_new_order(**_order())
+    api.close()
+
+
+def test_order_events_release_reservations():
+    risk = RiskChecker(max_position=2)
+    api = RestApi(session=FakeSession(), risk=risk)
+    first = api.create_new_order(**_order())["order"]["order_id"]
+    second = api.create_new_order(**_order())["order"]["order_id"]
+
+    risk.on_message({"channel": "orders", "type": "canceled", "data": {"order_id": first}})
+    api.create_new_order(**_order())
+    with pytest.raises(EmxRiskCheckException):
+        api.create_new_order(**_order())
+
+    # A partial fill moves size from the working order into the position
+    risk.on_message({"channel": "orders", "type": "filled",
+                     "data": {"order_id": second, "fill_size": "1", "status": "partially_filled"}})
+    api.create_new_order(**_order())
+    api.close()
+
+
+def test_failed_refresh_is_reported():
+    class FailingApi():
+        def get_balances(self, trader_id):
+            raise EmxApiException("down")
+
+    errors = []
+    risk = RiskChecker(rest_api=FailingApi())
+    risk.start_refresh(0.01, on_error=errors.append)
+    try:
+        for _ in range(200):
+            if errors:
+                break
+            time.sleep(0.01)
+    finally:
+        risk.stop_refresh()
+    assert isinstance(errors[0], EmxApiException)
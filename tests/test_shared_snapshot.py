@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+from multiprocessing import resource_tracker
+import pytest
+from emx.shared_snapshot import HEADER, SEQUENCE, SnapshotPublisher, SnapshotReader, _slot_offset
+from emx.utils import EmxApiException
+
+NAME = "emx-test-{}".format(os.getpid())
+
+
+def _count(publisher):
+    return HEADER.unpack_from(publisher._buf, 0)[2]
+
+
+def test_replace_stale_segment():
+    stale = SnapshotPublisher(NAME)
+    stale.update("BTCZ18", bid=100)
+    # Left behind by a killed process: nothing will remove it
+    resource_tracker.unregister(stale._shm._name, "shared_memory")
+    try:
+        with pytest.raises(FileExistsError):
+            SnapshotPublisher(NAME)
+        with SnapshotPublisher(NAME, replace=True) as publisher:
+            assert _count(publisher) == 0
+            publisher.update("ETHZ18", ask=10)
+            assert _count(publisher) == 1 and _count(stale) == 1
+    finally:
+        stale._buf = None
+        stale._shm.close()
+
+
+def test_messages_without_contract_code_are_skipped():
+    with SnapshotPublisher(NAME) as publisher:
+        publisher.on_message({"channel": "ticker", "data": {"mark_price": "1"}})
+        publisher.on_message({"channel": "trade", "contract_code": "BTCZ18",
+                              "data": [{"price": "100", "size": "2"}]})
+        assert list(publisher._slots) == ["BTCZ18"]
+        assert publisher._values[0][5] == 2
+
+
+@pytest.fixture
+def publisher():
+    with SnapshotPublisher(NAME) as publisher:
+        reader = SnapshotReader(NAME, retries=100000)
+        if sys.version_info < (3, 13):
+            # Attaching unregistered the segment from this process's resource
+            # tracker, the publisher unlinking it expects it registered
+            resource_tracker.register(publisher._shm._name, "shared_memory")
+        yield publisher, reader
+        reader.close()
+
+
+def test_reader_never_sees_a_torn_write(publisher):
+    publisher, reader = publisher
+    publisher.update("BTCZ18", bid=0, bid_size=0, ask=0, ask_size=0, last_price=0, last_size=0, mark_price=0)
+    stop = threading.Event()
+
+    def write():
+        value = 0
+        while not stop.is_set():
+            value += 1
+            publisher.update("BTCZ18", bid=value, bid_size=value, ask=value, ask_size=value,
+                             last_price=value, last_size=value, mark_price=value)
+
+    interval = sys.getswitchinterval()
+    # Switch threads as often as possible, also in the middle of a write
+    sys.setswitchinterval(1e-6)
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        last = 0
+        for _ in range(20000):
+            snapshot = reader.get("BTCZ18")
+            assert snapshot.sequence % 2 == 0 and snapshot.sequence >= last
+            assert len(set(snapshot[2:8])) == 1
+            last = snapshot.sequence
+    finally:
+        stop.set()
+        writer.join(5)
+        sys.setswitchinterval(interval)
+    assert last > 2
+
+
+def test_read_during_a_write_retries_then_raises(publisher):
+    publisher, reader = publisher
+    publisher.update("BTCZ18", bid=100)
+    offset = _slot_offset(0)
+    sequence = SEQUENCE.unpack_from(publisher._buf, offset)[0]
+    # A write left half done
+    SEQUENCE.pack_into(publisher._buf, offset, sequence + 1)
+    reader.retries = 10
+    with pytest.raises(EmxApiException):
+        reader.get("BTCZ18")
+    SEQUENCE.pack_into(publisher._buf, offset, sequence + 2)
+    assert reader.get("BTCZ18").bid == 100
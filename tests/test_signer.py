@@ -0,0 +1,30 @@
+import pytest
+import emx.utils
+from emx.utils import EmxApiException, Signer, generate_signature
+
+API_SECRET = "c2VjcmV0"
+
+
+@pytest.mark.parametrize("http_method, path, body", [
+    ("GET", "/v1/balances", None),
+    ("DELETE", "/v1/orders/O1", {}),
+    ("POST", "/v1/orders", {"contract_code": "BTCZ18", "order_type": "limit", "order_side": "buy",
+                            "size": "1", "price": "6500.5", "client_id": "c1"}),
+])
+def test_headers_sign_like_generate_signature(monkeypatch, http_method, path, body):
+    monkeypatch.setattr(emx.utils, "get_timestamp", lambda: 1541439700)
+    signer = Signer("key", API_SECRET)
+    # The keyed state is reused, so sign twice
+    for _ in range(2):
+        headers, data = signer.headers(http_method, path, body)
+        expected = generate_signature(API_SECRET, 1541439700, http_method, path, body).decode()
+        assert headers["EMX-ACCESS-SIG"] == expected
+        assert headers["EMX-ACCESS-TIMESTAMP"] == "1541439700"
+        assert headers["EMX-ACCESS-KEY"] == "key"
+        # The signed body is the one sent
+        assert data == (emx.utils.body_to_string(body) if body else None)
+
+
+def test_invalid_secret_raises():
+    with pytest.raises(EmxApiException):
+        Signer("key", "not base64!").headers("GET", "/v1/balances")
@@ -0,0 +1,125 @@
+import json
+import pytest
+from websocket import ABNF, WebSocketConnectionClosedException, WebSocketTimeoutException
+from emx.utils import EmxApiException, EmxApiTimeoutException
+from emx.ws_api import WebSocketApi
+
+API_SECRET = "c2VjcmV0"
+
+
+class FakeSocket():
+    """Returns the queued (opcode, data) frames, raises queued exceptions, and
+    times out when nothing is queued."""
+
+    def __init__(self):
+        self.sent = []
+        self.frames = []
+        self.pings = 0
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def ping(self):
+        self.pings += 1
+
+    def recv_data(self, control_frame=False):
+        if not self.frames:
+            raise WebSocketTimeoutException()
+        frame = self.frames.pop(0)
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    def push(self, msg):
+        self.frames.append((ABNF.OPCODE_TEXT, json.dumps(msg).encode()))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWebSocketApi(WebSocketApi):
+    """Opens a new FakeSocket on every connection; ``failures`` connections fail first."""
+
+    def __init__(self, *args, failures=0, **kwargs):
+        self.sockets = []
+        self.failures = failures
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        if self.sockets and self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError("refused")
+        self.sockets.append(FakeSocket())
+        return self.sockets[-1]
+
+
+def _subscribed(ws):
+    ws.subscribe(["BTCZ18", "ETHZ18"], ["level2"])
+    ws.subscribe(["BTCZ18"], ["orders"])
+    ws.ws.sent.clear()
+
+
+def test_dropped_connection_reconnects_and_resyncs_once():
+    ws = FakeWebSocketApi("key", API_SECRET, auto_reconnect=True, max_backoff=0.01)
+    _subscribed(ws)
+    old = ws.ws
+    old.frames.append(WebSocketConnectionClosedException("reset"))
+    old.push({"stale": True})
+
+    assert json.loads(ws.receive_msg()) == {
+        "type": "resynced",
+        "channels": [{"name": "level2", "contract_codes": ["BTCZ18", "ETHZ18"]},
+                     {"name": "orders", "contract_codes": ["BTCZ18"]}]}
+    assert old.closed and len(ws.sockets) == 2 and ws.ws is ws.sockets[1]
+    # Every subscription is replayed, signed again
+    assert [(msg["type"], msg["channels"], msg["contract_codes"]) for msg in ws.ws.sent] == [
+        ("subscribe", ["level2"], ["BTCZ18", "ETHZ18"]), ("subscribe", ["orders"], ["BTCZ18"])]
+    assert all(msg["sig"] and msg["key"] == "key" for msg in ws.ws.sent)
+
+    # Later messages come from the new connection, without another resync
+    ws.ws.push({"channel": "level2", "n": 1})
+    assert json.loads(ws.receive_msg()) == {"channel": "level2", "n": 1}
+    with pytest.raises(EmxApiTimeoutException):
+        ws.receive_msg()
+    assert len(ws.sockets) == 2
+
+
+def test_close_frame_reconnects_after_failed_attempts():
+    ws = FakeWebSocketApi("key", API_SECRET, auto_reconnect=True, max_backoff=0.01, failures=2)
+    _subscribed(ws)
+    ws.ws.frames.append((ABNF.OPCODE_CLOSE, b""))
+    assert json.loads(ws.receive_msg())["type"] == "resynced"
+    assert len(ws.sockets) == 2 and len(ws.ws.sent) == 2
+
+
+def test_missing_pong_reconnects():
+    ws = FakeWebSocketApi("key", API_SECRET, auto_reconnect=True, pong_timeout=0, max_backoff=0.01)
+    _subscribed(ws)
+    # The first timeout only probes the connection
+    with pytest.raises(EmxApiTimeoutException):
+        ws.receive_msg()
+    assert ws.ws.pings == 1
+    assert json.loads(ws.receive_msg())["type"] == "resynced"
+    assert len(ws.sockets) == 2
+
+
+def test_pong_keeps_the_connection():
+    ws = FakeWebSocketApi("key", API_SECRET, auto_reconnect=True, pong_timeout=0, max_backoff=0.01)
+    with pytest.raises(EmxApiTimeoutException):
+        ws.receive_msg()
+    ws.ws.frames.append((ABNF.OPCODE_PONG, b""))
+    ws.ws.push({"n": 1})
+    assert json.loads(ws.receive_msg()) == {"n": 1}
+    assert len(ws.sockets) == 1
+
+
+def test_gives_up_after_max_retries():
+    ws = FakeWebSocketApi("key", API_SECRET, auto_reconnect=True, max_backoff=0.01, max_retries=2,
+                          failures=5)
+    ws.ws.frames.append(WebSocketConnectionClosedException("reset"))
+    with pytest.raises(EmxApiException):
+        ws.receive_msg()
@@ -0,0 +1,103 @@
+import json
+import socket
+import pytest
+import websocket
+from websocket import ABNF
+import emx.ws_manager
+from emx.ws_api import WebSocketApi
+from emx.ws_manager import WebSocketManager
+
+API_SECRET = "c2VjcmV0"
+
+
+class PairWebSocketApi(WebSocketApi):
+    """Connects to the client end of a socketpair; the test writes frames to
+    the server end kept in ``peers``."""
+
+    peers = []
+
+    def _connect(self):
+        client, server = socket.socketpair()
+        ws = websocket.WebSocket()
+        ws.sock = client
+        ws.connected = True
+        client.settimeout(self.timeout)
+        self.peers.append(server)
+        return ws
+
+
+def _frame(msg):
+    return ABNF.create_frame(json.dumps(msg), ABNF.OPCODE_TEXT).format()
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    PairWebSocketApi.peers = []
+    monkeypatch.setattr(emx.ws_manager, "WebSocketApi", PairWebSocketApi)
+    manager = WebSocketManager("key", API_SECRET, timeout=1, max_backoff=0.01)
+    yield manager
+    # Closed peers let the close handshake fail fast
+    for peer in PairWebSocketApi.peers:
+        peer.close()
+    manager.close()
+
+
+def _peer(manager, shard):
+    index = list(manager.connections).index(shard)
+    return PairWebSocketApi.peers[index]
+
+
+def test_dispatch_across_shards_serves_priority_first(manager):
+    manager.subscribe(["BTCZ18"], ["level2", "orders", "ticker"])
+    assert sorted(manager.connections) == ["level2", "private", "public"]
+    assert manager.subscriptions == {"level2": {"BTCZ18"}, "orders": {"BTCZ18"}, "ticker": {"BTCZ18"}}
+
+    _peer(manager, "level2").sendall(_frame({"channel": "level2", "n": 1}))
+    _peer(manager, "public").sendall(_frame({"channel": "ticker", "n": 2}))
+    _peer(manager, "private").sendall(_frame({"channel": "orders", "n": 3}))
+    received = []
+    while len(received) < 3:
+        shard, msg = manager.receive()
+        received.append((shard, json.loads(msg)["n"]))
+    # All three were readable together, the private shard goes first
+    assert received[0] == ("private", 3)
+    assert sorted(received) == [("level2", 1), ("private", 3), ("public", 2)]
+
+
+def test_partial_frame_does_not_stall_other_shards(manager):
+    manager.subscribe(["BTCZ18"], ["level2", "orders"])
+    frame = _frame({"channel": "level2", "n": 1})
+    _peer(manager, "level2").sendall(frame[:5])
+    _peer(manager, "private").sendall(_frame({"channel": "orders", "n": 2}))
+
+    assert manager.receive()[0] == "private"
+    # The rest of the frame completes the buffered part
+    _peer(manager, "level2").sendall(frame[5:])
+    shard, msg = manager.receive()
+    assert shard == "level2" and json.loads(msg)["n"] == 1
+
+
+def test_dropped_shard_reconnects_and_resyncs(monkeypatch):
+    PairWebSocketApi.peers = []
+    monkeypatch.setattr(emx.ws_manager, "WebSocketApi", PairWebSocketApi)
+    manager = WebSocketManager("key", API_SECRET, timeout=1, auto_reconnect=True, max_backoff=0.01)
+    try:
+        manager.subscribe(["BTCZ18"], ["level2", "orders"])
+        _peer(manager, "level2").close()
+
+        shard, msg = manager.receive()
+        assert shard == "level2"
+        assert json.loads(msg) == {"type": "resynced",
+                                   "channels": [{"name": "level2", "contract_codes": ["BTCZ18"]}]}
+        # The new connection replayed its subscription and is served by the selector
+        new_peer = PairWebSocketApi.peers[-1]
+        assert len(PairWebSocketApi.peers) == 3
+        new_peer.sendall(_frame({"channel": "level2", "n": 1}))
+        assert manager.receive() == ("level2", json.dumps({"channel": "level2", "n": 1}))
+        # The other shard was not touched
+        _peer(manager, "private").sendall(_frame({"channel": "orders", "n": 2}))
+        assert manager.receive()[0] == "private"
+    finally:
+        for peer in PairWebSocketApi.peers:
+            peer.close()
+        manager.close()
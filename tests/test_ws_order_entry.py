@@ -0,0 +1,126 @@
+import json
+import time
+import pytest
+from websocket import WebSocketTimeoutException
+from emx.risk import RiskChecker
+from emx.utils import EmxApiException, EmxApiTimeoutException, EmxOrderRejectedException, EmxRiskCheckException
+from emx.ws_api import WebSocketApi
+
+API_SECRET = "c2VjcmV0"
+
+
+class FakeSocket():
+    def __init__(self):
+        self.sent = []
+        self.frames = []
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def recv(self):
+        if not self.frames:
+            raise WebSocketTimeoutException()
+        return self.frames.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeWebSocketApi(WebSocketApi):
+    def _connect(self):
+        return FakeSocket()
+
+    def push(self, msg):
+        self.ws.frames.append(json.dumps(msg))
+        return self.receive_msg()
+
+
+def _event(msg_type, **data):
+    return {"channel": "orders", "type": msg_type, "contract_code": "BTCZ18", "data": data}
+
+
+def test_create_resolved_by_client_id():
+    ws = FakeWebSocketApi("key", API_SECRET)
+    future = ws.create_new_order("BTCZ18", "limit", "buy", "1", client_id="c1", price="100")
+    assert ws.ws.sent[0]["action"] == "create-order"
+    ws.push(_event("accepted", order_id="O1", client_id="c1"))
+    assert future.result(0)["order_id"] == "O1"
+
+
+def test_modify_and_cancel_wait_for_their_own_event():
+    ws = FakeWebSocketApi("key", API_SECRET)
+    modify = ws.modify_order("O1", "limit", "buy", "1", order_price="101")
+    ws.push(_event("filled", order_id="O1", fill_size="1"))
+    assert not modify.done()
+    ws.push(_event("modified", order_id="O1", price="101"))
+    assert modify.result(0)["price"] == "101"
+
+    cancel = ws.cancel_order("O1")
+    ws.push(_event("modified", order_id="O1"))
+    assert not cancel.done()
+    ws.push(_event("canceled", order_id="O1"))
+    assert cancel.result(0)["order_id"] == "O1"
+
+
+def test_rejections_and_anonymous_errors():
+    ws = FakeWebSocketApi("key", API_SECRET)
+    rejected = ws.cancel_order("O1")
+    ws.push(_event("cancel-rejected", order_id="O1", message="Too late"))
+    with pytest.raises(EmxOrderRejectedException):
+        rejected.result(0)
+
+    first = ws.cancel_order("O2")
+    second = ws.cancel_order("O3")
+    ws.push({"type": "error", "message": "Invalid request"})
+    with pytest.raises(EmxOrderRejectedException):
+        first.result(0)
+    assert not second.done()
+
+
+def test_unacknowledged_requests_time_out():
+    ws = FakeWebSocketApi("key", API_SECRET, order_timeout=0.05)
+    future = ws.cancel_order("O1")
+    time.sleep(0.06)
+    with pytest.raises(EmxApiTimeoutException):
+        ws.receive_msg()
+    with pytest.raises(EmxApiTimeoutException):
+        future.result(0)
+    assert not ws._pending_orders
+
+    future = ws.cancel_order("O2")
+    ws.close()
+    with pytest.raises(EmxApiException):
+        future.result(0)
+
+
+def test_rejected_order_releases_risk_reservation():
+    risk = RiskChecker(max_position=1)
+    ws = FakeWebSocketApi("key", API_SECRET, risk=risk)
+    future = ws.create_new_order("BTCZ18", "limit", "buy", "1", client_id="c1", price="100")
+    assert isinstance(ws.create_new_order("BTCZ18", "limit", "buy", "1", price="100").exception(0),
+                      EmxRiskCheckException)
+    ws.push(_event("rejected", client_id="c1", message="post only"))
+    assert isinstance(future.exception(0), EmxOrderRejectedException)
+
+    ws.create_new_order("BTCZ18", "limit", "buy", "1", client_id="c2", price="100")
+    ws.push(_event("accepted", order_id="O2", client_id="c2"))
+    risk.on_message(_event("canceled", order_id="O2", client_id="c2"))
+    assert not ws.create_new_order("BTCZ18", "limit", "buy", "1", client_id="c3", price="100").done()
+
+
+def test_resynced_message_is_not_recorded():
+    class FakeRecorder():
+        def __init__(self):
+            self.frames = []
+
+        def record(self, frame):
+            self.frames.append(frame)
+
+    recorder = FakeRecorder()
+    ws = FakeWebSocketApi("key", API_SECRET, recorder=recorder)
+    assert '"resynced"' in ws.reconnect()
+    ws.push({"channel": "trade", "contract_code": "BTCZ18", "data": {}})
+    assert len(recorder.frames) == 1 and '"trade"' in recorder.frames[0]